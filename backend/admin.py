@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken, UploadFiles
+    Contact, ConfirmEmailToken, UploadFiles, ImportJob, FacetCount, CatalogEntry
 
 
 @admin.register(User)
@@ -75,4 +75,19 @@ class ConfirmEmailTokenAdmin(admin.ModelAdmin):
 
 @admin.register(UploadFiles)
 class UploadFilesAdmin(admin.ModelAdmin):
-    pass
\ No newline at end of file
+    pass
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'url', 'mode', 'state', 'rows', 'created_at', 'finished_at',)
+
+
+@admin.register(FacetCount)
+class FacetCountAdmin(admin.ModelAdmin):
+    list_display = ('shop', 'category', 'parameter', 'value', 'count',)
+
+
+@admin.register(CatalogEntry)
+class CatalogEntryAdmin(admin.ModelAdmin):
+    list_display = ('product_info', 'shop_name', 'product_name', 'model', 'price', 'quantity', 'visible',)
@@ -8,4 +8,11 @@ class BackendConfig(AppConfig):
     def ready(self):
         """
         импортируем сигналы
-        """
\ No newline at end of file
+        """
+        from django.db.models.signals import post_migrate
+        from backend.search import create_search_index
+        # Полнотекстовый индекс товаров (зависит от БД, поэтому создаётся не моделью, а после migrate)
+        post_migrate.connect(create_search_index, sender=self)
+        from backend.catalog_cache import check_shared_cache
+        # Кэш ответов каталога в памяти процесса не видит изменений из celery - не запускаемся с таким кэшем
+        check_shared_cache()
@@ -0,0 +1,218 @@
+# backend/basket.py
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from backend.catalog_cache import bump_catalog_version
+from backend.models import Order, OrderItem, ProductInfo, CatalogEntry, Contact
+
+# Статусы заказа, в которых товары заказа зарезервированы (списаны с остатка ProductInfo.quantity)
+# и покупатель может отменить заказ
+RESERVED_STATES = ('new', 'confirmed', 'assembled')
+
+
+class BasketError(ValueError):
+    """
+    Ошибка в позициях корзины из запроса (ничего не записано)
+    """
+
+
+class StockError(BasketError):
+    """
+    Товаров заказа не хватает на складе (заказ не оформлен), product_info_ids - id таких товаров
+    """
+
+    def __init__(self, product_info_ids):
+        self.product_info_ids = product_info_ids
+        super().__init__(f'Недостаточно товара на складе: {", ".join(map(str, product_info_ids))}')
+
+
+def refresh_totals(order_ids):
+    """
+    Пересчитывает сумму и кол-во позиций заказов order_ids (корзин) одним запросом UPDATE
+    """
+    items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    Order.objects.filter(id__in=order_ids).update(
+        total_sum=Coalesce(Subquery(items.annotate(total=Sum(F('quantity') * F('product_info__price'))).values(
+            'total')), 0),
+        items_count=Coalesce(Subquery(items.annotate(count=Count('id')).values('count')), 0))
+
+
+def basket_ids(product_infos):
+    """
+    id корзин (заказов в статусе basket) с товарами product_infos (список id или queryset ProductInfo).
+    Нужны до удаления товаров: позиции корзин удаляются вместе с ними, суммы корзин пересчитывает refresh_totals
+    """
+    return list(OrderItem.objects.filter(product_info__in=product_infos, order__state='basket').order_by()
+                .values_list('order_id', flat=True).distinct())
+
+
+def to_int(value):
+    """
+    Целое число из запроса: число или строка из цифр (формы и multipart присылают строки), иначе ValueError.
+    bool - не число.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    return int(value)
+
+
+def parse_items(items, key='product_info', merge=True):
+    """
+    Позиции корзины из запроса (список словарей {key: id, 'quantity': кол-во}) в виде {id: кол-во}.
+    Одинаковые id складываются (merge=False - берётся последнее кол-во, кол-во 0 допустимо).
+    Ошибка в любой позиции - BasketError.
+    """
+    if not isinstance(items, list) or not items:
+        raise BasketError('Неверный формат запроса')
+    quantities = {}
+    for number, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise BasketError(f'items[{number}]: позиция должна быть объектом')
+        try:
+            item_id, quantity = to_int(item.get(key)), to_int(item.get('quantity'))
+        except ValueError:
+            raise BasketError(f'items[{number}]: {key} и quantity должны быть целыми числами')
+        if quantity < 0 or merge and quantity == 0:
+            raise BasketError(f'items[{number}]: quantity должно быть больше 0' if merge else
+                              f'items[{number}]: quantity не может быть отрицательным')
+        quantities[item_id] = quantities.get(item_id, 0) + quantity if merge else quantity
+    return quantities
+
+
+def add_items(user_id, quantities):
+    """
+    Добавляет товары {id ProductInfo: кол-во} в корзину пользователя одной транзакцией:
+    товары проверяются одним запросом, кол-во товаров, которые уже есть в корзине, увеличивается (bulk_update),
+    новые позиции создаются одним bulk_create. Возвращает (кол-во созданных, кол-во изменённых позиций).
+    Кол-во запросов не зависит от кол-ва позиций.
+    """
+    with transaction.atomic():
+        # В корзину можно положить только товар из опубликованного каталога магазина
+        found = set(ProductInfo.objects.published().filter(id__in=quantities).values_list('id', flat=True))
+        missing = sorted(set(quantities) - found)
+        if missing:
+            raise BasketError(f'Товары не найдены: {", ".join(map(str, missing))}')
+        # Блокировка корзины: параллельные запросы того же пользователя добавляют товары по очереди
+        basket, _ = Order.objects.select_for_update().get_or_create(user_id=user_id, state='basket')
+        existing = list(OrderItem.objects.filter(order_id=basket.id, product_info_id__in=quantities))
+        for item in existing:
+            item.quantity += quantities[item.product_info_id]
+        OrderItem.objects.bulk_update(existing, ['quantity'])
+        added = {item.product_info_id for item in existing}
+        created = OrderItem.objects.bulk_create(
+            [OrderItem(order_id=basket.id, product_info_id=product_info_id, quantity=quantity)
+             for product_info_id, quantity in quantities.items() if product_info_id not in added])
+        refresh_totals([basket.id])
+    return len(created), len(existing)
+
+
+def update_items(user_id, quantities):
+    """
+    Меняет кол-во в позициях корзины пользователя {id OrderItem: кол-во} одной транзакцией:
+    все кол-ва - одним UPDATE ... SET quantity = CASE id WHEN ... END, позиции с кол-вом 0 удаляются.
+    Возвращает результат по каждой позиции: {id: 'updated' | 'deleted' | 'not_found'}.
+    """
+    results = dict.fromkeys(quantities, 'not_found')
+    with transaction.atomic():
+        basket = Order.objects.select_for_update().filter(user_id=user_id, state='basket').first()
+        if basket is None:
+            return results
+        items = OrderItem.objects.filter(order_id=basket.id)
+        found = set(items.filter(id__in=quantities).values_list('id', flat=True))
+        to_update = {item_id: quantity for item_id, quantity in quantities.items() if item_id in found and quantity}
+        to_delete = [item_id for item_id, quantity in quantities.items() if item_id in found and not quantity]
+        if to_update:
+            items.filter(id__in=to_update).update(quantity=Case(
+                *(When(id=item_id, then=Value(quantity)) for item_id, quantity in to_update.items()),
+                default=F('quantity'), output_field=IntegerField()))
+        if to_delete:
+            items.filter(id__in=to_delete).delete()
+        if to_update or to_delete:
+            refresh_totals([basket.id])
+    results.update(dict.fromkeys(to_update, 'updated'))
+    results.update(dict.fromkeys(to_delete, 'deleted'))
+    return results
+
+
+def delete_items(user_id, item_ids):
+    """
+    Удаляет позиции корзины пользователя (id OrderItem), возвращает кол-во удалённых позиций
+    """
+    with transaction.atomic():
+        basket = Order.objects.select_for_update().filter(user_id=user_id, state='basket').first()
+        if basket is None:
+            return 0
+        deleted = OrderItem.objects.filter(order_id=basket.id, id__in=item_ids).delete()[0]
+        if deleted:
+            refresh_totals([basket.id])
+    return deleted
+
+
+def change_stock(items, sign):
+    """
+    Меняет остатки товаров: items - пары (id ProductInfo, кол-во), sign=-1 - резерв, 1 - возврат резерва.
+    Остатки меняются по одному товару в порядке id: строки товаров блокируются до конца транзакции
+    всегда в одном порядке, поэтому параллельные заказы с общими товарами ждут друг друга, а не взаимоблокируются.
+    Резерв - условный UPDATE (quantity >= кол-во), поэтому остаток не уходит в минус.
+    Возвращает id товаров, которых не хватило.
+    """
+    short = []
+    for product_info_id, quantity in sorted(items):
+        products = ProductInfo.objects.filter(id=product_info_id)
+        if sign < 0:
+            products = products.filter(quantity__gte=quantity)
+        if not products.update(quantity=F('quantity') + sign * quantity):
+            short.append(product_info_id)
+    # Остатки в каталоге для покупателей
+    product_info_ids = [product_info_id for product_info_id, _ in items]
+    CatalogEntry.objects.filter(product_info_id__in=product_info_ids).update(quantity=Subquery(
+        ProductInfo.objects.filter(id=OuterRef('product_info_id')).values('quantity')[:1]))
+    shop_ids = set(ProductInfo.objects.filter(id__in=product_info_ids).values_list('shop_id', flat=True))
+    transaction.on_commit(lambda: bump_catalog_version(shop_ids))
+    return short
+
+
+def checkout(user_id, order_id, contact_id):
+    """
+    Оформление заказа из корзины одной транзакцией: товары резервируются (списываются с остатка),
+    корзина становится заказом в статусе new. Если какого-то товара не хватает - StockError и ничего не меняется.
+    Сумма и кол-во позиций заказа фиксируются по текущим ценам товаров.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(id=order_id, user_id=user_id, state='basket').first()
+        if order is None:
+            raise BasketError('Корзина не найдена')
+        if not Contact.objects.filter(id=contact_id, user_id=user_id).exists():
+            raise BasketError('Контакт не найден')
+        items = list(OrderItem.objects.filter(order_id=order.id).values_list('product_info_id', 'quantity'))
+        if not items:
+            raise BasketError('Корзина пуста')
+        short = change_stock(items, -1)
+        if short:
+            raise StockError(short)
+        totals = OrderItem.objects.filter(order_id=order.id).aggregate(
+            total_sum=Sum(F('quantity') * F('product_info__price')), items_count=Count('id'))
+        order.state, order.contact_id, order.reserved_at = 'new', contact_id, timezone.now()
+        order.total_sum, order.items_count = totals['total_sum'], totals['items_count']
+        order.save(update_fields=['state', 'contact', 'reserved_at', 'total_sum', 'items_count'])
+    return order
+
+
+def cancel_order(user_id, order_id):
+    """
+    Отмена заказа пользователя: резерв товаров возвращается на склад. Возвращает True, если заказ отменён.
+    Заказы, оформленные до появления резерва (reserved_at пусто), отменяются без возврата товаров на склад.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(
+            id=order_id, user_id=user_id, state__in=RESERVED_STATES).first()
+        if order is None:
+            return False
+        if order.reserved_at is not None:
+            change_stock(list(OrderItem.objects.filter(order_id=order.id).values_list(
+                'product_info_id', 'quantity')), 1)
+        order.state, order.reserved_at = 'canceled', None
+        order.save(update_fields=['state', 'reserved_at'])
+    return True
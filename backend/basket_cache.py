@@ -0,0 +1,278 @@
+# backend/basket_cache.py
+from contextlib import contextmanager
+from time import sleep
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from backend.basket import BasketError, checkout as checkout_basket, refresh_totals
+from backend.fast_serializers import format_datetime, product_infos_data
+from backend.models import Order, OrderItem, ProductInfo
+
+# Корзины покупателей в общем кэше (redis), включаются настройкой BASKET_CACHE.
+# Запросы к корзине (BasketView) читают и меняют корзину в кэше: позиции корзины и данные товаров (с ценами)
+# на момент добавления в корзину. В БД (Order/OrderItem) корзина сохраняется отложенно (write-behind):
+# задачей celery flush_basket_task не чаще раза в BASKET_FLUSH_DELAY секунд и перед оформлением заказа.
+# id позиции корзины - id OrderItem, как и без кэша: строка OrderItem новой позиции создаётся сразу при добавлении
+# товара (один INSERT на запрос), отложенно пишутся изменения кол-ва и удаление позиций.
+# Сумма корзины - по ценам из кэша, сумма заказа считается по ценам из БД при оформлении.
+BASKET_KEY = 'basket:{}'
+# Метка "сохранение корзины в БД уже запланировано"
+FLUSH_KEY = 'basket:flush:{}'
+LOCK_KEY = 'basket:lock:{}'
+# Блокировка корзины снимается сама через LOCK_TIMEOUT секунд (если процесс упал, не сняв её)
+LOCK_TIMEOUT = 10
+LOCK_ATTEMPTS = 200
+
+
+@contextmanager
+def basket_lock(user_id):
+    """
+    Блокировка корзины пользователя в кэше: параллельные запросы одного пользователя меняют корзину по очереди
+    """
+    key = LOCK_KEY.format(user_id)
+    for _ in range(LOCK_ATTEMPTS):
+        if cache.add(key, 1, LOCK_TIMEOUT):
+            break
+        sleep(0.01)
+    else:
+        raise BasketError('Корзина изменяется другим запросом, повторите запрос')
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def load_basket(user_id):
+    """
+    Корзина пользователя из кэша, если её там нет - из БД (и она кладётся в кэш).
+    Корзина - словарь: order_id и dt - корзина в Order (None, если её ещё нет в БД),
+    items - {id товара: {'id': id OrderItem, 'quantity': кол-во, 'product_info': товар в виде ProductInfoSerializer}}
+    """
+    basket = cache.get(BASKET_KEY.format(user_id))
+    if basket is None:
+        order = Order.objects.filter(user_id=user_id, state='basket').values('id', 'dt').first()
+        rows = list(OrderItem.objects.filter(order_id=order['id']).order_by('id').values_list(
+            'id', 'product_info_id', 'quantity')) if order else []
+        product_infos = product_infos_data([row[1] for row in rows]) if rows else {}
+        basket = {'order_id': order['id'] if order else None,
+                  'dt': format_datetime(order['dt']) if order else None,
+                  'items': {product_info_id: {'id': item_id, 'quantity': quantity,
+                                              'product_info': product_infos[product_info_id]}
+                            for item_id, product_info_id, quantity in rows}}
+        save_basket(user_id, basket)
+    return basket
+
+
+def save_basket(user_id, basket):
+    cache.set(BASKET_KEY.format(user_id), basket, settings.BASKET_CACHE_TIMEOUT)
+
+
+def schedule_flush(user_id):
+    """
+    Планирует сохранение корзины в БД через BASKET_FLUSH_DELAY секунд, если оно ещё не запланировано
+    """
+    # Импорт здесь: backend.tasks импортирует этот модуль
+    from backend.tasks import flush_basket_task
+    # Метка живёт дольше задержки: если задача потеряется, корзина сохранится после следующего изменения
+    if cache.add(FLUSH_KEY.format(user_id), 1, settings.BASKET_FLUSH_DELAY * 10):
+        flush_basket_task.apply_async((user_id,), countdown=settings.BASKET_FLUSH_DELAY)
+
+
+def basket_data(user_id):
+    """
+    Корзина пользователя в виде ответа BasketView.get (как OrderSerializer(many=True)) без запросов к БД
+    """
+    basket = load_basket(user_id)
+    if basket['order_id'] is None:
+        return []
+    items = basket['items']
+    # Позиции - по id, как при чтении корзины из БД
+    return [{'id': basket['order_id'],
+             'ordered_items': [{'id': line['id'], 'product_info': line['product_info'], 'quantity': line['quantity']}
+                               for line in sorted(items.values(), key=lambda line: line['id'])],
+             'state': 'basket',
+             'dt': basket['dt'],
+             'total_sum': sum(line['quantity'] * line['product_info']['price'] for line in items.values()),
+             'items_count': len(items),
+             'contact': None}]
+
+
+def add_items(user_id, quantities):
+    """
+    Добавляет товары {id ProductInfo: кол-во} в корзину в кэше (как basket.add_items):
+    товары проверяются по опубликованному каталогу, данные новых товаров кладутся в корзину.
+    У новых позиций сразу создаются строки OrderItem (их id - id позиций корзины), кол-во в них пишется отложенно.
+    Возвращает (кол-во новых, кол-во изменённых позиций).
+    """
+    found = set(ProductInfo.objects.published().filter(id__in=quantities).values_list('id', flat=True))
+    missing = sorted(set(quantities) - found)
+    if missing:
+        raise BasketError(f'Товары не найдены: {", ".join(map(str, missing))}')
+    with basket_lock(user_id):
+        basket = load_basket(user_id)
+        items = basket['items']
+        new_ids = [product_info_id for product_info_id in quantities if product_info_id not in items]
+        product_infos = product_infos_data(new_ids) if new_ids else {}
+        if basket['order_id'] is None:
+            # Корзина в Order создаётся один раз, её id нужен для оформления заказа
+            order, _ = Order.objects.get_or_create(user_id=user_id, state='basket')
+            basket['order_id'], basket['dt'] = order.id, format_datetime(order.dt)
+        item_ids = create_items(basket['order_id'], {product_info_id: quantities[product_info_id]
+                                                     for product_info_id in new_ids}) if new_ids else {}
+        for product_info_id, quantity in quantities.items():
+            if product_info_id in items:
+                items[product_info_id]['quantity'] += quantity
+            else:
+                items[product_info_id] = {'id': item_ids[product_info_id], 'quantity': quantity,
+                                          'product_info': product_infos[product_info_id]}
+        save_basket(user_id, basket)
+    schedule_flush(user_id)
+    return len(new_ids), len(quantities) - len(new_ids)
+
+
+def create_items(order_id, quantities):
+    """
+    Создаёт строки OrderItem новых позиций корзины {id товара: кол-во} одним bulk_create,
+    возвращает {id товара: id OrderItem}.
+    Строка могла остаться в БД от позиции, удалённой из корзины в кэше до сохранения корзины, - она используется снова.
+    """
+    with transaction.atomic():
+        item_ids = dict(OrderItem.objects.filter(order_id=order_id, product_info_id__in=quantities).values_list(
+            'product_info_id', 'id'))
+        created = OrderItem.objects.bulk_create([
+            OrderItem(order_id=order_id, product_info_id=product_info_id, quantity=quantity)
+            for product_info_id, quantity in quantities.items() if product_info_id not in item_ids])
+        item_ids.update({item.product_info_id: item.id for item in created})
+        refresh_totals([order_id])
+    return item_ids
+
+
+def line_ids(basket):
+    """
+    {id позиции корзины (OrderItem): id товара} корзины в кэше
+    """
+    return {line['id']: product_info_id for product_info_id, line in basket['items'].items()}
+
+
+def update_items(user_id, quantities):
+    """
+    Меняет кол-во в позициях корзины в кэше {id позиции (OrderItem): кол-во}, кол-во 0 удаляет позицию.
+    Возвращает результат по каждой позиции: {id: 'updated' | 'deleted' | 'not_found'}.
+    """
+    results = {}
+    with basket_lock(user_id):
+        basket = load_basket(user_id)
+        items = basket['items']
+        product_info_ids = line_ids(basket)
+        for item_id, quantity in quantities.items():
+            product_info_id = product_info_ids.get(item_id)
+            if product_info_id not in items:
+                results[item_id] = 'not_found'
+            elif quantity:
+                items[product_info_id]['quantity'] = quantity
+                results[item_id] = 'updated'
+            else:
+                del items[product_info_id]
+                results[item_id] = 'deleted'
+        save_basket(user_id, basket)
+    schedule_flush(user_id)
+    return results
+
+
+def delete_items(user_id, item_ids):
+    """
+    Удаляет позиции (id OrderItem) из корзины в кэше, возвращает кол-во удалённых позиций
+    """
+    with basket_lock(user_id):
+        basket = load_basket(user_id)
+        product_info_ids = line_ids(basket)
+        deleted = [item_id for item_id in item_ids
+                   if basket['items'].pop(product_info_ids.get(item_id), None) is not None]
+        save_basket(user_id, basket)
+    if deleted:
+        schedule_flush(user_id)
+    return len(deleted)
+
+
+def drop_missing(user_id, basket):
+    """
+    Удаляет из корзины в кэше товары, которых больше нет в опубликованном каталоге
+    (например, загрузка прайса с заменой удалила их и создала товары заново), возвращает id удалённых товаров
+    """
+    product_info_ids = list(basket['items'])
+    found = set(ProductInfo.objects.published().filter(id__in=product_info_ids).values_list(
+        'id', flat=True)) if product_info_ids else set()
+    missing = sorted(set(product_info_ids) - found)
+    if missing:
+        for product_info_id in missing:
+            del basket['items'][product_info_id]
+        save_basket(user_id, basket)
+    return missing
+
+
+def write_basket(basket):
+    """
+    Записывает корзину из кэша в OrderItem: лишние позиции удаляются, изменённые - bulk_update, новые - bulk_create.
+    Корзина, которая уже стала заказом, не меняется.
+    """
+    if basket is None or basket['order_id'] is None:
+        return False
+    quantities = {product_info_id: line['quantity'] for product_info_id, line in basket['items'].items()}
+    with transaction.atomic():
+        if not Order.objects.select_for_update().filter(id=basket['order_id'], state='basket').exists():
+            return False
+        items = OrderItem.objects.filter(order_id=basket['order_id'])
+        items.exclude(product_info_id__in=quantities).delete()
+        existing = {item.product_info_id: item for item in items.filter(product_info_id__in=quantities)}
+        changed = []
+        for product_info_id, item in existing.items():
+            if item.quantity != quantities[product_info_id]:
+                item.quantity = quantities[product_info_id]
+                changed.append(item)
+        OrderItem.objects.bulk_update(changed, ['quantity'])
+        # Строки новых позиций создаются при добавлении товара, здесь - только если строку удалили в обход корзины;
+        # её новый id записывается в позицию корзины
+        created = OrderItem.objects.bulk_create([
+            OrderItem(order_id=basket['order_id'], product_info_id=product_info_id, quantity=quantity)
+            for product_info_id, quantity in quantities.items() if product_info_id not in existing])
+        for item in created:
+            basket['items'][item.product_info_id]['id'] = item.id
+        refresh_totals([basket['order_id']])
+    return True
+
+
+def flush_basket(user_id):
+    """
+    Сохраняет корзину пользователя из кэша в БД (задача flush_basket_task),
+    товары, которых больше нет в каталоге, удаляются из корзины
+    """
+    # Метка снимается до чтения корзины: изменение после чтения запланирует новое сохранение
+    cache.delete(FLUSH_KEY.format(user_id))
+    with basket_lock(user_id):
+        basket = cache.get(BASKET_KEY.format(user_id))
+        if basket is None:
+            return False
+        drop_missing(user_id, basket)
+        written = write_basket(basket)
+        save_basket(user_id, basket)
+        return written
+
+
+def checkout(user_id, order_id, contact_id):
+    """
+    Оформление заказа из корзины в кэше: корзина сохраняется в БД, оформляется (basket.checkout)
+    и удаляется из кэша. Пока заказ оформляется, корзина заблокирована.
+    Если каких-то товаров корзины больше нет в каталоге, они удаляются из корзины, заказ не оформляется
+    (BasketError со списком этих товаров), покупатель видит обновлённую корзину.
+    """
+    with basket_lock(user_id):
+        basket = cache.get(BASKET_KEY.format(user_id))
+        missing = drop_missing(user_id, basket) if basket is not None else []
+        write_basket(basket)
+        if missing:
+            raise BasketError(f'Товары не найдены (удалены из корзины): {", ".join(map(str, missing))}')
+        order = checkout_basket(user_id, order_id, contact_id)
+        cache.delete(BASKET_KEY.format(user_id))
+    return order
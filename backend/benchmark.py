@@ -0,0 +1,182 @@
+# backend/benchmark.py
+import io
+import json
+import platform
+import resource
+import subprocess
+import sys
+from datetime import datetime
+from random import Random
+from time import perf_counter
+
+from django.db import connection
+
+from backend.basket import refresh_totals
+from backend.fast_serializers import catalog_entry_columns, catalog_entries_data, product_infos_data, orders_data
+from backend.importer import PriceListImporter
+from backend.models import User, ProductInfo, CatalogEntry, Order, OrderItem
+from backend.price_list import read_price_list
+from backend.serializers import CatalogEntrySerializer, ProductInfoSerializer, OrderSerializer
+
+# Внешние ИД товаров сгенерированного прайса начинаются с этого числа
+EXTERNAL_ID_START = 100000000
+
+# Изменение скорости загрузки (в долях), после которого compare_results отмечает регрессию
+REGRESSION_THRESHOLD = 0.1
+
+
+def dump(value):
+    """
+    Скаляр для yaml: строка в формате json является строкой yaml в двойных кавычках
+    """
+    return json.dumps(value, ensure_ascii=False)
+
+
+def generate_price_list(stream, goods=1000, categories=10, parameters=20, values=50, item_parameters=4,
+                        shop='Benchmark', seed=0):
+    """
+    Пишет в текстовый поток stream прайс магазина в формате yaml (как media/files/*.yaml):
+    goods товаров в categories категориях, parameters разных параметров с values значениями у каждого,
+    у товара item_parameters параметров. Файл пишется построчно, поэтому размер прайса не ограничен памятью.
+    Одинаковый seed даёт одинаковый прайс.
+    """
+    random = Random(seed)
+    names = [f'Параметр {number}' for number in range(1, parameters + 1)]
+    item_parameters = min(item_parameters, parameters)
+    write = stream.write
+    write(f'shop: {dump(shop)}\ncategories:\n')
+    for category_id in range(1, categories + 1):
+        write(f'  - id: {category_id}\n    name: {dump(f"Категория {category_id}")}\n')
+    write('\ngoods:\n')
+    for number in range(goods):
+        price = random.randint(100, 200000)
+        write(f'  - id: {EXTERNAL_ID_START + number}\n'
+              f'    category: {random.randint(1, categories)}\n'
+              f'    model: {dump(f"model/{number % 1000}")}\n'
+              f'    name: {dump(f"Товар {number}")}\n'
+              f'    price: {price}\n'
+              f'    price_rrc: {price + price // 10}\n'
+              f'    quantity: {random.randint(0, 100)}\n')
+        if not item_parameters:
+            write('    parameters: {}\n')
+            continue
+        write('    parameters:\n')
+        for name in random.sample(names, item_parameters):
+            write(f'      {dump(name)}: {dump(f"значение {random.randrange(values)}")}\n')
+
+
+def peak_rss_mb():
+    """
+    Пиковый объём памяти процесса (RSS) в Мб (ru_maxrss в Linux - в Кб)
+    """
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_case(path, batch_size=None):
+    """
+    Замер загрузки прайса path в текущую БД: первая загрузка (replace) и повторная загрузка
+    того же прайса в режиме sync (без изменений). Возвращает статистику PriceListImporter обеих загрузок.
+    """
+    user, _ = User.objects.get_or_create(email='benchmark@example.com',
+                                         defaults={'username': 'benchmark', 'type': 'shop'})
+    options = {'batch_size': batch_size} if batch_size else {}
+    result = {}
+    for mode in ('replace', 'sync'):
+        with open(path, 'rb') as file:
+            result[mode] = PriceListImporter(user.id, mode=mode, **options).run(read_price_list(file))
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_case_process(path, batch_size=None):
+    """
+    Запускает run_case в отдельном процессе (команда benchmark_import --case) на тестовой БД:
+    так пиковый RSS относится к одной загрузке, а рабочая БД не затрагивается.
+    """
+    command = [sys.executable, '-m', 'django', 'benchmark_import', '--case', str(path)]
+    if batch_size:
+        command += ['--batch-size', str(batch_size)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def environment():
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu': platform.processor()}
+
+
+def compare_results(old, new):
+    """
+    Сравнивает результаты двух запусков бенчмарка (по кол-ву товаров и режиму загрузки),
+    возвращает строки отчёта: скорость загрузки, кол-во запросов и пиковый RSS.
+    """
+    old_cases = {case['goods']: case for case in old['cases']}
+    lines = []
+    for case in new['cases']:
+        previous = old_cases.get(case['goods'])
+        if not previous:
+            continue
+        for mode in ('replace', 'sync'):
+            before, after = previous[mode]['rows_per_sec'], case[mode]['rows_per_sec']
+            change = (after - before) / before if before else 0.0
+            mark = ' РЕГРЕССИЯ' if change < -REGRESSION_THRESHOLD else ''
+            lines.append(f"{case['goods']} {mode}: {before} -> {after} товаров/с ({change:+.0%}), "
+                         f"запросов {previous[mode]['queries']} -> {case[mode]['queries']}{mark}")
+        lines.append(f"{case['goods']} пиковый RSS: {previous['peak_rss_mb']} -> {case['peak_rss_mb']} Мб")
+    return lines
+
+
+def best_time(function, repeat):
+    """
+    Лучшее время (с) из repeat запусков function
+    """
+    times = []
+    for _ in range(repeat):
+        started = perf_counter()
+        function()
+        times.append(perf_counter() - started)
+    return round(min(times), 4)
+
+
+def serialization_case(goods=1000, basket_items=100, repeat=5):
+    """
+    Микробенчмарк сериализации для чтения в текущей БД: каталог из goods товаров и корзина из basket_items позиций,
+    сериалайзеры DRF против backend/fast_serializers.py (вместе с запросами к БД).
+    Возвращает лучшее время из repeat запусков обоих вариантов и ускорение.
+    """
+    stream = io.StringIO()
+    generate_price_list(stream, goods=goods, shop='Serialization benchmark')
+    stream.seek(0)
+    user, _ = User.objects.get_or_create(email='serialization-benchmark@example.com',
+                                         defaults={'username': 'serialization-benchmark', 'type': 'shop'})
+    PriceListImporter(user.id).run(read_price_list(stream))
+    shop_infos = ProductInfo.objects.published().filter(shop__user=user)
+    basket = Order.objects.create(user=user, state='basket')
+    OrderItem.objects.bulk_create([OrderItem(order=basket, product_info_id=product_info_id, quantity=1)
+                                   for product_info_id in shop_infos.values_list('id', flat=True)[:basket_items]])
+    refresh_totals([basket.id])
+
+    entries = CatalogEntry.objects.filter(visible=True, shop_id__in=shop_infos.values('shop_id')).order_by('pk')
+    product_infos = shop_infos.order_by('id')
+    orders = Order.objects.filter(id=basket.id)
+    cases = {
+        'products': (lambda: CatalogEntrySerializer(entries.all(), many=True).data,
+                     lambda: catalog_entries_data(entries.values(*catalog_entry_columns()))),
+        'product_infos': (lambda: ProductInfoSerializer(product_infos.select_related('product').prefetch_related(
+                              'product_parameters__parameter'), many=True).data,
+                          lambda: product_infos_data(list(product_infos.values_list('id', flat=True)))),
+        'orders': (lambda: OrderSerializer(orders.prefetch_related(
+                       'ordered_items__product_info__product__category',
+                       'ordered_items__product_info__product_parameters__parameter').select_related('contact'),
+                       many=True).data,
+                   lambda: orders_data(orders)),
+    }
+    result = {}
+    for name, (serializer, fast) in cases.items():
+        serializer_seconds, fast_seconds = best_time(serializer, repeat), best_time(fast, repeat)
+        result[name] = {'serializer': serializer_seconds, 'fast': fast_seconds,
+                        'speedup': round(serializer_seconds / fast_seconds, 1) if fast_seconds else None}
+    return result
@@ -0,0 +1,52 @@
+# backend/catalog.py
+from django.db.models import F
+
+from backend.models import CatalogEntry
+from backend.search import make_search_text
+
+# Каталог для покупателей (CatalogEntry) - копия товаров магазинов в одной таблице для /products.
+# Строки пишет загрузка прайса (PriceListImporter) вместе с товарами, изменения менеджеров
+# пересчитывают их из основных таблиц (refresh_catalog_entries), команда refresh_catalog - весь каталог.
+
+
+def make_entry(product_info_id, shop, product_id, category_id, name, model, price, price_rrc, quantity,
+               parameters, visible=True):
+    """
+    Строка каталога товара, parameters - пары (имя параметра, значение) в порядке вывода
+    """
+    parameters = [{'parameter': parameter, 'value': str(value)} for parameter, value in parameters]
+    return CatalogEntry(product_info_id=product_info_id,
+                        shop_id=shop.id,
+                        shop_name=shop.name,
+                        shop_state=shop.state,
+                        product_id=product_id,
+                        product_name=name,
+                        category_id=category_id,
+                        model=model,
+                        price=price,
+                        price_rrc=price_rrc,
+                        quantity=quantity,
+                        parameters=parameters,
+                        search_text=make_search_text(name, model, [row['value'] for row in parameters]),
+                        visible=visible)
+
+
+def refresh_catalog_entries(queryset, batch_size=1000):
+    """
+    Пересчитывает строки каталога товаров queryset (ProductInfo) по основным таблицам
+    (например, после переименования продукта менеджером)
+    """
+    product_infos = queryset.select_related('shop', 'product').prefetch_related(
+        'product_parameters__parameter').annotate(published=F('shop__catalog_version')).order_by('id')
+    entries = []
+    for product_info in product_infos.iterator(chunk_size=batch_size):
+        entries.append(make_entry(
+            product_info.id, product_info.shop, product_info.product_id, product_info.product.category_id,
+            product_info.product.name, product_info.model, product_info.price, product_info.price_rrc,
+            product_info.quantity,
+            [(row.parameter.name, row.value) for row in product_info.product_parameters.all()],
+            # Товары незавершённой загрузки прайса остаются скрытыми
+            visible=product_info.catalog_version == product_info.published))
+    CatalogEntry.objects.filter(product_info_id__in=[entry.product_info_id for entry in entries]).delete()
+    CatalogEntry.objects.bulk_create(entries, batch_size=batch_size)
+    return len(entries)
@@ -0,0 +1,116 @@
+# backend/catalog_cache.py
+from functools import wraps
+from hashlib import sha1
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+# Кэш ответов каталога (категории, магазины, товары) в общем кэше (redis).
+# Ключ ответа - url без параметров, нормализованные query-параметры и версии каталога, от которых ответ зависит.
+# Любая запись в каталог меняет версию (bump_catalog_version), старые ответы больше не находятся по ключу
+# и удаляются из кэша по истечении CATALOG_CACHE_TIMEOUT.
+# Версии - время изменения (time_ns). Условные запросы - только по ETag (хэш ключа ответа): клиент с актуальной
+# копией (If-None-Match) получает 304 без тела. Last-Modified не отдаётся: у него точность в секунду,
+# и два изменения за одну секунду давали бы 304 на изменившийся ответ.
+# Кэш включается настройкой CATALOG_CACHE и требует общего кэша (redis): версии меняет и загрузка прайса в celery.
+VERSION_KEY = 'catalog:version:{}'
+# Кэши в памяти одного процесса: изменения из celery и других web-процессов до них не доходят
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+# Версия всего каталога - меняется при любом изменении
+ALL = 'all'
+# Версия данных, общих для всех магазинов (категории)
+GLOBAL = 'global'
+
+
+def shop_scope(shop_id):
+    return f'shop:{shop_id}'
+
+
+def get_versions(*scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: time_ns() for key in keys if key not in versions}
+    if missing:
+        # add - если версию одновременно задал другой процесс, остаётся его версия
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, 0) for key in keys]
+
+
+def bump_catalog_version(shop_ids=(), everything=False):
+    """
+    Сбрасывает кэш ответов каталога: магазинов shop_ids (и всех ответов по нескольким магазинам),
+    с everything=True - всех ответов (например, изменились категории)
+    """
+    version = time_ns()
+    scopes = [ALL, *(shop_scope(shop_id) for shop_id in shop_ids)]
+    if everything:
+        scopes.append(GLOBAL)
+    cache.set_many({VERSION_KEY.format(scope): version for scope in scopes}, None)
+
+
+def response_hash(request, versions):
+    """
+    Хэш ответа: путь, хост (ссылки next абсолютные), отсортированные непустые query-параметры и версии
+    """
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists() if any(values))
+    raw = f'{request.get_host()}{request.path}?{params}#{versions}'
+    return sha1(raw.encode()).hexdigest()
+
+
+def check_shared_cache():
+    """
+    С включённым кэшем ответов каталога (CATALOG_CACHE) кэш должен быть общим для всех процессов (CACHE_URL),
+    иначе ответы остаются устаревшими до CATALOG_CACHE_TIMEOUT - ошибка при запуске (BackendConfig.ready)
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.CATALOG_CACHE and backend in LOCAL_CACHES:
+        raise ImproperlyConfigured(f'CATALOG_CACHE требует общего кэша (CACHE_URL, redis), а не {backend}')
+
+
+def not_modified(request, etag):
+    """
+    True, если у клиента актуальная копия ответа: совпал ETag (If-None-Match)
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    return bool(if_none_match) and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match))
+
+
+def cache_catalog_response(scope=None):
+    """
+    Декоратор get-метода представления каталога: ответ берётся из кэша без запросов к БД,
+    на условный запрос с актуальным ETag - ответ 304 без тела. С CATALOG_CACHE=False ответ не кэшируется.
+    scope(request) - id магазина, которым ограничен ответ (тогда ответ сбрасывается только изменениями
+    этого магазина и категорий), None - ответ зависит от всего каталога.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not settings.CATALOG_CACHE:
+                return method(self, request, *args, **kwargs)
+            shop_id = scope(request) if scope else None
+            versions = get_versions(*([GLOBAL, shop_scope(shop_id)] if shop_id else [ALL]))
+            digest = response_hash(request, versions)
+            # json и html (browsable API) - разные представления ответа, у них разные ETag
+            etag = f'"{digest}-{request.accepted_renderer.format}"'
+            headers = {'ETag': etag}
+            if not_modified(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            key = f'catalog:response:{digest}'
+            data = cache.get(key)
+            if data is not None:
+                return Response(data, headers=headers)
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+                for header, value in headers.items():
+                    response[header] = value
+            return response
+        return wrapper
+    return decorator
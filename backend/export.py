@@ -0,0 +1,37 @@
+# backend/export.py
+import json
+import zlib
+
+from backend.fast_serializers import catalog_entry_columns, catalog_entries_data
+
+# Выгрузка всего каталога в NDJSON (одна строка json на товар) для партнёров и агрегаторов.
+# Строки читаются из БД пакетами (iterator - в PostgreSQL серверный курсор), каждый пакет сразу отправляется клиенту,
+# поэтому память на запрос не зависит от размера каталога, а первые товары уходят клиенту после первого пакета.
+
+
+def ndjson_chunks(queryset, chunk_size):
+    """
+    Строки каталога queryset (CatalogEntry) в NDJSON, по chunk_size товаров в куске
+    """
+    rows = []
+    for row in queryset.values(*catalog_entry_columns()).order_by('pk').iterator(chunk_size=chunk_size):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield encode_rows(rows)
+            rows = []
+    if rows:
+        yield encode_rows(rows)
+
+
+def encode_rows(rows):
+    return ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in catalog_entries_data(rows)).encode()
+
+
+def gzip_chunks(chunks):
+    """
+    Сжатие потока кусков в gzip: каждый кусок сжимается и отправляется сразу (Z_SYNC_FLUSH), не дожидаясь конца
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,63 @@
+# backend/facets.py
+from django.db.models import Count, F, Sum
+
+from backend.models import ProductParameter, FacetCount
+
+# Префикс query-параметров фильтра по значению параметра товара: param.<имя параметра>=<значение>
+PARAM_PREFIX = 'param.'
+
+
+def parameter_filters(query_params):
+    """
+    Фильтры по параметрам товаров из query-параметров запроса: {имя параметра: [значения]}
+    """
+    return {key[len(PARAM_PREFIX):]: query_params.getlist(key) for key in query_params
+            if key.startswith(PARAM_PREFIX) and len(key) > len(PARAM_PREFIX)}
+
+
+def filter_by_parameters(queryset, filters):
+    """
+    Товары queryset (ProductInfo или CatalogEntry) с заданными значениями параметров: у товара должны быть
+    все параметры фильтра, у каждого - одно из значений. Каждый параметр - подзапрос по индексу (parameter, value, product_info),
+    а не отдельный join к ProductParameter.
+    """
+    for name, values in filters.items():
+        queryset = queryset.filter(pk__in=ProductParameter.objects.filter(
+            parameter__name=name, value__in=values).values('product_info_id'))
+    return queryset
+
+
+def facet_counts(queryset, shop_id=None, category_id=None, precomputed=False):
+    """
+    Счётчики фильтров для товаров queryset: {имя параметра: {значение: кол-во товаров}}.
+    precomputed - товары ограничены только магазином и/или категорией,
+    тогда счётчики берутся из FacetCount (пересчитывается при загрузке прайса), а не считаются по товарам.
+    """
+    if precomputed:
+        rows = FacetCount.objects.filter(shop__state=True)
+        if shop_id:
+            rows = rows.filter(shop_id=shop_id)
+        if category_id:
+            rows = rows.filter(category_id=category_id)
+        rows = rows.values_list('parameter__name', 'value').annotate(count=Sum('count'))
+    else:
+        rows = ProductParameter.objects.filter(product_info_id__in=queryset.values('pk')).values_list(
+            'parameter__name', 'value').annotate(count=Count('id'))
+    facets = {}
+    for name, value, count in rows.order_by('parameter__name', 'value'):
+        facets.setdefault(name, {})[value] = count
+    return facets
+
+
+def refresh_facet_counts(shop_id):
+    """
+    Пересчитывает FacetCount магазина по опубликованной версии его каталога
+    """
+    FacetCount.objects.filter(shop_id=shop_id).delete()
+    rows = ProductParameter.objects.filter(
+        product_info__shop_id=shop_id,
+        product_info__catalog_version=F('product_info__shop__catalog_version')).values_list(
+        'product_info__product__category_id', 'parameter_id', 'value').annotate(count=Count('id')).order_by()
+    FacetCount.objects.bulk_create(
+        [FacetCount(shop_id=shop_id, category_id=category_id, parameter_id=parameter_id, value=value, count=count)
+         for category_id, parameter_id, value, count in rows], batch_size=1000)
@@ -0,0 +1,97 @@
+# backend/fast_serializers.py
+from operator import itemgetter
+
+from rest_framework import serializers
+
+from backend.models import Contact, OrderItem, ProductInfo, ProductParameter
+from backend.serializers import CatalogEntrySerializer, ContactSerializer
+
+# Быстрая сериализация для чтения (каталог, корзина, заказы): тот же json, что у CatalogEntrySerializer,
+# ProductInfoSerializer и OrderSerializer, но строки берутся из БД через .values()/.values_list(),
+# а поля ответа строятся заранее подготовленными функциями - без объектов моделей и полей DRF на каждую строку.
+# Совпадение с сериалайзерами DRF проверяется тестами (tests/backend/test_serializers.py).
+
+# Дата заказа в том же формате, что у DRF (часовой пояс, ISO 8601)
+format_datetime = serializers.DateTimeField().to_representation
+
+# Поле товара каталога -> функция, которая строит значение поля из строки CatalogEntry.objects.values()
+CATALOG_ENTRY_FIELDS = {
+    'id': itemgetter('pk'),
+    'model': itemgetter('model'),
+    'product': lambda row: {'name': row['product_name'], 'category': row['category_id']},
+    'shop': itemgetter('shop_id'),
+    'quantity': itemgetter('quantity'),
+    'price': itemgetter('price'),
+    'price_rrc': itemgetter('price_rrc'),
+    'product_parameters': itemgetter('parameters'),
+}
+
+PRODUCT_INFO_COLUMNS = ('id', 'model', 'product__name', 'product__category_id', 'shop_id', 'quantity', 'price',
+                        'price_rrc')
+CONTACT_COLUMNS = tuple(ContactSerializer.Meta.fields)
+
+
+def catalog_entry_columns(fields=None):
+    """
+    Столбцы CatalogEntry для .values() (pk - всегда, он нужен для постраничного вывода)
+    """
+    fields = fields if fields is not None else CatalogEntrySerializer.Meta.fields
+    columns = [column for name in fields if name != 'id'
+               for column in CatalogEntrySerializer.columns.get(name, (name,))]
+    return ['pk', *dict.fromkeys(columns)]
+
+
+def catalog_entries_data(rows, fields=None):
+    """
+    Товары каталога (строки CatalogEntry.objects.values(*catalog_entry_columns(fields))) в виде ответа /products
+    """
+    getters = [(name, CATALOG_ENTRY_FIELDS[name]) for name in (fields if fields is not None else CATALOG_ENTRY_FIELDS)
+               if name in CATALOG_ENTRY_FIELDS]
+    return [{name: getter(row) for name, getter in getters} for row in rows]
+
+
+def product_infos_data(ids):
+    """
+    Товары (ProductInfo) по id в виде ProductInfoSerializer: {id: товар}, двумя запросами
+    """
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.filter(product_info_id__in=ids).order_by(
+            'id').values_list('product_info_id', 'parameter__name', 'value'):
+        parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+    return {
+        product_info_id: {'id': product_info_id,
+                          'model': model,
+                          'product': {'name': name, 'category': category_id},
+                          'shop': shop_id,
+                          'quantity': quantity,
+                          'price': price,
+                          'price_rrc': price_rrc,
+                          'product_parameters': parameters.get(product_info_id, [])}
+        for product_info_id, model, name, category_id, shop_id, quantity, price, price_rrc in
+        ProductInfo.objects.filter(id__in=ids).order_by().values_list(*PRODUCT_INFO_COLUMNS)
+    }
+
+
+def orders_data(queryset):
+    """
+    Заказы queryset в виде OrderSerializer(many=True), пятью запросами
+    независимо от кол-ва заказов и позиций
+    """
+    orders = list(queryset.values_list('id', 'state', 'dt', 'total_sum', 'items_count', 'contact_id'))
+    items = {}
+    for order_id, item_id, product_info_id, quantity in OrderItem.objects.filter(
+            order_id__in=[order[0] for order in orders]).order_by('id').values_list(
+            'order_id', 'id', 'product_info_id', 'quantity'):
+        items.setdefault(order_id, []).append((item_id, product_info_id, quantity))
+    product_infos = product_infos_data({row[1] for rows in items.values() for row in rows})
+    contacts = {row['id']: row for row in Contact.objects.filter(
+        id__in={order[5] for order in orders if order[5]}).values(*CONTACT_COLUMNS)}
+    return [{'id': order_id,
+             'ordered_items': [{'id': item_id, 'product_info': product_infos[product_info_id], 'quantity': quantity}
+                               for item_id, product_info_id, quantity in items.get(order_id, [])],
+             'state': state,
+             'dt': format_datetime(dt),
+             'total_sum': total_sum,
+             'items_count': items_count,
+             'contact': contacts.get(contact_id)}
+            for order_id, state, dt, total_sum, items_count, contact_id in orders]
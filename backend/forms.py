@@ -1,5 +1,6 @@
 from django import forms
 from backend.models import UploadFiles, User, Contact
+from backend.price_list import validate_price_list
 
 
 class UploadFilesForm(forms.ModelForm):
@@ -9,6 +10,18 @@ class UploadFilesForm(forms.ModelForm):
         fields = ['user', 'email', 'name', 'file']
         widgets = {'user': forms.HiddenInput(), 'email': forms.HiddenInput()}
 
+    def clean_file(self):
+        """
+        Прайс проверяется при загрузке (без записи в БД), файл с ошибками не сохраняется
+        """
+        file = self.cleaned_data['file']
+        if file:
+            _, errors = validate_price_list(file)
+            file.seek(0)
+            if errors:
+                raise forms.ValidationError(errors)
+        return file
+
 
 class LoginForm(forms.ModelForm):
     class Meta:
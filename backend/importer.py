@@ -0,0 +1,441 @@
+# backend/importer.py
+from contextlib import contextmanager
+from itertools import islice
+from time import perf_counter
+
+from django.db import connection, transaction
+
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, CatalogEntry, \
+    IMPORT_MODE_CHOICES
+from backend.basket import basket_ids, refresh_totals
+from backend.catalog import make_entry
+from backend.catalog_cache import bump_catalog_version
+from backend.facets import refresh_facet_counts
+
+
+# Размер пакета для bulk_create (кол-во товаров, записываемых за один запрос)
+BATCH_SIZE = 1000
+
+# Режимы загрузки прайса:
+# replace - все товары магазина удаляются и записываются заново,
+# sync - товары сверяются с БД по внешнему ИД, записываются только добавленные/изменённые/удалённые
+IMPORT_MODES = tuple(mode for mode, _ in IMPORT_MODE_CHOICES)
+
+# Поля ProductInfo, которые обновляются в режиме sync
+SYNC_FIELDS = ('product_id', 'model', 'price', 'price_rrc', 'quantity')
+
+
+def batched(iterable, size):
+    """
+    Разбивает последовательность на пакеты (списки) по size элементов
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class QueryCounter:
+    """
+    Счётчик SQL-запросов к БД.
+    (Работает через execute_wrapper, поэтому считает запросы и при DEBUG=False)
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+# Ключ advisory-блокировок загрузки прайсов в PostgreSQL: (IMPORT_LOCK_KEY, id пользователя) - загрузка магазина,
+# (IMPORT_LOCK_KEY, 0) - создание общих Продуктов и Параметров
+IMPORT_LOCK_KEY = 20240
+
+
+@contextmanager
+def shop_lock(user_id):
+    """
+    Блокировка загрузки прайса магазина (пользователя user_id): возвращает True, если блокировка взята,
+    и False, если прайс магазина уже загружается другим процессом.
+    В PostgreSQL - сессионная advisory-блокировка, в других БД блокировки нет (всегда True),
+    там от параллельных загрузок одного магазина защищает только ограничение unique_active_import_job.
+    """
+    if connection.vendor != 'postgresql':
+        yield True
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [IMPORT_LOCK_KEY, user_id])
+        locked = cursor.fetchone()[0]
+    try:
+        yield locked
+    finally:
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [IMPORT_LOCK_KEY, user_id])
+
+
+def lock_shared():
+    """
+    Блокировка до конца транзакции на создание Продуктов и Параметров, общих для всех магазинов:
+    параллельные загрузки не создают дубликатов (только PostgreSQL)
+    """
+    if connection.vendor == 'postgresql' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, 0)', [IMPORT_LOCK_KEY])
+
+
+class CatalogCache:
+    """
+    Общий для нескольких загрузок кэш id Категорий и Параметров.
+    Загружается из БД один раз (например, перед запуском пула процессов загрузки) и дополняется
+    созданными при загрузке записями, поэтому каждая загрузка не перечитывает справочники из БД.
+    """
+
+    def __init__(self, categories=(), parameters=None):
+        # id Категорий, которые есть в БД
+        self.categories = set(categories)
+        # название параметра -> id параметра
+        self.parameters = parameters or {}
+
+    @classmethod
+    def load(cls):
+        cache = cls(Category.objects.values_list('id', flat=True))
+        for parameter_id, name in Parameter.objects.values_list('id', 'name'):
+            cache.parameters.setdefault(name, parameter_id)
+        return cache
+
+
+class PriceListImporter:
+    """
+    Загрузка прайса поставщика в БД.
+    Вместо get_or_create/create на каждую строку прайса, id Категорий, Продуктов и Параметров
+    берутся из словарей, заранее загруженных из БД несколькими запросами,
+    а ProductInfo и ProductParameter записываются пакетами через bulk_create.
+    В режиме replace товары пишутся в новую версию каталога магазина (ProductInfo.catalog_version),
+    которая публикуется одним UPDATE Shop.catalog_version после записи всех товаров.
+    В режиме sync товары сверяются с текущими товарами магазина по внешнему ИД (external_id)
+    и в БД одной транзакцией записываются только новые, изменённые (bulk_update) и удалённые товары.
+    Вместе с товарами пишутся строки каталога для покупателей (CatalogEntry) - из данных прайса, без чтения из БД.
+    """
+
+    def __init__(self, user_id, mode='replace', batch_size=BATCH_SIZE, progress=None, cache=None):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f'Неизвестный режим загрузки: {mode}')
+        self.user_id = user_id
+        self.mode = mode
+        self.batch_size = batch_size
+        # Функция, которая вызывается после каждого пакета со статистикой загрузки
+        self.progress = progress
+        # Общий кэш Категорий и Параметров (CatalogCache), без него справочники загружаются из БД
+        self.cache = cache
+        self.shop = None
+        # Версия каталога магазина, в которую пишутся товары
+        self.version = None
+        # (название продукта, id категории) -> id продукта
+        self.products = {}
+        # название параметра -> id параметра
+        self.parameters = {}
+        # Режим sync: внешний ИД -> (id, *SYNC_FIELDS) товаров магазина в БД
+        self.existing = {}
+        # Режим sync: id ProductInfo -> {id параметра: значение}
+        self.existing_parameters = {}
+        # Режим sync: id ProductInfo, которые нужно удалить
+        self.stale_ids = []
+        self.started = None
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'parameters': 0,
+                      'seconds': 0.0, 'rows_per_sec': 0.0, 'queries': 0}
+
+    def run(self, data):
+        """
+        Загружает в БД прайс data (словарь с ключами shop, categories, goods).
+        Возвращает статистику загрузки: кол-во товаров (созданных, изменённых, удалённых, без изменений),
+        время, товаров в секунду и кол-во запросов к БД.
+        """
+        counter = QueryCounter()
+        self.started = perf_counter()
+        with connection.execute_wrapper(counter):
+            with transaction.atomic():
+                self.shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=self.user_id)
+                self.load_categories(data['categories'])
+            # Товары незавершённой (упавшей) загрузки не опубликованы - удаляем
+            self.delete_product_infos(ProductInfo.objects.filter(
+                shop_id=self.shop.id, catalog_version__gt=self.shop.catalog_version).values_list('id', flat=True))
+            if self.mode == 'sync':
+                # Изменения пишутся в опубликованную версию каталога одной транзакцией
+                self.version = self.shop.catalog_version
+                with transaction.atomic():
+                    self.load_existing()
+                    self.write_batches(data['goods'], counter)
+                    self.delete_missing()
+                    refresh_facet_counts(self.shop.id)
+                    self.reset_cache()
+            else:
+                # Товары пишутся в новую версию каталога, которую покупатели не видят до публикации,
+                # каждый пакет - своей транзакцией, чтобы не держать блокировки всё время загрузки
+                self.version = self.shop.catalog_version + 1
+                self.write_batches(data['goods'], counter, atomic=True)
+                self.publish()
+        self.stats['queries'] = counter.count
+        self.update_timing()
+        return self.stats
+
+    def write_batches(self, goods, counter, atomic=False):
+        for batch in batched(goods, self.batch_size):
+            if atomic:
+                # Общие Продукты и Параметры создаются отдельной короткой транзакцией,
+                # чтобы не держать их блокировку (lock_shared), пока пишутся товары
+                with transaction.atomic():
+                    product_ids = self.resolve(batch)
+                with transaction.atomic():
+                    self.write_batch(batch, product_ids)
+            else:
+                self.write_batch(batch, self.resolve(batch))
+            self.stats['queries'] = counter.count
+            self.update_timing()
+            if self.progress:
+                self.progress(self.stats)
+
+    def publish(self):
+        """
+        Режим replace: публикует новую версию каталога магазина одним UPDATE (вместе со счётчиками фильтров
+        и строками каталога для покупателей) и удаляет старую версию (с пересчётом корзин с её товарами).
+        Покупатели до этого момента видят старый каталог целиком, после - новый целиком.
+        """
+        with transaction.atomic():
+            Shop.objects.filter(id=self.shop.id).update(catalog_version=self.version)
+            CatalogEntry.objects.filter(shop_id=self.shop.id, visible=True).delete()
+            CatalogEntry.objects.filter(shop_id=self.shop.id, visible=False).update(visible=True)
+            refresh_facet_counts(self.shop.id)
+            self.stats['deleted'] = self.delete_product_infos(ProductInfo.objects.filter(
+                shop_id=self.shop.id, catalog_version__lt=self.version).values_list('id', flat=True))
+            self.reset_cache()
+        self.shop.catalog_version = self.version
+
+    def reset_cache(self):
+        """
+        Сбрасывает кэш ответов каталога магазина после фиксации транзакции
+        """
+        shop_id = self.shop.id
+        transaction.on_commit(lambda: bump_catalog_version([shop_id]))
+
+    def delete_product_infos(self, ids):
+        """
+        Удаляет товары пакетами, возвращает кол-во удалённых товаров.
+        Позиции корзин с этими товарами удаляются вместе с ними, сумма корзин пересчитывается в той же транзакции.
+        """
+        ids = list(ids)
+        for batch in batched(ids, self.batch_size):
+            with transaction.atomic():
+                baskets = basket_ids(batch)
+                ProductInfo.objects.filter(id__in=batch).delete()
+                if baskets:
+                    refresh_totals(baskets)
+        return len(ids)
+
+    def update_timing(self):
+        self.stats['seconds'] = round(perf_counter() - self.started, 3)
+        if self.stats['seconds']:
+            self.stats['rows_per_sec'] = round(self.stats['rows'] / self.stats['seconds'], 1)
+
+    def load_categories(self, categories):
+        """
+        Создаёт недостающие Категории, привязывает их к магазину
+        и заранее загружает Продукты этих Категорий и все Параметры.
+        """
+        names = {category['id']: category['name'] for category in categories}
+        if self.cache:
+            existing = self.cache.categories
+        else:
+            existing = set(Category.objects.filter(id__in=names).values_list('id', flat=True))
+        # ignore_conflicts - Категорию могла создать параллельная загрузка
+        Category.objects.bulk_create(
+            [Category(id=category_id, name=name) for category_id, name in names.items()
+             if category_id not in existing], ignore_conflicts=True)
+        Category.shops.through.objects.bulk_create(
+            [Category.shops.through(category_id=category_id, shop_id=self.shop.id) for category_id in names],
+            ignore_conflicts=True)
+
+        self.products = {(name, category_id): product_id for product_id, name, category_id in
+                         Product.objects.filter(category_id__in=names).values_list('id', 'name', 'category_id')}
+        if self.cache:
+            self.cache.categories.update(names)
+            self.parameters = self.cache.parameters
+            return
+        # Параметров (имён характеристик) немного, поэтому загружаем их все
+        for parameter_id, name in Parameter.objects.values_list('id', 'name'):
+            self.parameters.setdefault(name, parameter_id)
+
+    def resolve_products(self, goods):
+        """
+        Возвращает id Продуктов для пакета товаров, недостающие Продукты создаются одним запросом
+        """
+        missing = {(item['name'], item['category']) for item in goods} - self.products.keys()
+        if missing:
+            lock_shared()
+            # Продукты из Категорий, которых не было в разделе categories прайса, ещё не загружены,
+            # или их только что создала параллельная загрузка
+            self.products.update(
+                ((name, category_id), product_id) for product_id, name, category_id in
+                Product.objects.filter(category_id__in={key[1] for key in missing},
+                                       name__in={key[0] for key in missing}).values_list('id', 'name', 'category_id'))
+            missing -= self.products.keys()
+        if missing:
+            created = Product.objects.bulk_create([Product(name=name, category_id=category_id)
+                                                   for name, category_id in missing])
+            self.fill_ids(created, Product.objects.filter(category_id__in={key[1] for key in missing},
+                                                          name__in={key[0] for key in missing}),
+                          key=lambda obj: (obj.name, obj.category_id))
+            self.products.update(((product.name, product.category_id), product.id) for product in created)
+        return [self.products[(item['name'], item['category'])] for item in goods]
+
+    def resolve_parameters(self, goods):
+        """
+        Создаёт одним запросом Параметры, которых ещё нет в БД
+        """
+        missing = {name for item in goods for name in item['parameters']} - self.parameters.keys()
+        if missing:
+            lock_shared()
+            # Параметры могла создать параллельная загрузка
+            for parameter_id, name in Parameter.objects.filter(name__in=missing).values_list('id', 'name'):
+                self.parameters.setdefault(name, parameter_id)
+            missing -= self.parameters.keys()
+        if missing:
+            created = Parameter.objects.bulk_create([Parameter(name=name) for name in missing])
+            self.fill_ids(created, Parameter.objects.filter(name__in=missing), key=lambda obj: obj.name)
+            self.parameters.update((parameter.name, parameter.id) for parameter in created)
+
+    def load_existing(self):
+        """
+        Режим sync: загружает текущие товары магазина и их параметры для сравнения с прайсом
+        """
+        for row in ProductInfo.objects.filter(shop_id=self.shop.id, catalog_version=self.version).values_list(
+                'external_id', 'id', *SYNC_FIELDS):
+            # Дубликаты внешнего ИД (возможны после старых загрузок) - лишние строки будут удалены
+            if row[0] in self.existing:
+                self.stale_ids.append(row[1])
+            else:
+                self.existing[row[0]] = row[1:]
+        for product_info_id, parameter_id, value in ProductParameter.objects.filter(
+                product_info__shop_id=self.shop.id, product_info__catalog_version=self.version).values_list(
+                'product_info_id', 'parameter_id', 'value'):
+            self.existing_parameters.setdefault(product_info_id, {})[parameter_id] = value
+
+    def resolve(self, goods):
+        """
+        Возвращает id Продуктов для пакета товаров, недостающие Продукты и Параметры создаются
+        """
+        product_ids = self.resolve_products(goods)
+        self.resolve_parameters(goods)
+        return product_ids
+
+    def write_batch(self, goods, product_ids):
+        """
+        Записывает пакет товаров: в режиме replace - все товары, в режиме sync - только изменения
+        """
+        self.stats['rows'] += len(goods)
+        if self.mode == 'replace':
+            self.create_product_infos(goods, product_ids)
+            return
+
+        new_goods, new_product_ids, to_update, changed_parameters, entries = [], [], [], [], []
+        for item, product_id in zip(goods, product_ids):
+            row = self.existing.pop(item['id'], None)
+            if row is None:
+                new_goods.append(item)
+                new_product_ids.append(product_id)
+                continue
+            product_info_id, *values = row
+            fields = (product_id, item['model'], item['price'], item['price_rrc'], item['quantity'])
+            parameters = self.item_parameters(item)
+            changed = False
+            if fields != tuple(values):
+                to_update.append(ProductInfo(id=product_info_id, **dict(zip(SYNC_FIELDS, fields))))
+                changed = True
+            if parameters != self.existing_parameters.pop(product_info_id, {}):
+                changed_parameters.append((product_info_id, parameters))
+                changed = True
+            if changed:
+                entries.append(self.catalog_entry(product_info_id, product_id, item))
+            self.stats['updated' if changed else 'unchanged'] += 1
+
+        if to_update:
+            ProductInfo.objects.bulk_update(to_update, SYNC_FIELDS)
+            # Суммы корзин - по текущим ценам (оформленные заказы не меняются)
+            baskets = basket_ids([product_info.id for product_info in to_update])
+            if baskets:
+                refresh_totals(baskets)
+        if changed_parameters:
+            ProductParameter.objects.filter(product_info_id__in=[row[0] for row in changed_parameters]).delete()
+            self.create_product_parameters(changed_parameters)
+        if entries:
+            # Строки каталога изменённых товаров пишутся заново
+            CatalogEntry.objects.filter(product_info_id__in=[entry.product_info_id for entry in entries]).delete()
+            CatalogEntry.objects.bulk_create(entries)
+        if new_goods:
+            self.create_product_infos(new_goods, new_product_ids)
+
+    def create_product_infos(self, goods, product_ids):
+        """
+        Создаёт пакет ProductInfo, их ProductParameter и строки каталога тремя запросами bulk_create
+        """
+        product_infos = ProductInfo.objects.bulk_create(
+            [ProductInfo(product_id=product_id,
+                         external_id=item['id'],
+                         model=item['model'],
+                         price=item['price'],
+                         price_rrc=item['price_rrc'],
+                         quantity=item['quantity'],
+                         shop_id=self.shop.id,
+                         catalog_version=self.version) for item, product_id in zip(goods, product_ids)])
+        self.fill_ids(product_infos, ProductInfo.objects.filter(shop_id=self.shop.id, catalog_version=self.version,
+                                                                external_id__in={item['id'] for item in goods}),
+                      key=lambda obj: (obj.product_id, obj.external_id))
+        self.create_product_parameters([(product_info.id, self.item_parameters(item))
+                                        for item, product_info in zip(goods, product_infos)])
+        CatalogEntry.objects.bulk_create([self.catalog_entry(product_info.id, product_info.product_id, item)
+                                          for item, product_info in zip(goods, product_infos)])
+        self.stats['created'] += len(product_infos)
+
+    def create_product_parameters(self, rows):
+        """
+        Создаёт параметры товаров одним запросом, rows - пары (id ProductInfo, {id параметра: значение})
+        """
+        product_parameters = ProductParameter.objects.bulk_create(
+            [ProductParameter(product_info_id=product_info_id, parameter_id=parameter_id, value=value)
+             for product_info_id, parameters in rows for parameter_id, value in parameters.items()])
+        self.stats['parameters'] += len(product_parameters)
+
+    def catalog_entry(self, product_info_id, product_id, item):
+        """
+        Строка каталога для покупателей товара из прайса.
+        В режиме replace строки скрыты до публикации новой версии каталога (publish).
+        """
+        return make_entry(product_info_id, self.shop, product_id, item['category'], item['name'], item['model'],
+                          item['price'], item['price_rrc'], item['quantity'], item['parameters'].items(),
+                          visible=self.mode == 'sync')
+
+    def item_parameters(self, item):
+        """
+        Параметры товара из прайса в виде {id параметра: значение}
+        """
+        return {self.parameters[name]: str(value) for name, value in item['parameters'].items()}
+
+    def delete_missing(self):
+        """
+        Режим sync: удаляет товары магазина, которых нет в прайсе
+        """
+        ids = self.stale_ids + [row[0] for row in self.existing.values()]
+        self.stats['deleted'] = self.delete_product_infos(ids)
+        self.existing, self.stale_ids = {}, []
+
+    @staticmethod
+    def fill_ids(objects, queryset, key):
+        """
+        Проставляет id созданным объектам, если БД не умеет возвращать их из bulk_create
+        """
+        if not objects or objects[0].pk is not None:
+            return
+        ids = {key(obj): obj.pk for obj in queryset}
+        for obj in objects:
+            obj.pk = ids[key(obj)]
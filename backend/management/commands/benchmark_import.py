@@ -0,0 +1,75 @@
+# backend/management/commands/benchmark_import.py
+import json
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from backend.benchmark import generate_price_list, run_case, run_case_process, environment, compare_results
+
+
+class Command(BaseCommand):
+    """
+    Замеры загрузки прайсов: для каждого размера генерируется прайс, который загружается в отдельном процессе
+    на тестовой БД (SQLite или PostgreSQL - какая указана в .env). Записываются товаров в секунду,
+    кол-во запросов к БД и пиковый RSS, результаты сохраняются в json для сравнения между релизами.
+    """
+    help = 'Замеры скорости загрузки прайсов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='размеры прайсов (кол-во товаров)')
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--parameters', type=int, default=20)
+        parser.add_argument('--values', type=int, default=50)
+        parser.add_argument('--item-parameters', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, help='размер пакета PriceListImporter')
+        parser.add_argument('--output', help='файл результатов (по умолчанию benchmarks/import-<БД>-<дата>.json)')
+        parser.add_argument('--compare', help='файл результатов прошлого запуска для сравнения')
+        parser.add_argument('--case', help='(внутренний) замер одного прайса в этом процессе')
+
+    def handle(self, *args, **options):
+        if options['case']:
+            self.run_single(options)
+            return
+
+        results = dict(environment(), cases=[])
+        with TemporaryDirectory() as directory:
+            for goods in options['goods']:
+                path = Path(directory, f'price_list_{goods}.yaml')
+                with open(path, 'w', encoding='utf-8') as stream:
+                    generate_price_list(stream, goods=goods, categories=options['categories'],
+                                        parameters=options['parameters'], values=options['values'],
+                                        item_parameters=options['item_parameters'])
+                case = run_case_process(path, options['batch_size'])
+                case.update(goods=goods, categories=options['categories'], parameters=options['parameters'],
+                            values=options['values'], item_parameters=options['item_parameters'],
+                            file_mb=round(os.path.getsize(path) / 1024 / 1024, 1))
+                results['cases'].append(case)
+                self.stdout.write(f"{goods} товаров: {case['replace']['rows_per_sec']} товаров/с, "
+                                  f"sync {case['sync']['rows_per_sec']} товаров/с, "
+                                  f"запросов {case['replace']['queries']}, RSS {case['peak_rss_mb']} Мб")
+
+        output = Path(options['output'] or
+                      f"benchmarks/import-{results['database']}-{results['created'].replace(':', '')}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        self.stdout.write(f'Результаты: {output}')
+
+        if options['compare']:
+            previous = json.loads(Path(options['compare']).read_text(encoding='utf-8'))
+            for line in compare_results(previous, results):
+                self.stdout.write(line)
+
+    def run_single(self, options):
+        """
+        Замер одного прайса на отдельной тестовой БД, результат - json последней строкой вывода
+        """
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            result = run_case(options['case'], options['batch_size'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.stdout.write(json.dumps(result))
@@ -0,0 +1,28 @@
+# backend/management/commands/benchmark_serializers.py
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from backend.benchmark import serialization_case
+
+
+class Command(BaseCommand):
+    """
+    Микробенчмарк сериализации каталога, товаров и заказов: сериалайзеры DRF против быстрой сериализации
+    (backend/fast_serializers.py). Данные генерируются на отдельной тестовой БД, рабочая БД не затрагивается.
+    """
+    help = 'Замеры скорости сериализации для чтения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, default=1000, help='кол-во товаров каталога')
+        parser.add_argument('--basket-items', type=int, default=100, help='кол-во позиций корзины')
+        parser.add_argument('--repeat', type=int, default=5, help='кол-во запусков (берётся лучшее время)')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            result = serialization_case(options['goods'], options['basket_items'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        for name, case in result.items():
+            self.stdout.write(f"{name}: DRF {case['serializer']} с, быстрая сериализация {case['fast']} с, "
+                              f"ускорение x{case['speedup']}")
@@ -0,0 +1,29 @@
+# backend/management/commands/generate_price_list.py
+from django.core.management.base import BaseCommand
+
+from backend.benchmark import generate_price_list
+
+
+class Command(BaseCommand):
+    """
+    Генерация прайса магазина (yaml) заданного размера для замеров загрузки (см. benchmark_import)
+    """
+    help = 'Генерация синтетического прайса магазина'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл прайса')
+        parser.add_argument('--goods', type=int, default=1000, help='кол-во товаров')
+        parser.add_argument('--categories', type=int, default=10, help='кол-во категорий')
+        parser.add_argument('--parameters', type=int, default=20, help='кол-во разных параметров')
+        parser.add_argument('--values', type=int, default=50, help='кол-во значений каждого параметра')
+        parser.add_argument('--item-parameters', type=int, default=4, help='кол-во параметров у товара')
+        parser.add_argument('--shop', default='Benchmark', help='название магазина')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with open(options['path'], 'w', encoding='utf-8') as stream:
+            generate_price_list(stream, goods=options['goods'], categories=options['categories'],
+                                parameters=options['parameters'], values=options['values'],
+                                item_parameters=options['item_parameters'], shop=options['shop'],
+                                seed=options['seed'])
+        self.stdout.write(f"Прайс {options['path']}: {options['goods']} товаров")
@@ -0,0 +1,66 @@
+# backend/management/commands/import_price_lists.py
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from backend.importer import CatalogCache
+from backend.models import ImportJob
+from backend.tasks import run_import_job
+
+# Общий кэш Категорий и Параметров процесса-воркера (передаётся из основного процесса при запуске пула)
+worker_cache = None
+
+
+def init_worker(cache):
+    global worker_cache
+    django.setup()
+    # Соединения с БД, унаследованные от основного процесса, не используются
+    connections.close_all()
+    worker_cache = cache
+
+
+def import_job_worker(job_id):
+    return run_import_job(job_id, worker_cache)
+
+
+class Command(BaseCommand):
+    """
+    Загрузка прайсов из очереди (ImportJob в статусе queued) несколькими процессами параллельно:
+    время загрузки прайсов многих магазинов определяется кол-вом ядер, а не кол-вом магазинов.
+    Каждый прайс загружается под блокировкой своего магазина, справочники Категорий и Параметров
+    загружаются из БД один раз и передаются в процессы пула.
+    """
+    help = 'Параллельная загрузка прайсов магазинов из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='id загрузок (по умолчанию - вся очередь)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='кол-во процессов')
+
+    def handle(self, *args, **options):
+        jobs = ImportJob.objects.filter(state='queued').order_by('id')
+        if options['job_ids']:
+            jobs = jobs.filter(id__in=options['job_ids'])
+        job_ids = list(jobs.values_list('id', flat=True))
+        if not job_ids:
+            self.stdout.write('Очередь загрузок пуста')
+            return
+
+        cache = CatalogCache.load()
+        workers = max(1, min(options['workers'], len(job_ids)))
+        if connection.vendor == 'sqlite' and workers > 1:
+            # В SQLite одновременно пишет только одно соединение - параллельные загрузки падают с database is locked
+            self.stdout.write('SQLite: прайсы загружаются по одному')
+            workers = 1
+        if workers == 1:
+            states = [run_import_job(job_id, cache) for job_id in job_ids]
+        else:
+            # Процессы пула открывают свои соединения с БД
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(cache,)) as pool:
+                states = list(pool.map(import_job_worker, job_ids))
+
+        for job_id, state in zip(job_ids, states):
+            self.stdout.write(f'Загрузка {job_id}: {state or "уже выполняется"}')
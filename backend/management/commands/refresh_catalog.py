@@ -0,0 +1,29 @@
+# backend/management/commands/refresh_catalog.py
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from backend.catalog import refresh_catalog_entries
+from backend.catalog_cache import bump_catalog_version
+from backend.models import Shop, ProductInfo
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт каталога для покупателей (CatalogEntry) по основным таблицам: заполнение каталога
+    в существующей БД или исправление после правок товаров в обход API (например, через админку)
+    """
+    help = 'Пересчёт каталога для покупателей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_ids', nargs='*', type=int, help='id магазинов (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.order_by('id')
+        if options['shop_ids']:
+            shops = shops.filter(id__in=options['shop_ids'])
+        for shop_id in shops.values_list('id', flat=True):
+            # Каждый магазин - своей транзакцией
+            with transaction.atomic():
+                count = refresh_catalog_entries(ProductInfo.objects.filter(shop_id=shop_id))
+            bump_catalog_version([shop_id])
+            self.stdout.write(f'Магазин {shop_id}: {count} товаров')
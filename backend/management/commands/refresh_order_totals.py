@@ -0,0 +1,30 @@
+# backend/management/commands/refresh_order_totals.py
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from backend.basket import refresh_totals
+from backend.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт сумм и кол-ва позиций корзин (Order.total_sum, Order.items_count) по позициям заказов:
+    исправление после правок позиций в обход API (например, через админку).
+    Суммы оформленных заказов зафиксированы при оформлении и не пересчитываются, с --all заполняются
+    только пустые (заказы, созданные до появления полей)
+    """
+    help = 'Пересчёт сумм и кол-ва позиций корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='также заполнить суммы оформленных заказов, у которых они пустые')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        orders = Q(state='basket')
+        if options['all']:
+            orders |= Q(total_sum__isnull=True)
+        order_ids = list(Order.objects.filter(orders).order_by('id').values_list('id', flat=True))
+        for start in range(0, len(order_ids), options['batch_size']):
+            refresh_totals(order_ids[start:start + options['batch_size']])
+        self.stdout.write(f'Пересчитано заказов: {len(order_ids)}')
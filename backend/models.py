@@ -1,6 +1,7 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.cache import cache
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
@@ -22,6 +23,21 @@ USER_TYPE_CHOICES = (
 
 )
 
+IMPORT_MODE_CHOICES = (
+    ('replace', 'Замена всех товаров магазина'),
+    ('sync', 'Запись только изменений'),
+)
+
+IMPORT_STATE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершена'),
+    ('failed', 'Ошибка'),
+)
+
+# Состояния незавершённой загрузки прайса (у магазина одновременно может быть только одна такая загрузка)
+IMPORT_ACTIVE_STATES = ('queued', 'running')
+
 
 # Create your models here.
 
@@ -113,6 +129,15 @@ class Shop(models.Model):
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='статус получения заказов', default=True)
+    # Последний загруженный прайс: хэш содержимого (повторная загрузка того же файла пропускается),
+    # ссылка и её заголовки ETag/Last-Modified (для условного запроса - неизменённый файл не скачивается)
+    import_hash = models.CharField(verbose_name='Хэш прайса', max_length=64, blank=True)
+    import_url = models.URLField(verbose_name='Ссылка на прайс', max_length=500, blank=True)
+    import_etag = models.CharField(verbose_name='ETag прайса', max_length=200, blank=True)
+    import_last_modified = models.CharField(verbose_name='Last-Modified прайса', max_length=50, blank=True)
+    # Опубликованная версия каталога магазина: покупатели видят только товары этой версии
+    # (загрузка прайса пишет товары в следующую версию и публикует её одним UPDATE)
+    catalog_version = models.PositiveIntegerField(verbose_name='Версия каталога', default=0)
 
     # filename
 
@@ -152,6 +177,14 @@ class Product(models.Model):
         return self.name
 
 
+class ProductInfoQuerySet(models.QuerySet):
+    def published(self):
+        """
+        Только товары опубликованной версии каталога магазина (без товаров незавершённой загрузки прайса)
+        """
+        return self.filter(catalog_version=models.F('shop__catalog_version'))
+
+
 class ProductInfo(models.Model):
     model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
     external_id = models.PositiveIntegerField(verbose_name='Внешний ИД')
@@ -162,12 +195,20 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    catalog_version = models.PositiveIntegerField(verbose_name='Версия каталога', default=0)
+
+    objects = ProductInfoQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Информация о продукте'
         verbose_name_plural = "Информационный список о продуктах"
         constraints = [
-            models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
+            models.UniqueConstraint(fields=['product', 'shop', 'external_id', 'catalog_version'],
+                                    name='unique_product_info'),
+        ]
+        indexes = [
+            # Постраничный вывод каталога по ключу (shop, id) - KeysetPagination
+            models.Index(fields=['shop', 'id'], name='product_info_shop_id_idx'),
         ]
 
 
@@ -197,6 +238,70 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            # Инвертированный индекс: значение параметра -> товары (фильтр param.<имя>=<значение>)
+            models.Index(fields=['parameter', 'value', 'product_info'], name='product_parameter_value_idx'),
+        ]
+
+
+class FacetCount(models.Model):
+    """
+    Кол-во товаров магазина в категории с данным значением параметра (опубликованный каталог).
+    Пересчитывается при загрузке прайса, из этой таблицы отдаются счётчики фильтров каталога
+    без подсчёта по всем товарам.
+    """
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='facet_counts', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='facet_counts',
+                                 on_delete=models.CASCADE)
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='facet_counts',
+                                  on_delete=models.CASCADE)
+    value = models.CharField(verbose_name='Значение', max_length=100)
+    count = models.PositiveIntegerField(verbose_name='Кол-во товаров')
+
+    class Meta:
+        verbose_name = 'Кол-во товаров по значению параметра'
+        verbose_name_plural = 'Кол-во товаров по значениям параметров'
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'category', 'parameter', 'value'], name='unique_facet_count'),
+        ]
+
+
+class CatalogEntry(models.Model):
+    """
+    Каталог для покупателей (модель для чтения): одна строка на товар магазина со всем, что выводит /products -
+    магазин, продукт, категория, цены, кол-во и параметры (готовым json). Каталог читается из одной таблицы
+    без join и prefetch. Строки пишет загрузка прайса (PriceListImporter), изменения менеджеров обновляют их.
+    """
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о продукте', primary_key=True,
+                                        related_name='catalog_entry', on_delete=models.CASCADE)
+    shop_id = models.BigIntegerField(verbose_name='Магазин')
+    shop_name = models.CharField(verbose_name='Название магазина', max_length=50)
+    shop_state = models.BooleanField(verbose_name='Статус получения заказов')
+    product_id = models.BigIntegerField(verbose_name='Продукт')
+    product_name = models.CharField(verbose_name='Название продукта', max_length=80)
+    category_id = models.BigIntegerField(verbose_name='Категория')
+    model = models.CharField(verbose_name='Модель', max_length=80, blank=True)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    # [{"parameter": имя, "value": значение}, ...] - как product_parameters в ProductInfoSerializer
+    parameters = models.JSONField(verbose_name='Параметры', default=list)
+    # Название продукта, модель и значения параметров - по этому полю строится полнотекстовый индекс (backend/search.py)
+    search_text = models.TextField(verbose_name='Текст для поиска', blank=True, default='')
+    # False - товар незавершённой загрузки прайса (ещё не опубликован)
+    visible = models.BooleanField(verbose_name='Опубликован', default=True)
+
+    class Meta:
+        verbose_name = 'Товар каталога'
+        verbose_name_plural = 'Каталог товаров'
+        indexes = [
+            # Постраничный вывод каталога по ключу (shop_id, id) - KeysetPagination
+            models.Index(fields=['shop_id', 'product_info'], name='catalog_entry_shop_idx'),
+            models.Index(fields=['category_id', 'shop_id', 'product_info'], name='catalog_entry_category_idx'),
+            # Каталог категории/магазина по цене (ordering=price, -price) и фильтр по диапазону цен
+            models.Index(fields=['category_id', 'price', 'product_info'], name='catalog_entry_cat_price_idx'),
+            models.Index(fields=['shop_id', 'price', 'product_info'], name='catalog_entry_shop_price_idx'),
+        ]
 
 
 class Contact(models.Model):
@@ -229,11 +334,23 @@ class Order(models.Model):
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    # Когда товары заказа списаны с остатков (резерв при оформлении, backend/basket.py).
+    # У заказов, оформленных до появления резерва, - пусто: их отмена не возвращает товары на склад
+    reserved_at = models.DateTimeField(verbose_name='Товары зарезервированы', null=True, blank=True)
+    # Сумма и кол-во позиций хранятся в заказе: корзина пересчитывает их при каждом изменении позиций
+    # (backend/basket.py, refresh_totals), при оформлении заказа они фиксируются по текущим ценам.
+    # Пусто - ещё не посчитаны (заказы, созданные до появления полей): команда refresh_order_totals --all
+    total_sum = models.PositiveIntegerField(verbose_name='Сумма', null=True, blank=True)
+    items_count = models.PositiveIntegerField(verbose_name='Кол-во позиций', null=True, blank=True)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказ"
         ordering = ('-dt',)
+        indexes = [
+            # Заказы и корзина пользователя
+            models.Index(fields=['user', 'state', '-dt'], name='order_user_state_idx'),
+        ]
 
     def __str__(self):
         return str(self.dt)
@@ -312,3 +429,56 @@ class UploadFiles(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class ImportJob(models.Model):
+    """
+    Загрузка прайса поставщика (выполняется в celery, см. tasks.import_price_list_task)
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь',
+                             related_name='import_jobs', blank=True,
+                             on_delete=models.CASCADE)
+    # Источник прайса: файл, загруженный менеджером (UploadFiles), или внешняя ссылка
+    upload = models.ForeignKey('UploadFiles', verbose_name='Файл прайса',
+                               related_name='import_jobs', blank=True, null=True,
+                               on_delete=models.SET_NULL)
+    url = models.URLField(verbose_name='Ссылка на прайс', max_length=500, blank=True)
+    mode = models.CharField(verbose_name='Режим загрузки', choices=IMPORT_MODE_CHOICES, max_length=10,
+                            default='replace')
+    # Загрузить прайс, даже если он не изменился с прошлой загрузки
+    force = models.BooleanField(verbose_name='Загружать без проверки изменений', default=False)
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=10, default='queued')
+    rows = models.PositiveIntegerField(verbose_name='Обработано товаров', default=0)
+    stats = models.JSONField(verbose_name='Статистика загрузки', default=dict, blank=True)
+    errors = models.JSONField(verbose_name='Ошибки', default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Загрузка прайса'
+        verbose_name_plural = "Список загрузок прайсов"
+        ordering = ('-created_at',)
+        constraints = [
+            # Защита от двух одновременных загрузок одного магазина (один менеджер - один магазин)
+            models.UniqueConstraint(fields=['user'], condition=models.Q(state__in=IMPORT_ACTIVE_STATES),
+                                    name='unique_active_import_job'),
+        ]
+
+    def __str__(self):
+        return f'{self.url or self.upload} ({self.state})'
+
+    # Прогресс выполняющейся загрузки хранится в кэше, а не в БД:
+    # в режиме sync товары пишутся в одной транзакции, и запись в БД из неё не видна до окончания загрузки
+    @property
+    def progress_key(self):
+        return f'import_job_progress:{self.id}'
+
+    def save_progress(self, stats):
+        cache.set(self.progress_key, {'rows': stats['rows'], 'rows_per_sec': stats['rows_per_sec']}, 24 * 60 * 60)
+
+    @property
+    def progress(self):
+        if self.state == 'running':
+            return cache.get(self.progress_key) or {'rows': self.rows, 'rows_per_sec': 0.0}
+        return {'rows': self.rows, 'rows_per_sec': self.stats.get('rows_per_sec', 0.0)}
@@ -0,0 +1,104 @@
+# backend/pagination.py
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу (keyset/cursor): страница начинается после последней записи
+    предыдущей страницы (WHERE (shop_id, id) > (..., ...) ORDER BY shop_id, id LIMIT n), а не со смещения OFFSET,
+    поэтому время ответа и память не зависят от того, насколько далеко листает клиент.
+    Курсор (параметр cursor) - значения полей ordering последней записи страницы, url следующей страницы - в next.
+    """
+    # Поля сортировки (последнее поле должно быть уникальным), '-' - по убыванию.
+    # Чтобы страница читалась по индексу, нужен индекс по полям сортировки (после полей фильтра)
+    ordering = ('shop_id', 'pk')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    # Размер страницы по умолчанию и максимальный размер страницы, который может запросить клиент
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = settings.MAX_PAGE_SIZE
+    # Как у CursorPagination DRF
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor))
+        page = list(queryset.order_by(*self.ordering)[:page_size + 1])
+        # Лишняя запись показывает, что есть следующая страница
+        self.next_cursor = self.position(page[page_size - 1]) if len(page) > page_size else None
+        return page[:page_size]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def after(self, cursor):
+        """
+        Условие "запись после курсора" в порядке ordering:
+        (a > x) OR (a = x AND b > y) OR ... (по убыванию - < вместо >)
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, cursor):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def position(self, obj):
+        # obj - объект модели или словарь (queryset.values())
+        if isinstance(obj, dict):
+            return [obj[field.lstrip('-')] for field in self.ordering]
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        # Поля сортировки - числа (id, цена, релевантность), подделанный курсор не должен дойти до запроса к БД
+        if not isinstance(cursor, list) or len(cursor) != len(self.ordering) or \
+                not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in cursor):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, cursor):
+        return urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.encode_cursor(self.next_cursor))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
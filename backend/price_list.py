@@ -0,0 +1,332 @@
+# backend/price_list.py
+from hashlib import sha256
+from tempfile import SpooledTemporaryFile
+from types import GeneratorType
+
+from requests import get
+from yaml import ScalarNode, SequenceNode, MappingNode
+from yaml import AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent, MappingEndEvent
+from yaml import StreamStartEvent, DocumentStartEvent, YAMLError
+
+# Парсер на C (libyaml) в разы быстрее парсера на чистом Python, если pyyaml собран с libyaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Разделы прайса, которые должны быть прочитаны до товаров
+HEADER_KEYS = ('shop', 'categories')
+
+# Размер блока при чтении файла для подсчёта хэша
+CHUNK_SIZE = 64 * 1024
+
+# Скачанный прайс до этого размера хранится в памяти, больше - во временном файле на диске
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Обязательные поля товара и их типы
+GOODS_FIELDS = {'id': int, 'category': int, 'model': str, 'name': str, 'price': int, 'price_rrc': int,
+                'quantity': int, 'parameters': dict}
+
+# Поля товара, которые не могут быть отрицательными (PositiveIntegerField)
+POSITIVE_FIELDS = ('id', 'price', 'price_rrc', 'quantity')
+
+# Диапазон целых полей товаров и категорий в БД (integer в PostgreSQL)
+MIN_INT, MAX_INT = -2 ** 31, 2 ** 31 - 1
+
+# Наибольшая длина строк (max_length полей моделей): поля товара (Product.name, ProductInfo.model),
+# название магазина (Shop.name) и категории (Category.name), название (Parameter.name)
+# и значение (ProductParameter.value) параметра
+GOODS_MAX_LENGTHS = {'name': 80, 'model': 80}
+SHOP_NAME_LENGTH = 50
+CATEGORY_NAME_LENGTH = 40
+PARAMETER_NAME_LENGTH = 40
+PARAMETER_VALUE_LENGTH = 100
+
+# Типы значений параметров (в БД значение хранится строкой)
+PARAMETER_VALUE_TYPES = (str, int, float, bool)
+
+# Сколько ошибок прайса возвращает проверка (остальные только считаются)
+MAX_ERRORS = 100
+
+
+class PriceListError(ValueError):
+    """
+    Ошибки прайса, найденные проверкой validate_price_list
+    """
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class PriceListReader:
+    """
+    Потоковое чтение прайса поставщика (yaml или json - json тоже является yaml-документом).
+    Документ не строится в памяти целиком: парсер читает файл блоками, а товары из раздела goods
+    собираются по одному из событий парсера и сразу отдаются дальше (в PriceListImporter пакетами).
+    Поэтому расход памяти не зависит от размера прайса.
+    """
+
+    def __init__(self, stream):
+        self.loader = SafeLoader(stream)
+        self.anchors = {}
+
+    def read(self):
+        """
+        Читает прайс, возвращает словарь с ключами shop, categories и goods,
+        где goods - генератор товаров, который дочитывает файл по мере обхода.
+        """
+        loader = self.loader
+        try:
+            self.expect(StreamStartEvent, DocumentStartEvent, MappingStartEvent)
+            data = {}
+            while not loader.check_event(MappingEndEvent):
+                key = self.construct(loader.get_event())
+                if key == 'goods' and loader.check_event(SequenceStartEvent):
+                    loader.get_event()
+                    if all(name in data for name in HEADER_KEYS):
+                        data['goods'] = self.iter_goods()
+                        return data
+                    # shop и categories идут после goods - так прочитать файл потоком нельзя,
+                    # товары собираются в список
+                    data['goods'] = list(self.iter_goods(finish=False))
+                else:
+                    data[key] = self.construct(loader.get_event())
+            self.close()
+            return data
+        except Exception:
+            self.close()
+            raise
+
+    def iter_goods(self, finish=True):
+        """
+        Генератор товаров раздела goods. С finish=True после последнего товара файл закрывается.
+        """
+        loader = self.loader
+        try:
+            while not loader.check_event(SequenceEndEvent):
+                yield self.construct(loader.get_event())
+            loader.get_event()
+        finally:
+            if finish:
+                self.close()
+
+    def construct(self, event):
+        """
+        Собирает python-объект из узла, который начинается с события event
+        """
+        return self.loader.construct_document(self.compose(event))
+
+    def compose(self, event):
+        """
+        Собирает узел документа из событий парсера (аналог yaml.composer.Composer,
+        которого нет у парсера на C)
+        """
+        loader = self.loader
+        if isinstance(event, AliasEvent):
+            if event.anchor not in self.anchors:
+                raise YAMLError(f'Неизвестная ссылка *{event.anchor} {event.start_mark}')
+            return self.anchors[event.anchor]
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not loader.check_event(SequenceEndEvent):
+                node.value.append(self.compose(loader.get_event()))
+            node.end_mark = loader.get_event().end_mark
+        elif isinstance(event, MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not loader.check_event(MappingEndEvent):
+                key = self.compose(loader.get_event())
+                node.value.append((key, self.compose(loader.get_event())))
+            node.end_mark = loader.get_event().end_mark
+        else:
+            raise YAMLError(f'Неожиданное событие {event} {event.start_mark}')
+        if getattr(event, 'anchor', None):
+            self.anchors[event.anchor] = node
+        return node
+
+    def expect(self, *event_classes):
+        for event_class in event_classes:
+            if not self.loader.check_event(event_class):
+                event = self.loader.peek_event()
+                raise YAMLError(f'Неверная структура прайса: {event} {event.start_mark}')
+            self.loader.get_event()
+
+    def close(self):
+        self.loader.dispose()
+
+
+def read_price_list(stream):
+    """
+    Потоковое чтение прайса из файлового объекта stream (см. PriceListReader)
+    """
+    return PriceListReader(stream).read()
+
+
+def open_url(url, timeout=60, etag='', last_modified=''):
+    """
+    Запрос прайса по ссылке без загрузки ответа в память: тело ответа (response.raw)
+    читается блоками по мере разбора. Ответ нужно закрыть (with open_url(url) as response).
+    С etag/last_modified запрос условный: если файл не изменился, сервер ответит 304 без тела.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = get(url, stream=True, timeout=timeout, headers=headers)
+    response.raise_for_status()
+    # Распаковка gzip/deflate на лету, если сервер отдаёт сжатый ответ
+    response.raw.decode_content = True
+    return response
+
+
+def file_hash(stream):
+    """
+    Хэш (sha256) содержимого файла, файл читается блоками
+    """
+    digest = sha256()
+    while chunk := stream.read(CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def spool(stream):
+    """
+    Копирует поток во временный файл (небольшой файл остаётся в памяти) и считает хэш содержимого.
+    Возвращает временный файл, готовый к чтению, и хэш.
+    """
+    digest = sha256()
+    file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    while chunk := stream.read(CHUNK_SIZE):
+        digest.update(chunk)
+        file.write(chunk)
+    file.seek(0)
+    return file, digest.hexdigest()
+
+
+def type_error(value, expected):
+    """
+    Ошибка типа значения поля прайса или None (bool в yaml - не число)
+    """
+    if isinstance(value, expected) and not (expected is int and isinstance(value, bool)):
+        return None
+    return f'ожидается {"число" if expected is int else "строка" if expected is str else "словарь"}, ' \
+           f'получено {value!r}'
+
+
+def value_error(value, max_length=None, positive=False):
+    """
+    Ошибка значения поля прайса, которое не поместится в поле БД, или None:
+    длина строки больше max_length, целое число вне диапазона MIN_INT..MAX_INT (positive - отрицательное)
+    """
+    if isinstance(value, str):
+        if max_length and len(value) > max_length:
+            return f'длина {len(value)} больше {max_length}'
+    elif positive and value < 0:
+        return f'отрицательное значение {value}'
+    elif not MIN_INT <= value <= MAX_INT:
+        return f'значение {value} вне диапазона {MIN_INT}..{MAX_INT}'
+    return None
+
+
+def parameter_errors(parameters):
+    """
+    Ошибки параметров товара: название - строка, значение - строка или число, длина - по полям БД
+    """
+    for param, value in parameters.items():
+        if not isinstance(param, str):
+            yield f'parameters: название параметра {param!r} - не строка'
+        elif message := value_error(param, PARAMETER_NAME_LENGTH):
+            yield f'parameters[{param!r}]: название - {message}'
+        if not isinstance(value, PARAMETER_VALUE_TYPES):
+            yield f'parameters[{param!r}]: ожидается строка или число, получено {value!r}'
+        elif message := value_error(str(value), PARAMETER_VALUE_LENGTH):
+            yield f'parameters[{param!r}]: значение - {message}'
+
+
+def validate_price_list(stream, max_errors=MAX_ERRORS):
+    """
+    Проверка прайса без записи в БД (прайс читается потоком один раз, со скоростью разбора файла):
+    структура (shop, categories, goods), обязательные поля и типы полей товаров, размеры значений
+    (длина строк и диапазон чисел - чтобы загрузка не упала на записи в БД), ссылки товаров на категории
+    из раздела categories и повторы внешнего ИД товаров.
+    Возвращает кол-во товаров и список ошибок (не больше max_errors, последней строкой - сколько не показано).
+    """
+    errors = []
+    total = 0
+
+    def error(message):
+        nonlocal total
+        total += 1
+        if total <= max_errors:
+            errors.append(message)
+
+    rows = 0
+    try:
+        data = read_price_list(stream)
+        if not isinstance(data.get('shop'), str) or not data['shop']:
+            error('shop: не указано название магазина')
+        elif message := value_error(data['shop'], SHOP_NAME_LENGTH):
+            error(f'shop: {message}')
+        categories = data.get('categories')
+        category_ids = set()
+        if not isinstance(categories, list):
+            error('categories: ожидается список категорий')
+            categories = []
+        for index, category in enumerate(categories):
+            if not isinstance(category, dict):
+                error(f'categories[{index}]: ожидается словарь с полями id и name')
+                continue
+            for field, expected in (('id', int), ('name', str)):
+                if field not in category:
+                    error(f'categories[{index}]: нет поля {field}')
+                elif message := (type_error(category[field], expected)
+                                 or value_error(category[field], CATEGORY_NAME_LENGTH)):
+                    error(f'categories[{index}].{field}: {message}')
+            if isinstance(category.get('id'), int):
+                category_ids.add(category['id'])
+        if 'goods' not in data:
+            error('goods: нет раздела с товарами')
+        goods = data.get('goods') or []
+        if not isinstance(goods, (list, GeneratorType)):
+            error('goods: ожидается список товаров')
+            goods = []
+        external_ids = set()
+        for index, item in enumerate(goods):
+            rows += 1
+            if not isinstance(item, dict):
+                error(f'goods[{index}]: ожидается словарь с полями товара')
+                continue
+            name = f'goods[{index}] (id {item["id"]})' if 'id' in item else f'goods[{index}]'
+            for field, expected in GOODS_FIELDS.items():
+                if field not in item:
+                    error(f'{name}: нет поля {field}')
+                elif message := type_error(item[field], expected):
+                    error(f'{name}.{field}: {message}')
+                elif expected is dict:
+                    for message in parameter_errors(item[field]):
+                        error(f'{name}.{message}')
+                elif message := value_error(item[field], GOODS_MAX_LENGTHS.get(field), field in POSITIVE_FIELDS):
+                    error(f'{name}.{field}: {message}')
+            if isinstance(item.get('category'), int) and item['category'] not in category_ids:
+                error(f'{name}.category: категории {item["category"]} нет в разделе categories')
+            if isinstance(item.get('id'), int):
+                if item['id'] in external_ids:
+                    error(f'{name}: внешний ИД повторяется')
+                external_ids.add(item['id'])
+    except YAMLError as e:
+        error(f'Ошибка разбора файла: {e}')
+    if total > max_errors:
+        errors.append(f'... и ещё {total - max_errors} ошибок')
+    return rows, errors
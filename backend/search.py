@@ -0,0 +1,98 @@
+# backend/search.py
+import re
+
+from django.db import connection, connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from backend.models import CatalogEntry
+
+# Полнотекстовый индекс по CatalogEntry.search_text (название продукта, модель и значения параметров товара):
+# PostgreSQL - GIN-индекс по to_tsvector, SQLite - таблица FTS5, которая обновляется триггерами.
+# Индекс создаётся после migrate (create_search_index), поле search_text заполняется вместе со строкой каталога.
+SEARCH_CONFIG = 'russian'
+SEARCH_INDEX = 'backend_catalogentry_search'
+TABLE = CatalogEntry._meta.db_table
+ROWID = CatalogEntry._meta.pk.column
+
+POSTGRESQL_INDEX = [
+    f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX}_idx ON {TABLE} "
+    f"USING GIN (to_tsvector('{SEARCH_CONFIG}', search_text))",
+]
+
+SQLITE_INDEX = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_INDEX} USING fts5("
+    f"search_text, content='{TABLE}', content_rowid='{ROWID}')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX}_insert AFTER INSERT ON {TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_INDEX}(rowid, search_text) VALUES (new.{ROWID}, new.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX}_delete AFTER DELETE ON {TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_INDEX}({SEARCH_INDEX}, rowid, search_text) "
+    f"VALUES ('delete', old.{ROWID}, old.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX}_update AFTER UPDATE OF search_text ON {TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_INDEX}({SEARCH_INDEX}, rowid, search_text) "
+    f"VALUES ('delete', old.{ROWID}, old.search_text); "
+    f"INSERT INTO {SEARCH_INDEX}(rowid, search_text) VALUES (new.{ROWID}, new.search_text); END",
+]
+
+
+def make_search_text(name, model, values):
+    """
+    Текст товара для полнотекстового поиска: название продукта, модель и значения параметров
+    """
+    return ' '.join([name, model, *(str(value) for value in values)])
+
+
+def create_search_index(using='default', **kwargs):
+    """
+    Создаёт полнотекстовый индекс (обработчик сигнала post_migrate)
+    """
+    db = connections[using]
+    if db.vendor == 'postgresql':
+        statements = POSTGRESQL_INDEX
+    elif db.vendor == 'sqlite':
+        statements = SQLITE_INDEX
+    else:
+        return
+    with db.cursor() as cursor:
+        exists = SEARCH_INDEX in db.introspection.table_names(cursor)
+        for statement in statements:
+            cursor.execute(statement)
+        if db.vendor == 'sqlite' and not exists:
+            # Таблица FTS5 создана для уже заполненной БД - индексируем существующие товары
+            cursor.execute(f"INSERT INTO {SEARCH_INDEX}({SEARCH_INDEX}) VALUES ('rebuild')")
+
+
+def search_words(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search(queryset, query):
+    """
+    Строки каталога queryset (CatalogEntry), найденные по запросу query (все слова запроса, по началу слова),
+    с релевантностью в поле rank (чем больше, тем релевантнее)
+    """
+    words = search_words(query)
+    if not words:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField())).none()
+    if connection.vendor == 'postgresql':
+        # ts_rank возвращает real (float4), а курсор страниц хранит релевантность как float8 (json):
+        # без приведения товары с равной релевантностью на границе страницы пропускаются или повторяются
+        ts_query = ' & '.join(f'{word}:*' for word in words)
+        vector = f"to_tsvector('{SEARCH_CONFIG}', {TABLE}.search_text)"
+        return queryset.filter(
+            RawSQL(f"{vector} @@ to_tsquery('{SEARCH_CONFIG}', %s)", [ts_query], output_field=BooleanField())
+        ).annotate(rank=RawSQL(f"CAST(ts_rank({vector}, to_tsquery('{SEARCH_CONFIG}', %s)) AS double precision)",
+                               [ts_query], output_field=FloatField()))
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{word}"*' for word in words)
+        # bm25 - чем меньше, тем релевантнее
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {SEARCH_INDEX} WHERE {SEARCH_INDEX} MATCH %s', [match])
+        ).annotate(rank=RawSQL(f'SELECT -bm25({SEARCH_INDEX}) FROM {SEARCH_INDEX} '
+                               f'WHERE {SEARCH_INDEX} MATCH %s AND rowid = {TABLE}.{ROWID}', [match],
+                               output_field=FloatField()))
+    # Другие БД - поиск подстрок без индекса и без ранжирования
+    condition = Q()
+    for word in words:
+        condition &= Q(search_text__icontains=word)
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
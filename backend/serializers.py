@@ -1,7 +1,8 @@
 from drf_spectacular.utils import extend_schema_serializer, OpenApiExample
 from rest_framework import serializers
 
-from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact
+from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact, \
+    ImportJob, CatalogEntry
 
 
 #  region api_documentation
@@ -149,13 +150,64 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа (query-параметры fields и expand): fields=id,price - только перечисленные поля,
+    expand=product_parameters - вложенные объекты (expandable_fields) в дополнение к fields или ко всем простым полям.
+    Без fields и expand выводятся все поля. Ответ по выбранным полям строится в backend/fast_serializers.py.
+    """
+    expandable_fields = ()
+
+    @classmethod
+    def requested_fields(cls, query_params):
+        """
+        Поля ответа по query-параметрам запроса, None - все поля.
+        Неизвестные поля (и поля expand, которые нельзя раскрыть) - ValueError со списком этих полей.
+        """
+        fields = {name.strip() for name in query_params.get('fields', '').split(',') if name.strip()}
+        expand = {name.strip() for name in query_params.get('expand', '').split(',') if name.strip()}
+        unknown = sorted((fields - set(cls.Meta.fields)) | (expand - set(cls.expandable_fields)))
+        if unknown:
+            raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+        if not fields and not expand:
+            return None
+        if not fields:
+            fields = set(cls.Meta.fields) - set(cls.expandable_fields)
+        return [name for name in cls.Meta.fields if name in fields or name in expand]
+
+
+class CatalogEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Товар каталога (CatalogEntry) в том же виде, что и ProductInfoSerializer, но без запросов к связанным таблицам
+    """
+    id = serializers.IntegerField(source='product_info_id', read_only=True)
+    product = serializers.SerializerMethodField()
+    shop = serializers.IntegerField(source='shop_id', read_only=True)
+    product_parameters = serializers.JSONField(source='parameters', read_only=True)
+
+    expandable_fields = ('product', 'product_parameters')
+    # Столбцы CatalogEntry, из которых выводится поле (остальные столбцы можно не загружать из БД)
+    columns = {'id': ('product_info',), 'product': ('product_name', 'category_id'), 'shop': ('shop_id',),
+               'product_parameters': ('parameters',)}
+
+    class Meta:
+        model = CatalogEntry
+        fields = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters',)
+        read_only_fields = fields
+
+    def get_product(self, obj):
+        return {'name': obj.product_name, 'category': obj.category_id}
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ('id', 'product_info', 'quantity', 'order',)
         read_only_fields = ('id',)
         extra_kwargs = {
-            'order': {'write_only': True}
+            'order': {'write_only': True},
+            # В корзину можно положить только товар из опубликованного каталога магазина
+            'product_info': {'queryset': ProductInfo.objects.published()},
         }
 
 
@@ -177,10 +229,37 @@ class OrderItemCreateSerializer(OrderItemSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
 
-    total_sum = serializers.IntegerField()
     contact = ContactSerializer(read_only=True)
 
     class Meta:
         model = Order
+        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'items_count', 'contact',)
+        read_only_fields = ('id', 'total_sum', 'items_count',)
+
+
+class PartnerOrderSerializer(OrderSerializer):
+    """
+    Заказ для магазина (PartnerOrders): total_sum - сумма товаров этого магазина (аннотация shop_total)
+    """
+    total_sum = serializers.IntegerField(source='shop_total', read_only=True)
+
+    class Meta(OrderSerializer.Meta):
         fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'contact',)
-        read_only_fields = ('id',)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    # Пока загрузка выполняется, кол-во обработанных товаров и скорость берутся из кэша (см. ImportJob.progress)
+    rows = serializers.SerializerMethodField()
+    rows_per_sec = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'upload', 'url', 'mode', 'force', 'state', 'rows', 'rows_per_sec', 'stats', 'errors',
+                  'created_at', 'started_at', 'finished_at',)
+        read_only_fields = fields
+
+    def get_rows(self, obj):
+        return obj.progress['rows']
+
+    def get_rows_per_sec(self, obj):
+        return obj.progress['rows_per_sec']
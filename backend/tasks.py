@@ -1,11 +1,16 @@
 # backend/tasks.py
+from contextlib import contextmanager
 from time import sleep
 from django.core.mail import EmailMultiAlternatives
+from django.utils import timezone
 
-from backend.models import ConfirmEmailToken
+from backend.models import ConfirmEmailToken, ImportJob, Shop
 from django.conf import settings
 from celery import shared_task
 from backend.models import User
+from backend.basket_cache import flush_basket
+from backend.importer import PriceListImporter, shop_lock
+from backend.price_list import read_price_list, open_url, file_hash, spool, validate_price_list, PriceListError
 import os
 
 
@@ -76,3 +81,100 @@ def new_order_mail_task(user_id, order_sum, order_id, **kwargs):
         [user.email]
     )
     msg.send()
+
+
+@shared_task()
+def flush_basket_task(user_id):
+    """
+    Сохранение корзины пользователя из кэша в БД (BASKET_CACHE), ставится в очередь изменениями корзины
+    """
+    flush_basket(user_id)
+
+
+@contextmanager
+def open_price_list(job, shop=None):
+    """
+    Открывает прайс загрузки job для потокового чтения.
+    Файл, загруженный менеджером, читается прямо из хранилища (без запроса к своему же серверу по http),
+    по ссылке скачиваются только прайсы с внешних серверов.
+    Возвращает (поток, хэш содержимого, заголовки ETag и Last-Modified) или None, если прайс не изменился
+    с прошлой загрузки магазина shop (по ETag/Last-Modified, при этом файл даже не скачивается).
+    """
+    if job.upload_id:
+        if not job.upload.file:
+            raise FileNotFoundError(f'У загрузки {job.upload} нет файла')
+        with job.upload.file.open('rb') as file:
+            content_hash = file_hash(file)
+            file.seek(0)
+            yield file, content_hash, '', ''
+    else:
+        # Условный запрос, если по этой ссылке прайс уже загружался
+        known = shop if shop and not job.force and shop.import_url == job.url else None
+        with open_url(job.url, etag=known.import_etag if known else '',
+                      last_modified=known.import_last_modified if known else '') as response:
+            if response.status_code == 304:
+                yield None
+                return
+            file, content_hash = spool(response.raw)
+            with file:
+                yield file, content_hash, response.headers.get('ETag', ''), response.headers.get('Last-Modified', '')
+
+
+@shared_task()
+def import_price_list_task(job_id):
+    """
+    Загрузка прайса поставщика в БД (PartnerUpdate.post только ставит загрузку в очередь).
+    Ход загрузки смотрится по url partner/update/<job_id>.
+    """
+    run_import_job(job_id)
+
+
+def run_import_job(job_id, cache=None):
+    """
+    Выполняет загрузку прайса job_id (из celery или из команды import_price_lists),
+    cache - общий кэш Категорий и Параметров (CatalogCache). Возвращает итоговый статус загрузки.
+    Если прайс не изменился с прошлой загрузки магазина, товары не перезаписываются.
+    """
+    # Загрузку берёт в работу только один воркер
+    if not ImportJob.objects.filter(id=job_id, state='queued').update(state='running', started_at=timezone.now()):
+        return None
+    job = ImportJob.objects.get(id=job_id)
+    try:
+        with shop_lock(job.user_id) as locked:
+            if not locked:
+                raise RuntimeError('Прайс магазина уже загружается другим процессом')
+            stats = import_job(job, cache)
+    except PriceListError as error:
+        ImportJob.objects.filter(id=job_id).update(state='failed', errors=error.errors, finished_at=timezone.now())
+        return 'failed'
+    except Exception as error:
+        ImportJob.objects.filter(id=job_id).update(state='failed', errors=[f'{type(error).__name__}: {error}'],
+                                                   finished_at=timezone.now())
+        return 'failed'
+    ImportJob.objects.filter(id=job_id).update(state='done', rows=stats['rows'], stats=stats,
+                                               finished_at=timezone.now())
+    return 'done'
+
+
+def import_job(job, cache=None):
+    """
+    Читает прайс загрузки job и пишет его в БД, возвращает статистику загрузки
+    """
+    shop = Shop.objects.filter(user_id=job.user_id).first()
+    with open_price_list(job, shop) as price_list:
+        if price_list is None:
+            return {'rows': 0, 'skipped': True, 'message': 'Прайс не изменился (ETag/Last-Modified)'}
+        stream, content_hash, etag, last_modified = price_list
+        if shop and not job.force and content_hash == shop.import_hash:
+            stats = {'rows': 0, 'skipped': True, 'message': 'Прайс не изменился'}
+        else:
+            # Прайс с ошибками не загружается совсем (проверка - один быстрый проход по файлу без записи в БД)
+            _, errors = validate_price_list(stream)
+            if errors:
+                raise PriceListError(errors)
+            stream.seek(0)
+            stats = PriceListImporter(job.user_id, mode=job.mode, progress=job.save_progress, cache=cache).run(
+                read_price_list(stream))
+        Shop.objects.filter(user_id=job.user_id).update(
+            import_hash=content_hash, import_url=job.url, import_etag=etag, import_last_modified=last_modified)
+    return stats
@@ -4,7 +4,7 @@ from rest_framework.routers import DefaultRouter
 from backend.views import PartnerUpdate, RegisterAccount, LoginAccount, CategoryView, ShopView, ProductInfoView, \
     BasketView, AccountDetails, OrderView, PartnerOrders, ConfirmAccount, LogoutAccount, \
     UploadFilesView, ResetPassword, EnterNewPassword, ContactViewSet, PartnerShopSet, PartnerCategorySet, \
-    PartnerProductSet
+    PartnerProductSet, PartnerUpdateStatus, ProductExportView
 
 from django.conf import settings
 from django.conf.urls.static import static
@@ -46,6 +46,8 @@ urlpatterns = [
     path('partner/upload_file/', UploadFilesView.as_view(), name="upload_files"),
     # Загрузка товаров/магазинов в БД данных из файла
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
+    # Ход загрузки товаров из файла: статус, кол-во обработанных товаров, скорость, ошибки
+    path('partner/update/<int:job_id>', PartnerUpdateStatus.as_view(), name='partner-update-status'),
     # Просмотр оформленных заказов поставщиками, каждый видит заказанные товары только из своего магазина
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
     # Просмотр и редактирование своих данных пользователем
@@ -60,6 +62,8 @@ urlpatterns = [
     path('shops', ShopView.as_view(), name='shops'),
     # Поиск товаров по магазину и/или категории товара
     path('products', ProductInfoView.as_view(), name='products'),
+    # Выгрузка всего каталога (или товаров магазина/категории) потоком в NDJSON, по Accept-Encoding: gzip - сжатая
+    path('products/export', ProductExportView.as_view(), name='products-export'),
     # # 1. Запрос на авторизацию яндекс
     # # (первоначальный запрос - редирект ссылкой на yandex с ID приложения в параметрах url)
     # path('ya_req', ya_first_request, name='ya_req'),
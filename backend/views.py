@@ -1,17 +1,21 @@
 import datetime
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.utils import timezone
 from django_rest_passwordreset.views import ResetPasswordRequestToken, ResetPasswordConfirm
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter
-from requests import get
+from requests import RequestException
 from rest_framework.authtoken.models import Token
 from django_rest_passwordreset.models import ResetPasswordToken
 from rest_framework.generics import ListAPIView
@@ -21,14 +25,26 @@ from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from ujson import loads as load_json
-from yaml import load as load_yaml, Loader
+from backend import basket_cache
+from backend.basket import BasketError, parse_items, add_items, update_items, delete_items, checkout, cancel_order, \
+    basket_ids, refresh_totals
+from backend.catalog import refresh_catalog_entries
+from backend.catalog_cache import cache_catalog_response, bump_catalog_version
+from backend.facets import parameter_filters, filter_by_parameters, facet_counts, refresh_facet_counts
+from backend.export import ndjson_chunks, gzip_chunks
+from backend.fast_serializers import catalog_entry_columns, catalog_entries_data, orders_data
 from backend.forms import UploadFilesForm, RegisterForm, ResetPasswordForm, EnterNewPasswordForm, LoginForm
-from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken, User, UploadFiles
+from backend.importer import IMPORT_MODES
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, \
+    Contact, ConfirmEmailToken, User, UploadFiles, ImportJob, CatalogEntry, IMPORT_ACTIVE_STATES
+from backend.pagination import KeysetPagination
 from backend.permissions import IsOwnerAdminOrReadOnly, IsOwnerOrAdmin
-from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer, ContactSerializer, ProductSerializer, LoginSerializer
-from backend.tasks import new_user_registered_mail_task, password_reset_token_mail_task, host, new_order_mail_task
+from backend.price_list import validate_price_list, open_url
+from backend.search import search
+from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, CatalogEntrySerializer, \
+    OrderSerializer, PartnerOrderSerializer, ContactSerializer, ProductSerializer, LoginSerializer, ImportJobSerializer
+from backend.tasks import new_user_registered_mail_task, password_reset_token_mail_task, new_order_mail_task, \
+    import_price_list_task
 from time import sleep
 
 
@@ -271,6 +287,10 @@ class CategoryView(ListAPIView):
     serializer_class = CategorySerializer
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
+    @cache_catalog_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 #  region api_documentation
 @extend_schema(tags=["Категории товаров"])
@@ -296,6 +316,23 @@ class PartnerCategorySet(ModelViewSet):
             queryset = queryset.filter(user_id=self.request.user.id)
         return queryset
 
+    # Категории есть в ответах каталога всех магазинов - сбрасывается весь кэш каталога
+    def perform_create(self, serializer):
+        serializer.save()
+        bump_catalog_version(everything=True)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        bump_catalog_version(everything=True)
+
+    # Позиции корзин с товарами категории удаляются вместе с ней, суммы корзин пересчитываются
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            baskets = basket_ids(ProductInfo.objects.filter(product__category=instance))
+            instance.delete()
+            refresh_totals(baskets)
+        bump_catalog_version(everything=True)
+
 
 # по умолчанию только get метод
 class ShopView(ListAPIView):
@@ -306,34 +343,115 @@ class ShopView(ListAPIView):
     serializer_class = ShopSerializer
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
+    @cache_catalog_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 class ProductInfoView(APIView):
     """
-    Класс для поиска товаров по магазину и/или категории товаров
+    Класс для поиска товаров по магазину и/или категории товаров, по значениям параметров (param.<имя>=<значение>)
+    и полнотекстового поиска (q=) по названию, модели и параметрам товара. Товары выдаются постранично (page_size,
+    переход на следующую страницу - по ссылке next), найденные по q - в порядке релевантности.
+    Фильтр по цене - price_min/price_max, сортировка по цене - ordering=price (по возрастанию) или -price.
+    Поля товара в ответе - fields=id,price,..., вложенные product и product_parameters - expand=product,...
+    С facets=true в ответе - кол-во найденных товаров по каждому значению каждого параметра.
     """
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-
+    pagination_class = KeysetPagination
+    # Допустимые значения ordering и соответствующий порядок страниц: сортировка по индексам
+    # (category_id, price, id) и (shop_id, price, id) - без сортировки всех товаров категории
+    orderings = {
+        'price': ('price', 'pk'),
+        '-price': ('-price', '-pk'),
+    }
+
+    # Ответ по одному магазину сбрасывается только изменениями этого магазина
+    @cache_catalog_response(scope=lambda request: request.query_params.get('shop_id'))
     def get(self, request, *args, **kwargs):
 
-        query = Q(shop__state=True)
+        query = Q(visible=True, shop_state=True)
         shop_id = request.query_params.get('shop_id')
         category_id = request.query_params.get('category_id')
+        ordering = request.query_params.get('ordering')
+        if ordering and ordering not in self.orderings:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'Неверная сортировка, возможны: {", ".join(self.orderings)}'}, status=400)
+        try:
+            fields = CatalogEntrySerializer.requested_fields(request.query_params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)}, status=400)
+        prices = {}
+        for param, lookup in (('price_min', 'price__gte'), ('price_max', 'price__lte')):
+            value = request.query_params.get(param)
+            if value:
+                if not value.isdigit():
+                    return JsonResponse({'Status': False, 'Errors': f'{param} должен быть целым числом'}, status=400)
+                prices[lookup] = int(value)
 
         if shop_id:
             query = query & Q(shop_id=shop_id)
 
         if category_id:
-            query = query & Q(product__category_id=category_id)
-
-        # фильтруем и отбрасываем дубликаты
-        queryset = ProductInfo.objects.filter(
-            query).select_related(
-            'shop', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+            query = query & Q(category_id=category_id)
+
+        if prices:
+            query = query & Q(**prices)
+
+        # фильтруем каталог для покупателей (только опубликованные товары): магазин, продукт и параметры товара
+        # хранятся в строке каталога, страница читается одним запросом без join и prefetch
+        queryset = CatalogEntry.objects.filter(query)
+
+        filters = parameter_filters(request.query_params)
+        queryset = filter_by_parameters(queryset, filters)
+
+        paginator = self.pagination_class()
+        search_query = request.query_params.get('q')
+        if search_query:
+            queryset = search(queryset, search_query)
+            paginator.ordering = ('-rank', 'pk')
+        if ordering:
+            paginator.ordering = self.orderings[ordering]
+        # Из БД загружаются только столбцы выбранных полей и сортировки (без json параметров, если они не нужны),
+        # строки - словарями .values(), ответ строится без объектов моделей (backend/fast_serializers.py)
+        columns = catalog_entry_columns(fields) + [field.lstrip('-') for field in paginator.ordering
+                                                   if field.lstrip('-') != 'pk']
+        page = paginator.paginate_queryset(queryset.values(*dict.fromkeys(columns)), request, view=self)
+
+        response = paginator.get_paginated_response(catalog_entries_data(page, fields))
+        if str(request.query_params.get('facets', '')).lower() in ('1', 'true', 'on'):
+            # Без фильтров по параметрам и цене и без поиска счётчики готовые (FacetCount),
+            # иначе считаются по найденным товарам
+            response.data['facets'] = facet_counts(queryset, shop_id, category_id,
+                                                   precomputed=not filters and not prices and not search_query)
+        return response
+
+
+class ProductExportView(APIView):
+    """
+    Класс для выгрузки всего каталога (или товаров магазина shop_id и/или категории category_id) в NDJSON:
+    одна строка json на товар, в том же виде, что и в /products. Ответ отправляется потоком по мере чтения из БД,
+    с заголовком запроса Accept-Encoding: gzip - сжатым в gzip.
+    """
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+    def get(self, request, *args, **kwargs):
+        queryset = CatalogEntry.objects.filter(visible=True, shop_state=True)
+        shop_id = request.query_params.get('shop_id')
+        category_id = request.query_params.get('category_id')
+        if shop_id:
+            queryset = queryset.filter(shop_id=shop_id)
+        if category_id:
+            queryset = queryset.filter(category_id=category_id)
 
-        return Response(serializer.data)
+        chunks = ndjson_chunks(queryset, settings.CATALOG_EXPORT_CHUNK_SIZE)
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        response = StreamingHttpResponse(gzip_chunks(chunks) if compress else chunks,
+                                         content_type='application/x-ndjson; charset=utf-8')
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+        return response
 
 
 class PartnerProductSet(ModelViewSet):
@@ -353,6 +471,28 @@ class PartnerProductSet(ModelViewSet):
             queryset = queryset.filter(product_infos__shop__user=self.request.user.id)
         return queryset
 
+    # Название и категория продукта хранятся в строках каталога его товаров,
+    # от категории продукта зависят счётчики фильтров магазинов
+    def perform_update(self, serializer):
+        category_id = serializer.instance.category_id
+        product = serializer.save()
+        refresh_catalog_entries(ProductInfo.objects.filter(product=product))
+        shop_ids = set(ProductInfo.objects.filter(product=product).values_list('shop_id', flat=True))
+        if product.category_id != category_id:
+            for shop_id in shop_ids:
+                refresh_facet_counts(shop_id)
+        bump_catalog_version(shop_ids)
+
+    def perform_destroy(self, instance):
+        shop_ids = set(ProductInfo.objects.filter(product=instance).values_list('shop_id', flat=True))
+        with transaction.atomic():
+            baskets = basket_ids(ProductInfo.objects.filter(product=instance))
+            instance.delete()
+            refresh_totals(baskets)
+            for shop_id in shop_ids:
+                refresh_facet_counts(shop_id)
+        bump_catalog_version(shop_ids)
+
 
 #  region api_documentation
 @extend_schema(tags=["Работа с Корзиной, оформление заказа"])
@@ -390,23 +530,30 @@ class BasketView(APIView):
 
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
 
+    # С настройкой BASKET_CACHE корзина хранится в кэше (backend/basket_cache.py) и сохраняется в БД отложенно.
+    # В обоих режимах:
+    #  POST items [{"product_info": id товара, "quantity": кол-во}] - добавляет товары (кол-во складывается);
+    #  ordered_items[].id в ответе get, id в PUT items [{"id", "quantity"}] и в DELETE items "id,id" - id позиции
+    #  корзины (OrderItem), он не меняется, пока позиция в корзине
+
     # получить корзину
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
-        basket = Order.objects.filter(
-            user_id=request.user.id, state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        if settings.BASKET_CACHE:
+            return Response(basket_cache.basket_data(request.user.id))
+        # Позиции корзины, товары и их параметры загружаются в orders_data (тот же json, что у OrderSerializer)
+        # Сумма и кол-во позиций хранятся в Order (пересчитываются при изменении корзины)
+        basket = Order.objects.filter(user_id=request.user.id, state='basket')
 
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
+        return Response(orders_data(basket))
 
     # Создать корзину (добавить в корзину товары)
     # Перед добавлением в корзину первого товара - создаётся корзина пользователя - одна запись в таблице Order (basket)
     # А так же в OrderItem - запись с выбранным товаром, id-корзины из Order(куда его положили), и кол-во товаров
-    # Параметры запроса: product_info - id из таблицы productinfo и quantity - кол-во товаров
+    # Параметры запроса: product_info - id из таблицы productinfo и quantity - кол-во товаров.
+    # Все позиции проверяются и записываются вместе (backend/basket.py): при ошибке корзина не меняется,
+    # кол-во товара, который уже есть в корзине, увеличивается
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -414,28 +561,14 @@ class BasketView(APIView):
         items_sting = request.data.get('items')
         if items_sting:
             try:
-                items_dict = load_json(items_sting)
-            except ValueError:
-                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
-            else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_created = 0
-                for order_item in items_dict:
-                    order_item.update({'order': basket.id})
-                    serializer = OrderItemSerializer(data=order_item)
-                    if serializer.is_valid():
-                        try:
-                            serializer.save()
-                        except IntegrityError as error:
-                            return JsonResponse({'Status': False, 'Errors': str(error)})
-                        else:
-                            objects_created += 1
-
-                    else:
-
-                        return JsonResponse({'Status': False, 'Errors': serializer.errors})
-
-                return JsonResponse({'Status': True, 'Создано объектов': objects_created})
+                items = load_json(items_sting) if isinstance(items_sting, str) else items_sting
+                add = basket_cache.add_items if settings.BASKET_CACHE else add_items
+                created, updated = add(request.user.id, parse_items(items))
+            except ValueError as error:
+                # BasketError - тоже ValueError
+                message = str(error) if isinstance(error, BasketError) else 'Неверный формат запроса'
+                return JsonResponse({'Status': False, 'Errors': message})
+            return JsonResponse({'Status': True, 'Создано объектов': created, 'Обновлено объектов': updated})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
     # удалить товары из корзины
@@ -446,20 +579,19 @@ class BasketView(APIView):
         items_sting = request.data.get('items')
         if items_sting:
             items_list = items_sting.split(',')
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-            query = Q()
-            objects_deleted = False
-            for order_item_id in items_list:
-                if order_item_id.isdigit():
-                    query = query | Q(order_id=basket.id, id=order_item_id)
-                    objects_deleted = True
-
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
+            ids = [int(item_id) for item_id in items_list if item_id.isdigit()]
+            if ids:
+                delete = basket_cache.delete_items if settings.BASKET_CACHE else delete_items
+                try:
+                    deleted_count = delete(request.user.id, ids)
+                except BasketError as error:
+                    return JsonResponse({'Status': False, 'Errors': str(error)})
                 return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
     # изменить позиции в корзине
+    # Параметры запроса: id - id позиции корзины и quantity - новое кол-во (0 - удалить позицию).
+    # Все позиции меняются одним запросом UPDATE (backend/basket.py), в ответе - результат по каждой позиции
     def put(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -467,24 +599,23 @@ class BasketView(APIView):
         items_sting = request.data.get('items')
         if items_sting:
             try:
-                items_dict = load_json(items_sting)
-            except ValueError:
-                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
-            else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_updated = 0
-                for order_item in items_dict:
-                    if type(order_item['id']) == int and type(order_item['quantity']) == int:
-                        objects_updated += OrderItem.objects.filter(order_id=basket.id, id=order_item['id']).update(
-                            quantity=order_item['quantity'])
-
-                return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated})
+                items = load_json(items_sting) if isinstance(items_sting, str) else items_sting
+                update = basket_cache.update_items if settings.BASKET_CACHE else update_items
+                results = update(request.user.id, parse_items(items, key='id', merge=False))
+            except ValueError as error:
+                message = str(error) if isinstance(error, BasketError) else 'Неверный формат запроса'
+                return JsonResponse({'Status': False, 'Errors': message})
+            return JsonResponse({'Status': True,
+                                 'Обновлено объектов': list(results.values()).count('updated'),
+                                 'Удалено объектов': list(results.values()).count('deleted'),
+                                 'items': [{'id': item_id, 'result': result} for item_id, result in results.items()]})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
 class PartnerUpdate(APIView):
     """
-    Класс для обновления прайса от поставщика
+    Класс для обновления прайса от поставщика.
+    Загрузка выполняется в celery, в ответе - id загрузки для просмотра её хода по url partner/update/<job_id>
     """
 
     # Форма с выпадающим списком всех загруженных файлов менеджера магазина.
@@ -498,11 +629,9 @@ class PartnerUpdate(APIView):
 
         files = UploadFiles.objects.filter(user_id=request.user.id)
 
-        url = f'http://{host}:8000/api/v1/media/'
-        names = [url + str(file.file) for file in files]
-
-        return render(request, 'backend/choice_file.html', {'names': names})
+        return render(request, 'backend/choice_file.html', {'files': files})
 
+    # Загрузка прайса из своего файла (file_id - id из таблицы uploadfiles) или по внешней ссылке (url)
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -511,7 +640,26 @@ class PartnerUpdate(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
 
+        # Режим загрузки: replace - полная перезапись товаров магазина, sync - запись только изменений
+        mode = request.data.get('mode', 'replace')
+        if mode not in IMPORT_MODES:
+            return JsonResponse({'Status': False, 'Error': f'Неизвестный режим загрузки: {mode}'})
+
+        # force - загрузить прайс, даже если он не изменился с прошлой загрузки
+        force = str(request.data.get('force', '')).lower() in ('1', 'true', 'on')
+        # dry_run - только проверить прайс, ничего не записывая в БД
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'on')
+        file_id = request.data.get('file_id')
         url = request.data.get('url')
+        if file_id:
+            # Файл, уже загруженный менеджером, читается прямо из хранилища, а не скачивается по http
+            upload = UploadFiles.objects.filter(id=file_id, user_id=request.user.id).first() \
+                if str(file_id).isdigit() else None
+            if not upload:
+                return JsonResponse({'Status': False, 'Error': 'Файл не найден'})
+            if dry_run:
+                return self.validate(upload=upload)
+            return self.queue_import(request, mode, force, upload=upload)
         if url:
             validate_url = URLValidator()
             try:
@@ -519,35 +667,80 @@ class PartnerUpdate(APIView):
             except ValidationError as e:
                 return JsonResponse({'Status': False, 'Error': str(e)})
             else:
-                stream = get(url).content
-
-                data = load_yaml(stream, Loader=Loader)
-
-                shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
-                for category in data['categories']:
-                    category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                    category_object.shops.add(shop.id)
-                    category_object.save()
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for item in data['goods']:
-                    product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-                    product_info = ProductInfo.objects.create(product_id=product.id,
-                                                              external_id=item['id'],
-                                                              model=item['model'],
-                                                              price=item['price'],
-                                                              price_rrc=item['price_rrc'],
-                                                              quantity=item['quantity'],
-                                                              shop_id=shop.id)
-                    for name, value in item['parameters'].items():
-                        parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                        ProductParameter.objects.create(product_info_id=product_info.id,
-                                                        parameter_id=parameter_object.id,
-                                                        value=value)
-                return render(request, 'backend/success_products_update.html')
+                if dry_run:
+                    return self.validate(url=url)
+                return self.queue_import(request, mode, force, url=url)
 
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
+    @staticmethod
+    def validate(upload=None, url=None):
+        """
+        Проверка прайса без загрузки в БД: кол-во товаров и все ошибки структуры прайса
+        """
+        try:
+            if upload:
+                with upload.file.open('rb') as file:
+                    rows, errors = validate_price_list(file)
+            else:
+                with open_url(url) as response:
+                    rows, errors = validate_price_list(response.raw)
+        except (OSError, RequestException) as e:
+            return JsonResponse({'Status': False, 'Error': str(e)})
+        return JsonResponse({'Status': not errors, 'rows': rows, 'Errors': errors})
+
+    @staticmethod
+    def queue_import(request, mode, force, **source):
+        """
+        Ставит загрузку прайса в очередь celery
+        """
+        # Зависшая загрузка (упал воркер celery) не должна навсегда блокировать загрузки магазина
+        ImportJob.objects.filter(
+            user_id=request.user.id, state__in=IMPORT_ACTIVE_STATES,
+            created_at__lt=timezone.now() - timedelta(seconds=settings.PRICE_LIST_IMPORT_TIMEOUT)).update(
+            state='failed', errors=['Превышено время загрузки'], finished_at=timezone.now())
+        # Одновременно у магазина выполняется только одна загрузка (ограничение unique_active_import_job)
+        try:
+            with transaction.atomic():
+                job = ImportJob.objects.create(user_id=request.user.id, mode=mode, force=force, **source)
+        except IntegrityError:
+            job = ImportJob.objects.filter(user_id=request.user.id, state__in=IMPORT_ACTIVE_STATES).first()
+            return JsonResponse({'Status': False, 'Errors': 'Загрузка прайса магазина уже выполняется',
+                                 'job_id': job.id if job else None})
+        # Файл разбирается потоком и пишется в БД пакетами в celery
+        # (или загрузка ждёт в очереди команду import_price_lists)
+        if settings.PRICE_LIST_IMPORT_CELERY:
+            try:
+                import_price_list_task.delay(job.id)
+            except Exception as error:
+                # Брокер celery недоступен: загрузка не в очереди и не должна блокировать следующие загрузки магазина
+                ImportJob.objects.filter(id=job.id).update(
+                    state='failed', errors=[f'{type(error).__name__}: {error}'], finished_at=timezone.now())
+                return JsonResponse({'Status': False, 'job_id': job.id,
+                                     'Errors': 'Не удалось поставить загрузку в очередь, повторите позже'}, status=503)
+        return JsonResponse({'Status': True, 'job_id': job.id,
+                             'status_url': reverse('backend:partner-update-status', args=[job.id])})
+
+
+class PartnerUpdateStatus(APIView):
+    """
+    Класс для просмотра хода загрузки прайса: статус, кол-во обработанных товаров, скорость и ошибки
+    """
+
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+
+        job = ImportJob.objects.filter(id=job_id, user_id=request.user.id).first()
+        if not job:
+            return JsonResponse({'Status': False, 'Errors': 'Загрузка не найдена'}, status=404)
+
+        serializer = ImportJobSerializer(job)
+        return Response(serializer.data)
+
 
 class PartnerShopSet(ModelViewSet):
     queryset = Shop.objects.all()
@@ -561,6 +754,24 @@ class PartnerShopSet(ModelViewSet):
             queryset = queryset.filter(user_id=self.request.user.id)
         return queryset
 
+    # Название и статус магазина есть в ответах каталога (список магазинов, товары магазина)
+    def perform_create(self, serializer):
+        shop = serializer.save()
+        bump_catalog_version([shop.id])
+
+    def perform_update(self, serializer):
+        shop = serializer.save()
+        CatalogEntry.objects.filter(shop_id=shop.id).update(shop_name=shop.name, shop_state=shop.state)
+        bump_catalog_version([shop.id])
+
+    def perform_destroy(self, instance):
+        shop_id = instance.id
+        with transaction.atomic():
+            baskets = basket_ids(ProductInfo.objects.filter(shop=instance))
+            instance.delete()
+            refresh_totals(baskets)
+        bump_catalog_version([shop_id])
+
 
 class PartnerOrders(APIView):
     """
@@ -574,13 +785,17 @@ class PartnerOrders(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
 
+        # Заказы, в которых есть товары магазина (подзапрос вместо join с distinct),
+        # сумма - только по товарам магазина (а не сумма всего заказа из Order)
         order = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=request.user.id).exclude(state='basket').prefetch_related(
+            id__in=OrderItem.objects.filter(product_info__shop__user_id=request.user.id).values('order_id')).exclude(
+            state='basket').prefetch_related(
             'ordered_items__product_info__product__category',
             'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+            shop_total=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'),
+                           filter=Q(ordered_items__product_info__shop__user_id=request.user.id)))
 
-        serializer = OrderSerializer(order, many=True)
+        serializer = PartnerOrderSerializer(order, many=True)
         return Response(serializer.data)
 
 
@@ -611,14 +826,18 @@ class ContactViewSet(ModelViewSet):
                     "(в json запросе передаются id-корзины и id-адреса_доставки_пользователя, "
                     "т.к. корзин и контактво может быть у пользователя несколько) "
                     "У заказа статус меняется на new, на почту пользователю отправляется письмо - что заказ оформлен. "
+                    "Товары заказа резервируются на складе, если какого-то товара не хватает - заказ не оформляется. "
                     "(Небольшой нюанс: id корзины передаётся строкой, id контакта - числом.)",
         request=OrderSerializer,
     ),
+    delete=extend_schema(
+        summary="Отмена своего Заказа (статусы new, confirmed, assembled), резерв товаров возвращается на склад",
+    ),
 )
 #  endregion
 class OrderView(APIView):
     """
-    Класс для создания из Корзины Заказа и просмотра своих Заказов.
+    Класс для создания из Корзины Заказа, просмотра и отмены своих Заказов.
     """
 
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
@@ -627,14 +846,9 @@ class OrderView(APIView):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
-        order = Order.objects.filter(
-            user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        order = Order.objects.filter(user_id=request.user.id).exclude(state='basket')
 
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        return Response(orders_data(order))
 
     # Оформление заказа из корзины. Статус заказа меняется с basket на new. Заказчику отправляется письмо-подтверждение.
     def post(self, request, *args, **kwargs):
@@ -642,32 +856,36 @@ class OrderView(APIView):
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
         if {'id', 'contact'}.issubset(request.data):
-            if request.data['id'].isdigit():
+            if str(request.data['id']).isdigit():
+                # Товары заказа резервируются на складе (backend/basket.py), если их не хватает - заказ не оформляется
                 try:
-                    is_updated = Order.objects.filter(
-                        user_id=request.user.id, id=int(request.data['id'])).update(
-                        contact_id=request.data['contact'],
-                        state='new')
-                except IntegrityError as error:
+                    # Корзина из кэша перед оформлением сохраняется в БД
+                    checkout_order = basket_cache.checkout if settings.BASKET_CACHE else checkout
+                    order = checkout_order(request.user.id, int(request.data['id']), request.data['contact'])
+                except BasketError as error:
+                    return JsonResponse({'Status': False, 'Errors': str(error)})
+                except (IntegrityError, ValueError) as error:
                     print(error)
                     return JsonResponse({'Status': False, 'Errors': 'Неправильно указаны аргументы'})
-                else:
-                    if is_updated:
-                        # Формируем общую сумму нового заказа (по id-заказа и id-пользователя)
-                        order = Order.objects.filter(
-                            user_id=request.user.id, id=int(request.data['id'])).prefetch_related(
-                            'ordered_items__product_info__product__category',
-                            'ordered_items__product_info__product_parameters__parameter').select_related(
-                            'contact').annotate(
-                            total_sum=Sum(
-                                F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-                        serializer = OrderSerializer(order, many=True)
-                        order_sum = serializer.data[0]['total_sum']
-                        # Отправка письма о новом заказе с помощью Celery
-                        new_order_mail_task.delay(request.user.id, order_sum, request.data['id'])
-                        return render(request, 'backend/success_new_order.html',
-                                      {'id': request.data['id'], 'order_sum': order_sum})
+                # Общая сумма нового заказа (зафиксирована при оформлении)
+                order_sum = order.total_sum
+                # Отправка письма о новом заказе с помощью Celery
+                new_order_mail_task.delay(request.user.id, order_sum, request.data['id'])
+                return render(request, 'backend/success_new_order.html',
+                              {'id': request.data['id'], 'order_sum': order_sum})
+
+        return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+
+    # Отмена своего заказа (пока он не отправлен), зарезервированные товары возвращаются на склад
+    def delete(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
+        order_id = str(request.data.get('id', ''))
+        if order_id.isdigit():
+            if cancel_order(request.user.id, int(order_id)):
+                return JsonResponse({'Status': True})
+            return JsonResponse({'Status': False, 'Errors': 'Заказ не найден или уже не может быть отменён'})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
@@ -688,7 +906,9 @@ class UploadFilesView(APIView):
         form = UploadFilesForm(request.POST, request.FILES)
         if form.is_valid():
             form.save()
-        return render(request, 'backend/success_upload_file.html')
+            return render(request, 'backend/success_upload_file.html')
+        # Форма с ошибками (в том числе ошибками прайса)
+        return render(request, 'backend/upload.html', {'form': form}, status=400)
 
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
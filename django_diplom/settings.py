@@ -161,6 +161,9 @@ SERVER_EMAIL = os.getenv('SERVER_EMAIL')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Максимальный размер страницы, который клиент может запросить параметром page_size (каталог товаров)
+MAX_PAGE_SIZE = 200
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 40,
@@ -193,6 +196,42 @@ REST_FRAMEWORK = {
 CELERY_BROKER_URL = "redis://localhost:6379"
 CELERY_RESULT_BACKEND = "redis://localhost:6379"
 
+# Кэш, общий для web и celery (прогресс загрузки прайсов, ответы каталога и их версии).
+# В работе нужен общий кэш (CACHE_URL): загрузка прайса в celery должна сбрасывать кэш каталога web-процессов
+# Без CACHE_URL в .env используется кэш в памяти процесса (для тестов и разработки, кэш ответов каталога выключен)
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+
+# True - ответы каталога (категории, магазины, товары) кэшируются и отдаются с ETag (304 на If-None-Match).
+# Нужен общий кэш (CACHE_URL): с кэшем в памяти процесса приложение не запустится (backend/catalog_cache.py).
+# По умолчанию включено, если задан CACHE_URL
+CATALOG_CACHE = os.getenv('CATALOG_CACHE', str(bool(os.getenv('CACHE_URL')))) == 'True'
+# Сколько секунд хранятся ответы каталога (категории, магазины, товары) в кэше.
+# Изменения каталога сбрасывают кэш сразу (версии каталога), время хранения только ограничивает размер кэша
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Кол-во товаров в одном пакете выгрузки каталога (products/export): пакет читается из БД и сразу отправляется клиенту
+CATALOG_EXPORT_CHUNK_SIZE = 2000
+
+# True - корзины покупателей хранятся в общем кэше (CACHE_URL), запросы к корзине не пишут в БД.
+# Корзина сохраняется в Order/OrderItem задачей celery не чаще раза в BASKET_FLUSH_DELAY секунд и при оформлении заказа
+BASKET_CACHE = os.getenv('BASKET_CACHE', 'False') == 'True'
+BASKET_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+BASKET_FLUSH_DELAY = 60
+
+# Через сколько секунд незавершённая загрузка прайса считается зависшей (воркер celery упал)
+# и не мешает поставить в очередь новую загрузку магазина
+PRICE_LIST_IMPORT_TIMEOUT = 2 * 60 * 60
+
+# False - PartnerUpdate не отправляет загрузки в celery, очередь загрузок разбирает команда
+# python manage.py import_price_lists (несколько прайсов параллельно пулом процессов, например по cron)
+PRICE_LIST_IMPORT_CELERY = os.getenv('PRICE_LIST_IMPORT_CELERY', 'True') == 'True'
+
 # drf-spectacular settings (for api_documentation)
 SPECTACULAR_SETTINGS = {
     "TITLE": "django_diplom API",  # название проекта
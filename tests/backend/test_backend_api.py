@@ -204,8 +204,9 @@ def test_get_own_contact(client, user_factory, contact_factory):
 # по заранее известным названиям из yaml-файла.
 # yaml-файл загружается по url и лежит в папке /media,
 # поэтому для успешного тестирования, чтобы файл был доступен - нужно запустить проект - runserver
+# (загрузка выполняется задачей celery, в тесте - сразу, без воркера)
 @pytest.mark.django_db
-def test_partner_update_products(client, user_factory):
+def test_partner_update_products(client, user_factory, celery_eager):
     # создаём менеджера
     user = user_factory()
     user.is_active = True
@@ -0,0 +1,409 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, OperationalError
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from model_bakery import baker
+
+from backend.basket import checkout, StockError
+from backend.basket_cache import FLUSH_KEY, flush_basket
+from backend.models import ProductInfo, Order, OrderItem, CatalogEntry
+from backend.views import PartnerCategorySet
+from tests.conftest import db_queries
+
+
+pytestmark = pytest.mark.usefixtures('no_throttling')
+
+
+# Магазин с 40 товарами из сгенерированного прайса
+@pytest.fixture
+def product_ids(shop_factory):
+    shop_factory(goods=40)
+    return list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+
+
+@pytest.fixture
+def buyer(client, user_factory):
+    user = user_factory(is_active=True)
+    client.force_authenticate(user=user)
+    return user
+
+
+def post_items(client, items):
+    return client.post('/api/v1/basket', {'items': json.dumps(items)})
+
+
+def basket_items(user):
+    return dict(OrderItem.objects.filter(order__user=user, order__state='basket').values_list(
+        'product_info_id', 'quantity'))
+
+
+# Кол-во запросов на добавление в корзину не зависит от кол-ва позиций
+@pytest.mark.django_db
+def test_basket_post_queries(client, buyer, product_ids):
+    post_items(client, [{'product_info': product_ids[0], 'quantity': 1}])  # корзина создана
+    with CaptureQueriesContext(connection) as small:
+        assert post_items(client, [{'product_info': pk, 'quantity': 1} for pk in product_ids[:3]]).json()['Status']
+    with CaptureQueriesContext(connection) as large:
+        response = post_items(client, [{'product_info': pk, 'quantity': 2} for pk in product_ids[:30]])
+    assert response.json() == {'Status': True, 'Создано объектов': 27, 'Обновлено объектов': 3}
+    assert len(db_queries(large)) == len(db_queries(small)) < 15
+    assert basket_items(buyer)[product_ids[0]] == 4 and len(basket_items(buyer)) == 30
+
+
+# Повторное добавление товара увеличивает кол-во в позиции корзины, одинаковые товары в запросе складываются
+@pytest.mark.django_db
+def test_basket_post_merge(client, buyer, product_ids):
+    post_items(client, [{'product_info': product_ids[0], 'quantity': 2}])
+    response = post_items(client, [{'product_info': product_ids[0], 'quantity': 3},
+                                   {'product_info': product_ids[1], 'quantity': 1},
+                                   {'product_info': product_ids[1], 'quantity': 4}])
+    assert response.json()['Status']
+    assert basket_items(buyer) == {product_ids[0]: 5, product_ids[1]: 5}
+    # id и кол-во строками (как присылают формы)
+    assert post_items(client, [{'product_info': str(product_ids[2]), 'quantity': '2'}]).json()['Status']
+    assert basket_items(buyer)[product_ids[2]] == 2
+    assert Order.objects.filter(user=buyer, state='basket').count() == 1
+
+
+# Ошибка в любой позиции - корзина не меняется
+@pytest.mark.django_db
+def test_basket_post_atomic(client, buyer, product_ids):
+    post_items(client, [{'product_info': product_ids[0], 'quantity': 1}])
+    for items in ([{'product_info': product_ids[1], 'quantity': 1}, {'product_info': 10 ** 9, 'quantity': 1}],
+                  [{'product_info': product_ids[1], 'quantity': 1}, {'product_info': product_ids[2], 'quantity': 0}],
+                  [{'product_info': product_ids[1], 'quantity': '1.5'}],
+                  [{'product_info': product_ids[1], 'quantity': True}],
+                  {'product_info': product_ids[1], 'quantity': 1}):
+        response = post_items(client, items)
+        assert response.json()['Status'] is False
+    assert '1000000000' in post_items(client, [{'product_info': 10 ** 9, 'quantity': 1}]).json()['Errors']
+    assert client.post('/api/v1/basket', {'items': '[{'}).json() == {'Status': False,
+                                                                      'Errors': 'Неверный формат запроса'}
+    assert basket_items(buyer) == {product_ids[0]: 1}
+
+
+# Изменение кол-ва в позициях корзины одним запросом UPDATE, кол-во 0 удаляет позицию, результат по каждой позиции
+@pytest.mark.django_db
+def test_basket_put(client, buyer, product_ids, user_factory):
+    post_items(client, [{'product_info': pk, 'quantity': 1} for pk in product_ids[:30]])
+    item_ids = list(OrderItem.objects.filter(order__user=buyer).order_by('id').values_list('id', flat=True))
+    other = Order.objects.create(user=user_factory(), state='basket')
+    other_item = OrderItem.objects.create(order=other, product_info_id=product_ids[0], quantity=1)
+    items = [{'id': item_id, 'quantity': 5} for item_id in item_ids[:25]] + \
+            [{'id': item_id, 'quantity': 0} for item_id in item_ids[25:]] + [{'id': other_item.id, 'quantity': 7}]
+    with CaptureQueriesContext(connection) as queries:
+        response = client.put('/api/v1/basket', {'items': json.dumps(items)})
+    data = response.json()
+    assert data['Обновлено объектов'] == 25 and data['Удалено объектов'] == 5
+    assert data['items'][0] == {'id': item_ids[0], 'result': 'updated'}
+    assert data['items'][-1] == {'id': other_item.id, 'result': 'not_found'}
+    assert len([sql for sql in db_queries(queries) if sql.startswith('UPDATE "backend_orderitem"')]) == 1
+    assert basket_items(buyer) == {pk: 5 for pk in product_ids[:25]}
+    other_item.refresh_from_db()
+    assert other_item.quantity == 1
+
+    response = client.put('/api/v1/basket', {'items': json.dumps([{'id': item_ids[0], 'quantity': 1},
+                                                                  {'id': item_ids[1], 'quantity': -1}])})
+    assert response.json()['Status'] is False
+    assert basket_items(buyer)[product_ids[0]] == 5
+
+
+def make_basket(user, items):
+    basket = Order.objects.create(user=user, state='basket')
+    OrderItem.objects.bulk_create([OrderItem(order=basket, product_info_id=product_info_id, quantity=quantity)
+                                   for product_info_id, quantity in items])
+    return basket
+
+
+# Оформление заказа резервирует товары на складе, при нехватке заказ не оформляется, отмена возвращает резерв
+@pytest.mark.django_db
+def test_checkout_reserves_stock(client, buyer, product_ids):
+    contact = baker.make('backend.Contact', user=buyer)
+    first, second = ProductInfo.objects.filter(id__in=product_ids[:2]).order_by('id')
+    ProductInfo.objects.filter(id=first.id).update(quantity=5)
+    basket = make_basket(buyer, [(first.id, 3), (second.id, 1)])
+    checkout(buyer.id, basket.id, contact.id)
+    assert ProductInfo.objects.get(id=first.id).quantity == 2
+    assert ProductInfo.objects.get(id=second.id).quantity == second.quantity - 1
+    assert CatalogEntry.objects.get(pk=first.id).quantity == 2
+    assert Order.objects.get(id=basket.id).state == 'new'
+
+    basket = make_basket(buyer, [(second.id, 1), (first.id, 3)])
+    with pytest.raises(StockError) as error:
+        checkout(buyer.id, basket.id, contact.id)
+    assert error.value.product_info_ids == [first.id]
+    assert ProductInfo.objects.get(id=second.id).quantity == second.quantity - 1  # всё откатилось
+    assert Order.objects.get(id=basket.id).state == 'basket'
+
+    order_id = Order.objects.get(user=buyer, state='new').id
+    assert client.delete('/api/v1/order', {'id': order_id}).json() == {'Status': True}
+    assert ProductInfo.objects.get(id=first.id).quantity == 5
+    assert ProductInfo.objects.get(id=second.id).quantity == second.quantity
+    assert client.delete('/api/v1/order', {'id': order_id}).json()['Status'] is False
+
+    # Заказ, оформленный до появления резерва, отменяется без возврата товаров на склад
+    old_order = make_basket(buyer, [(first.id, 4)])
+    Order.objects.filter(id=old_order.id).update(state='confirmed', contact=contact)
+    assert client.delete('/api/v1/order', {'id': old_order.id}).json() == {'Status': True}
+    assert ProductInfo.objects.get(id=first.id).quantity == 5
+    assert Order.objects.get(id=old_order.id).state == 'canceled'
+
+
+# Много покупателей одновременно оформляют заказы на один товар: продано ровно столько, сколько было на складе
+@pytest.mark.django_db(transaction=True)
+def test_checkout_concurrent(product_ids, user_factory):
+    stock, clients = 10, 30
+    ProductInfo.objects.filter(id=product_ids[0]).update(quantity=stock)
+    shared_stock = ProductInfo.objects.get(id=product_ids[1]).quantity
+    baskets = []
+    for _ in range(clients):
+        user = user_factory()
+        contact = baker.make('backend.Contact', user=user)
+        # второй товар - общий для всех, заказы блокируют несколько строк ProductInfo
+        basket = make_basket(user, [(product_ids[1], 1), (product_ids[0], 1)])
+        baskets.append((user.id, basket.id, contact.id))
+
+    queries = []
+
+    def run(args):
+        for attempt in range(1000):
+            try:
+                # connection - соединение этого потока
+                with CaptureQueriesContext(connection) as context:
+                    checkout(*args)
+                queries.append(len(db_queries(context)))
+                return 'ok'
+            except StockError:
+                return 'short'
+            except OperationalError:
+                # SQLite: параллельная запись в БД - повтор (в PostgreSQL запросы ждут блокировки строк)
+                sleep(0.01 * (attempt % 5 + 1))
+        return 'error'
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(run, baskets))
+    finally:
+        connections.close_all()
+    ordered, short = results.count('ok'), results.count('short')
+    # Каждый заказ либо оформлен, либо отклонён из-за нехватки товара, спрос больше остатка - продан весь остаток
+    assert ordered + short == clients and ordered == stock, results
+    # Остатки уменьшились ровно на кол-во оформленных заказов (отклонённые ничего не списали)
+    assert ProductInfo.objects.get(id=product_ids[0]).quantity == stock - ordered
+    assert ProductInfo.objects.get(id=product_ids[1]).quantity == shared_stock - ordered
+    assert Order.objects.filter(state='new').count() == ordered
+    assert Order.objects.filter(state='basket').count() == short
+    # Пропускная способность под конкуренцией: транзакция оформления (BEGIN ... COMMIT), которая держит блокировки,
+    # - постоянное число запросов: заказ, контакт, позиции, по UPDATE на каждый из 2 товаров, остатки в каталоге,
+    # магазины, сумма и сохранение заказа - независимо от кол-ва повторов и конкурирующих заказов
+    assert queries == [2 + 7 + 2] * ordered
+
+
+# Корзина в кэше (BASKET_CACHE), задачи celery выполняются сразу
+@pytest.fixture
+def cached_basket(settings, celery_eager):
+    settings.BASKET_CACHE = True
+    cache.clear()
+    yield
+    cache.clear()
+
+
+# Корзина в кэше: новая позиция сразу получает строку OrderItem (её id - id позиции, как без кэша),
+# изменения кол-ва и удаление позиций не пишутся в БД, пока не сработает отложенное сохранение
+@pytest.mark.django_db
+def test_cached_basket_write_behind(client, buyer, product_ids, cached_basket, settings):
+    cache.add(FLUSH_KEY.format(buyer.id), 1)  # сохранение корзины уже запланировано
+    post_items(client, [{'product_info': pk, 'quantity': 1} for pk in product_ids[:5]])
+    assert basket_items(buyer) == dict.fromkeys(product_ids[:5], 1)
+    ids = {item['product_info']['id']: item['id'] for item in client.get('/api/v1/basket').json()[0]['ordered_items']}
+    assert ids == dict(OrderItem.objects.filter(order__user=buyer).values_list('product_info_id', 'id'))
+    missing_id = max(ids.values()) + 1
+
+    with CaptureQueriesContext(connection) as queries:
+        response = post_items(client, [{'product_info': product_ids[0], 'quantity': 2}])
+        assert response.json() == {'Status': True, 'Создано объектов': 0, 'Обновлено объектов': 1}
+        data = client.put('/api/v1/basket', {'items': json.dumps([{'id': ids[product_ids[1]], 'quantity': 4},
+                                                                  {'id': ids[product_ids[2]], 'quantity': 0},
+                                                                  {'id': missing_id, 'quantity': 1}])}).json()
+        assert data['items'] == [{'id': ids[product_ids[1]], 'result': 'updated'},
+                                 {'id': ids[product_ids[2]], 'result': 'deleted'},
+                                 {'id': missing_id, 'result': 'not_found'}]
+        assert client.delete('/api/v1/basket', {'items': f'{ids[product_ids[3]]},{missing_id}'}).json() == \
+               {'Status': True, 'Удалено объектов': 1}
+    assert not [sql for sql in db_queries(queries) if 'backend_orderitem' in sql]
+    assert basket_items(buyer) == dict.fromkeys(product_ids[:5], 1)
+    # Товар, удалённый из корзины до её сохранения, добавляется снова в ту же строку OrderItem
+    post_items(client, [{'product_info': product_ids[3], 'quantity': 5}])
+
+    with CaptureQueriesContext(connection) as queries:
+        basket = client.get('/api/v1/basket').json()[0]
+    assert not db_queries(queries)
+    assert [(item['id'], item['quantity']) for item in basket['ordered_items']] == \
+           [(ids[product_ids[0]], 3), (ids[product_ids[1]], 4), (ids[product_ids[3]], 5), (ids[product_ids[4]], 1)]
+    assert basket['total_sum'] == sum(item['quantity'] * item['product_info']['price']
+                                      for item in basket['ordered_items'])
+
+    assert flush_basket(buyer.id)
+    assert basket_items(buyer) == {product_ids[0]: 3, product_ids[1]: 4, product_ids[3]: 5, product_ids[4]: 1}
+    # Корзина, которой нет в кэше, читается из БД, id позиций те же и без кэша
+    cache.clear()
+    assert client.get('/api/v1/basket').json()[0]['ordered_items'] == basket['ordered_items']
+    settings.BASKET_CACHE = False
+    items = client.get('/api/v1/basket').json()[0]['ordered_items']
+    assert sorted((item['id'], item['quantity']) for item in items) == \
+           [(item['id'], item['quantity']) for item in basket['ordered_items']]
+
+
+# Корзина в кэше сохраняется задачей celery после изменения и перед оформлением заказа, после - удаляется из кэша
+@pytest.mark.django_db
+def test_cached_basket_checkout(client, buyer, product_ids, cached_basket):
+    assert client.get('/api/v1/basket').json() == []
+    post_items(client, [{'product_info': pk, 'quantity': 2} for pk in product_ids[:3]])
+    assert basket_items(buyer) == dict.fromkeys(product_ids[:3], 2)
+    cache.add(FLUSH_KEY.format(buyer.id), 1)
+    post_items(client, [{'product_info': product_ids[3], 'quantity': 1}])
+    order_id = client.get('/api/v1/basket').json()[0]['id']
+    contact = baker.make('backend.Contact', user=buyer)
+    quantity = ProductInfo.objects.get(id=product_ids[3]).quantity
+    response = client.post('/api/v1/order', {'id': order_id, 'contact': contact.id})
+    assert response.status_code == 200
+    assert Order.objects.get(id=order_id).state == 'new'
+    assert dict(OrderItem.objects.filter(order_id=order_id).values_list('product_info_id', 'quantity')) == \
+           {**dict.fromkeys(product_ids[:3], 2), product_ids[3]: 1}
+    assert ProductInfo.objects.get(id=product_ids[3]).quantity == quantity - 1
+    assert client.get('/api/v1/basket').json() == []
+
+
+# Загрузка прайса с заменой товаров между добавлением в корзину в кэше и оформлением заказа:
+# удалённые товары убираются из корзины с сообщением покупателю, корзина сохраняется и оформляется без них
+@pytest.mark.django_db
+def test_cached_basket_replace_import(client, buyer, product_ids, cached_basket, shop_factory):
+    cache.add(FLUSH_KEY.format(buyer.id), 1)
+    post_items(client, [{'product_info': pk, 'quantity': 1} for pk in product_ids[:2]])
+    order_id = client.get('/api/v1/basket').json()[0]['id']
+    shop_factory(goods=40, user=ProductInfo.objects.get(id=product_ids[0]).shop.user)
+    assert not ProductInfo.objects.filter(id__in=product_ids).exists()
+    new_id = ProductInfo.objects.published().order_by('id').values_list('id', flat=True)[0]
+    post_items(client, [{'product_info': new_id, 'quantity': 3}])
+    contact = baker.make('backend.Contact', user=buyer)
+
+    response = client.post('/api/v1/order', {'id': order_id, 'contact': contact.id}).json()
+    assert response == {'Status': False,
+                        'Errors': f'Товары не найдены (удалены из корзины): {product_ids[0]}, {product_ids[1]}'}
+    assert [item['product_info']['id'] for item in client.get('/api/v1/basket').json()[0]['ordered_items']] == \
+           [new_id]
+    assert basket_items(buyer) == {new_id: 3}
+    # Сохранение корзины задачей celery тоже не падает на удалённых товарах
+    assert flush_basket(buyer.id)
+
+    assert client.post('/api/v1/order', {'id': order_id, 'contact': contact.id}).status_code == 200
+    assert Order.objects.get(id=order_id).state == 'new'
+    assert dict(OrderItem.objects.filter(order_id=order_id).values_list('product_info_id', 'quantity')) == \
+           {new_id: 3}
+
+
+def order_totals(order_id):
+    order = Order.objects.get(id=order_id)
+    return order.total_sum, order.items_count
+
+
+# Сумма и кол-во позиций корзины хранятся в Order и меняются вместе с позициями, при оформлении заказа - фиксируются
+@pytest.mark.django_db
+def test_order_totals(client, buyer, product_ids):
+    prices = dict(ProductInfo.objects.filter(id__in=product_ids[:3]).values_list('id', 'price'))
+    post_items(client, [{'product_info': pk, 'quantity': 2} for pk in product_ids[:3]])
+    basket = Order.objects.get(user=buyer, state='basket')
+    assert order_totals(basket.id) == (2 * sum(prices.values()), 3)
+
+    item_ids = dict(OrderItem.objects.filter(order=basket).values_list('product_info_id', 'id'))
+    client.put('/api/v1/basket', {'items': json.dumps([{'id': item_ids[product_ids[0]], 'quantity': 5}])})
+    client.delete('/api/v1/basket', {'items': str(item_ids[product_ids[1]])})
+    total = 5 * prices[product_ids[0]] + 2 * prices[product_ids[2]]
+    assert order_totals(basket.id) == (total, 2)
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get('/api/v1/basket').json()[0]['total_sum'] == total
+    assert not [sql for sql in db_queries(queries) if 'SUM(' in sql]
+
+    contact = baker.make('backend.Contact', user=buyer)
+    checkout(buyer.id, basket.id, contact.id)
+    ProductInfo.objects.filter(id=product_ids[0]).update(price=F('price') + 100)
+    orders = client.get('/api/v1/order').json()
+    assert [(order['id'], order['total_sum'], order['items_count']) for order in orders] == [(basket.id, total, 2)]
+
+
+# Магазин видит в заказе сумму только своих товаров, покупатель - сумму всего заказа
+@pytest.mark.django_db
+def test_partner_orders_shop_total(client, buyer, product_ids, shop_factory):
+    other_shop = shop_factory(goods=5, shop='Другой магазин', seed=1)
+    other_id = ProductInfo.objects.filter(shop__user=other_shop).values_list('id', flat=True).first()
+    prices = dict(ProductInfo.objects.filter(id__in=[product_ids[0], other_id]).values_list('id', 'price'))
+    post_items(client, [{'product_info': product_ids[0], 'quantity': 2}, {'product_info': other_id, 'quantity': 3}])
+    basket = Order.objects.get(user=buyer, state='basket')
+    checkout(buyer.id, basket.id, baker.make('backend.Contact', user=buyer).id)
+    assert order_totals(basket.id) == (2 * prices[product_ids[0]] + 3 * prices[other_id], 2)
+
+    for shop, total in ((ProductInfo.objects.get(id=product_ids[0]).shop.user, 2 * prices[product_ids[0]]),
+                        (other_shop, 3 * prices[other_id])):
+        client.force_authenticate(user=shop)
+        orders = client.get('/api/v1/partner/orders').json()
+        assert [(order['id'], order['total_sum'], len(order['ordered_items'])) for order in orders] == \
+               [(basket.id, total, 2)]
+
+
+def delete_product(client, product_info):
+    client.force_authenticate(user=product_info.shop.user)
+    assert client.delete(f'/api/v1/partner/product/{product_info.product_id}/').status_code == 204
+
+
+def delete_shop(client, product_info):
+    client.force_authenticate(user=product_info.shop.user)
+    assert client.delete(f'/api/v1/partner/shop/{product_info.shop_id}/').status_code == 204
+
+
+def delete_category(client, product_info):
+    # Через API категорию не удалить: у Category нет владельца для IsOwnerAdminOrReadOnly
+    PartnerCategorySet().perform_destroy(product_info.product.category)
+
+
+# Удаление товара, магазина или категории менеджером удаляет позиции корзин, суммы корзин пересчитываются
+@pytest.mark.parametrize('delete', [delete_product, delete_shop, delete_category])
+@pytest.mark.django_db
+def test_partner_delete_refreshes_baskets(client, buyer, product_ids, shop_factory, delete):
+    other_shop = shop_factory(goods=5, shop='Другой магазин', seed=1)
+    other_id = ProductInfo.objects.filter(shop__user=other_shop).values_list('id', flat=True).first()
+    post_items(client, [{'product_info': product_ids[0], 'quantity': 2}, {'product_info': other_id, 'quantity': 3}])
+    basket = Order.objects.get(user=buyer, state='basket')
+    assert order_totals(basket.id)[1] == 2
+
+    delete(client, ProductInfo.objects.select_related('shop__user', 'product').get(id=product_ids[0]))
+    items = OrderItem.objects.filter(order=basket)
+    assert len(items) < 2
+    assert order_totals(basket.id) == (sum(item.quantity * item.product_info.price for item in items), len(items))
+
+
+# Команда refresh_order_totals пересчитывает суммы корзин, позиции которых записаны в обход API.
+# Оформленные заказы не пересчитываются, --all заполняет только пустые суммы
+@pytest.mark.django_db
+def test_refresh_order_totals_command(buyer, product_ids, user_factory):
+    basket = make_basket(buyer, [(product_ids[0], 2), (product_ids[1], 1)])
+    old_order = make_basket(user_factory(), [(product_ids[0], 1)])
+    frozen = make_basket(user_factory(), [(product_ids[1], 1)])
+    Order.objects.filter(id__in=[old_order.id, frozen.id]).update(state='confirmed')
+    Order.objects.filter(id=frozen.id).update(total_sum=1, items_count=1)
+    assert order_totals(basket.id) == order_totals(old_order.id) == (None, None)
+    prices = dict(ProductInfo.objects.filter(id__in=product_ids[:2]).values_list('id', 'price'))
+
+    call_command('refresh_order_totals', stdout=io.StringIO())
+    assert order_totals(basket.id) == (2 * prices[product_ids[0]] + prices[product_ids[1]], 2)
+    assert order_totals(old_order.id) == (None, None)
+
+    call_command('refresh_order_totals', '--all', stdout=io.StringIO())
+    assert order_totals(old_order.id) == (prices[product_ids[0]], 1)
+    assert order_totals(frozen.id) == (1, 1)
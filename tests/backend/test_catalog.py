@@ -0,0 +1,437 @@
+import gzip
+import io
+import json
+from base64 import urlsafe_b64encode
+from urllib.parse import urlencode
+
+import pytest
+import yaml
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+
+from backend.catalog_cache import bump_catalog_version, check_shared_cache
+from backend.importer import PriceListImporter
+from backend.facets import facet_counts
+from backend.models import ProductInfo, Shop, CatalogEntry
+from backend.price_list import read_price_list
+from backend.search import search
+from backend.serializers import ProductInfoSerializer
+from tests.conftest import db_queries
+
+
+# Каждый тест начинает с чистого кэша (кэш ответов каталога включён: в тестах один процесс, общий кэш не нужен),
+# лимиты запросов (throttling) здесь не проверяются
+@pytest.fixture(autouse=True)
+def clear_cache(no_throttling, settings):
+    settings.CATALOG_CACHE = True
+    cache.clear()
+    yield
+    cache.clear()
+
+
+# Два магазина с товарами из сгенерированных прайсов
+@pytest.fixture
+def catalog(shop_factory):
+    for seed, shop in enumerate(('Магазин 1', 'Магазин 2')):
+        shop_factory(goods=25, shop=shop, seed=seed)
+
+
+def get_all_pages(client, url):
+    ids = []
+    while url:
+        data = client.get(url).json()
+        ids += [item['id'] for item in data['results']]
+        url = data['next']
+    return ids
+
+
+# Каталог выдаётся постранично по (магазин, id): страницы не пересекаются и содержат все товары
+@pytest.mark.django_db
+def test_products_pages(client, catalog):
+    ids = get_all_pages(client, '/api/v1/products?page_size=7')
+    assert ids == list(ProductInfo.objects.order_by('shop_id', 'id').values_list('id', flat=True))
+    assert len(ids) == 50
+    data = client.get('/api/v1/products').json()
+    assert len(data['results']) == 40 and data['next']
+
+
+# Размер страницы ограничен MAX_PAGE_SIZE, неверный курсор - 404
+@pytest.mark.django_db
+def test_products_page_size(client, catalog, settings):
+    response = client.get('/api/v1/products?page_size=100000')
+    assert len(response.json()['results']) == 50
+    assert client.get('/api/v1/products?page_size=0').json()['results'][0]['id']
+    assert client.get('/api/v1/products?cursor=bad').status_code == 404
+    for cursor in (['x', 'y'], [1], [1, None], [True, 2], {'shop_id': 1}):
+        encoded = urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+        response = client.get('/api/v1/products', {'cursor': encoded})
+        assert response.status_code == 404 and response.json() == {'detail': 'Invalid cursor'}
+
+
+# Страница каталога - один запрос к CatalogEntry, кол-во запросов не зависит от номера страницы
+@pytest.mark.django_db
+def test_products_page_queries(client, catalog):
+    first = client.get('/api/v1/products?page_size=5').json()
+    with CaptureQueriesContext(connection) as first_queries:
+        second = client.get(first['next']).json()
+    url = second['next']
+    for _ in range(5):
+        url = client.get(url).json()['next']
+    with CaptureQueriesContext(connection) as last_queries:
+        client.get(url)
+    assert len(db_queries(first_queries)) == len(db_queries(last_queries)) == 1
+    assert not any('OFFSET' in sql.upper() for sql in db_queries(last_queries))
+
+
+# Магазины Ozon и Tele2 из прайсов media/files
+@pytest.fixture
+def shops(user_factory):
+    for name in ('ozon.yaml', 'tele2.yaml'):
+        with open(f'media/files/{name}', 'rb') as file:
+            PriceListImporter(user_factory(type='shop').id).run(read_price_list(file))
+
+
+# Полнотекстовый поиск по названию, модели и значениям параметров (все слова, по началу слова)
+@pytest.mark.django_db
+def test_products_search(client, shops):
+    def found(query):
+        return [item['model'] for item in client.get('/api/v1/products', {'q': query}).json()['results']]
+
+    assert found('iphone xr') == ['apple/iphone/xr'] * 3
+    assert sorted(found('смартф черн')) == ['apple/iphone/xr', 'xiaomi/redmi/13 pro']
+    assert found('салатов') == ['xiaomi/redmi/13 pro']
+    assert found('nokia') == []
+    assert found('!!!') == []
+
+
+# Результаты поиска упорядочены по релевантности и выдаются постранично
+@pytest.mark.django_db
+def test_products_search_pages(client, shops):
+    everything = client.get('/api/v1/products', {'q': 'смартфон', 'page_size': 100}).json()['results']
+    assert len(everything) == 7
+    assert get_all_pages(client, '/api/v1/products?' + urlencode({'q': 'смартфон', 'page_size': 3})) == \
+           [item['id'] for item in everything]
+
+
+# Товары с одинаковой релевантностью на границе страниц не пропускаются и не повторяются:
+# релевантность из курсора (json) сравнивается с релевантностью в БД точно
+@pytest.mark.django_db
+def test_products_search_rank_ties(client, shops):
+    ranks = dict(search(CatalogEntry.objects.all(), 'iphone xr').values_list('pk', 'rank'))
+    assert len(ranks) == 3 and len(set(ranks.values())) < 3
+    for rank in set(ranks.values()):
+        assert search(CatalogEntry.objects.all(), 'iphone xr').filter(rank=json.loads(json.dumps(rank))).count() == \
+               list(ranks.values()).count(rank)
+    for page_size in (1, 2):
+        ids = get_all_pages(client, '/api/v1/products?' + urlencode({'q': 'iphone xr', 'page_size': page_size}))
+        assert sorted(ids) == sorted(ranks)
+
+
+# Индекс поиска следует за изменениями товаров: синхронизацией прайса и переименованием продукта
+@pytest.mark.django_db
+def test_products_search_updates(client, user_factory):
+    user = user_factory(type='shop', is_active=True)
+    data = yaml.safe_load(open('media/files/tele2.yaml', encoding='utf-8'))
+    PriceListImporter(user.id).run(data)
+    data['goods'][0]['parameters']['Цвет'] = 'бирюзовый'
+    PriceListImporter(user.id, mode='sync').run(data)
+    assert len(client.get('/api/v1/products', {'q': 'бирюзовый'}).json()['results']) == 1
+
+    product = ProductInfo.objects.get(external_id=data['goods'][1]['id']).product
+    client.force_authenticate(user=user)
+    response = client.put(f'/api/v1/partner/product/{product.id}/',
+                          {'name': 'Телефон Яблоко', 'category': product.category_id})
+    assert response.status_code == 200
+    assert len(client.get('/api/v1/products', {'q': 'яблоко'}).json()['results']) == 1
+
+
+# Фильтр по значениям параметров: по каждому параметру - любое из значений, все параметры сразу
+@pytest.mark.django_db
+def test_products_parameter_filter(client, shops):
+    def found(params):
+        return len(client.get('/api/v1/products?' + urlencode(params, doseq=True)).json()['results'])
+
+    assert found({'param.Встроенная память (Гб)': '256'}) == 4
+    assert found({'param.Встроенная память (Гб)': ['256', '512']}) == 6
+    assert found({'param.Встроенная память (Гб)': '256', 'param.Цвет': 'синий'}) == 1
+    assert found({'param.Цвет': 'синий', 'q': 'xiaomi'}) == 1
+    assert found({'param.Нет такого': '1'}) == 0
+
+
+# Счётчики фильтров: готовые (FacetCount) совпадают с посчитанными по товарам и обновляются загрузкой прайса
+@pytest.mark.django_db
+def test_products_facets(client, user_factory):
+    user = user_factory(type='shop')
+    data = yaml.safe_load(open('media/files/tele2.yaml', encoding='utf-8'))
+    PriceListImporter(user.id).run(data)
+    PriceListImporter(user_factory(type='shop').id).run(
+        yaml.safe_load(open('media/files/ozon.yaml', encoding='utf-8')))
+
+    facets = client.get('/api/v1/products', {'facets': 'true'}).json()['facets']
+    assert facets == facet_counts(ProductInfo.objects.published())
+    assert facets['Встроенная память (Гб)'] == {'128': 1, '256': 4, '512': 2}
+
+    response = client.get('/api/v1/products?' + urlencode({'facets': 1, 'param.Цвет': 'синий'}))
+    assert response.json()['facets']['Встроенная память (Гб)'] == {'256': 1, '512': 1}
+
+    shop_id = Shop.objects.get(user=user).id
+    del data['goods'][0]
+    PriceListImporter(user.id, mode='sync').run(data)
+    facets = client.get('/api/v1/products', {'facets': 'true', 'shop_id': shop_id}).json()['facets']
+    assert facets['Встроенная память (Гб)'] == {'256': 3}
+
+
+# Ответы каталога берутся из кэша без запросов к БД, загрузка прайса магазина сбрасывает кэш его товаров
+@pytest.mark.django_db
+def test_catalog_response_cache(client, shops, django_capture_on_commit_callbacks):
+    ozon = Shop.objects.get(name='Ozon')
+    tele2 = Shop.objects.get(name='Tele2')
+    urls = ['/api/v1/categories', '/api/v1/shops', '/api/v1/products?page_size=5',
+            f'/api/v1/products?shop_id={ozon.id}', f'/api/v1/products?shop_id={tele2.id}']
+    first = [client.get(url).json() for url in urls]
+    with CaptureQueriesContext(connection) as queries:
+        assert [client.get(url).json() for url in urls] == first
+    assert db_queries(queries) == []
+    # порядок и пустые query-параметры не меняют ключ кэша
+    with CaptureQueriesContext(connection) as queries:
+        client.get(f'/api/v1/products?q=&shop_id={ozon.id}')
+    assert db_queries(queries) == []
+
+    data = yaml.safe_load(open('media/files/ozon.yaml', encoding='utf-8'))
+    data['goods'][0]['price'] = 1
+    with django_capture_on_commit_callbacks(execute=True):
+        PriceListImporter(ozon.user_id, mode='sync').run(data)
+    with CaptureQueriesContext(connection) as queries:
+        client.get(urls[4])
+    assert db_queries(queries) == []  # товары другого магазина остались в кэше
+    prices = [item['price'] for item in client.get(urls[3]).json()['results']]
+    assert 1 in prices
+    assert 1 in [item['price'] for item in client.get(urls[2]).json()['results']]
+
+
+# Изменение магазина менеджером сбрасывает кэш списка магазинов
+@pytest.mark.django_db
+def test_catalog_cache_partner_edit(client, shops):
+    assert len(client.get('/api/v1/shops').json()['results']) == 2
+    ozon = Shop.objects.get(name='Ozon')
+    client.force_authenticate(user=ozon.user)
+    response = client.put(f'/api/v1/partner/shop/{ozon.id}/', {'name': 'Ozon', 'state': False})
+    assert response.status_code == 200
+    assert [shop['name'] for shop in client.get('/api/v1/shops').json()['results']] == ['Tele2']
+    assert client.get(f'/api/v1/products?shop_id={ozon.id}').json()['results'] == []
+
+
+# Новая категория менеджера сразу видна в списке категорий (кэш и ETag сброшены)
+@pytest.mark.django_db
+def test_catalog_cache_partner_category(client, shops):
+    response = client.get('/api/v1/categories')
+    count = len(response.json()['results'])
+    etag = response['ETag']
+    client.force_authenticate(user=Shop.objects.get(name='Ozon').user)
+    assert client.post('/api/v1/partner/categories/', {'name': 'Новая категория'}).status_code == 201
+    response = client.get('/api/v1/categories', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert len(response.json()['results']) == count + 1
+
+
+def product_infos_data():
+    return ProductInfoSerializer(ProductInfo.objects.published().order_by('shop_id', 'id'), many=True).data
+
+
+# Каталог для покупателей совпадает с товарами из основных таблиц после загрузки, синхронизации прайса
+# и изменений менеджеров
+@pytest.mark.django_db
+def test_catalog_entries(client, shops):
+    ozon = Shop.objects.get(name='Ozon')
+    data = yaml.safe_load(open('media/files/ozon.yaml', encoding='utf-8'))
+    data['goods'][0]['price'] = 1
+    data['goods'][1]['parameters']['Цвет'] = 'бирюзовый'
+    del data['goods'][2]
+    PriceListImporter(ozon.user_id, mode='sync').run(data)
+    product = ProductInfo.objects.published().filter(shop=ozon).first().product
+    client.force_authenticate(user=ozon.user)
+    assert client.put(f'/api/v1/partner/product/{product.id}/',
+                      {'name': 'Телефон', 'category': product.category_id}).status_code == 200
+    assert client.put(f'/api/v1/partner/shop/{ozon.id}/', {'name': 'Ozon', 'state': True}).status_code == 200
+
+    results = client.get('/api/v1/products', {'page_size': 100}).json()['results']
+    assert results == product_infos_data()
+    assert CatalogEntry.objects.count() == ProductInfo.objects.count()
+
+
+# Товары незавершённой загрузки прайса (replace) не видны покупателям до публикации
+@pytest.mark.django_db
+def test_catalog_entries_staged(client, user_factory):
+    user = user_factory(type='shop')
+    data = yaml.safe_load(open('media/files/tele2.yaml', encoding='utf-8'))
+    PriceListImporter(user.id).run(data)
+    before = client.get('/api/v1/products').json()['results']
+    seen = []
+    data['goods'][0]['price'] = 1
+    PriceListImporter(user.id, batch_size=2, progress=lambda stats: seen.append(
+        list(CatalogEntry.objects.filter(visible=True).values_list('pk', flat=True)))).run(data)
+    assert len(seen) > 1
+    assert all(ids == [item['id'] for item in before] for ids in seen)
+    cache.clear()
+    after = client.get('/api/v1/products').json()['results']
+    assert after == product_infos_data()
+    assert after[0]['price'] == 1
+
+
+# Команда refresh_catalog заполняет каталог по основным таблицам
+@pytest.mark.django_db
+def test_refresh_catalog_command(shops):
+    expected = list(CatalogEntry.objects.order_by('pk').values())
+    CatalogEntry.objects.all().delete()
+    call_command('refresh_catalog', stdout=io.StringIO())
+    assert list(CatalogEntry.objects.order_by('pk').values()) == expected
+
+
+# Фильтр по диапазону цен и сортировка по цене, страницы продолжают друг друга
+@pytest.mark.django_db
+def test_products_price_ordering(client, catalog):
+    entries = CatalogEntry.objects.filter(price__gte=50000, price__lte=150000)
+    for ordering, expected in (('price', entries.order_by('price', 'pk')),
+                               ('-price', entries.order_by('-price', '-pk'))):
+        ids = get_all_pages(client, '/api/v1/products?price_min=50000&price_max=150000&page_size=4'
+                                    f'&ordering={ordering}')
+        assert ids == list(expected.values_list('pk', flat=True))
+        assert len(ids) > 4
+    assert client.get('/api/v1/products?ordering=name').status_code == 400
+    assert client.get('/api/v1/products?price_min=abc').status_code == 400
+
+
+# Счётчики фильтров учитывают фильтр по цене
+@pytest.mark.django_db
+def test_products_price_facets(client, catalog):
+    response = client.get('/api/v1/products', {'facets': 'true', 'price_min': 10 ** 9}).json()
+    assert response['results'] == [] and response['facets'] == {}
+    facets = client.get('/api/v1/products', {'facets': 'true', 'price_min': 50000, 'price_max': 150000}).json()[
+        'facets']
+    assert facets == facet_counts(CatalogEntry.objects.filter(price__gte=50000, price__lte=150000))
+    assert facets != client.get('/api/v1/products', {'facets': 'true'}).json()['facets']
+
+
+# Каталог категории по цене читается по индексу (category_id, price, id) без сортировки всех товаров категории
+@pytest.mark.django_db
+def test_products_price_ordering_index(client, catalog):
+    if connection.vendor != 'sqlite':
+        pytest.skip('план запроса SQLite')
+    category_id = CatalogEntry.objects.values_list('category_id', flat=True).first()
+    with CaptureQueriesContext(connection) as queries:
+        client.get(f'/api/v1/products?category_id={category_id}&ordering=price&page_size=5')
+    sql = db_queries(queries)[0]
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+    assert 'catalog_entry_cat_price_idx' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+# Условные запросы: с актуальным ETag или Last-Modified ответ 304 без тела и без запросов к БД,
+# после изменения каталога - новый ETag
+@pytest.mark.django_db
+def test_catalog_conditional_get(client, shops, django_capture_on_commit_callbacks):
+    ozon = Shop.objects.get(name='Ozon')
+    url = f'/api/v1/products?shop_id={ozon.id}'
+    response = client.get(url)
+    etag = response['ETag']
+    assert client.get(url)['ETag'] == etag  # ответ из кэша
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304 and not response.content
+    assert db_queries(queries) == []
+    # Last-Modified (точность - секунда) не отдаётся и не проверяется: 304 - только по ETag
+    assert 'Last-Modified' not in response
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT').status_code == 200
+    assert client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code == 200
+    assert client.get('/api/v1/shops', HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    data = yaml.safe_load(open('media/files/ozon.yaml', encoding='utf-8'))
+    data['goods'][0]['price'] = 1
+    with django_capture_on_commit_callbacks(execute=True):
+        PriceListImporter(ozon.user_id, mode='sync').run(data)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response['ETag'] != etag
+
+
+# Два изменения каталога в одну секунду: ответ на условный запрос после второго - новый, а не 304
+@pytest.mark.django_db
+def test_catalog_conditional_get_same_second(client, shops, monkeypatch):
+    monkeypatch.setattr('backend.catalog_cache.time_ns', lambda: 10 ** 18)
+    bump_catalog_version(everything=True)
+    etag = client.get('/api/v1/shops')['ETag']
+    monkeypatch.setattr('backend.catalog_cache.time_ns', lambda: 10 ** 18 + 1)
+    bump_catalog_version(everything=True)
+    for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': http_date(10 ** 9)}):
+        response = client.get('/api/v1/shops', **headers)
+        assert response.status_code == 200 and response['ETag'] != etag
+
+
+# Кэш ответов каталога работает только с общим кэшем (redis), без CATALOG_CACHE ответы не кэшируются
+@pytest.mark.django_db
+def test_catalog_cache_settings(client, shops, settings, tmp_path):
+    with pytest.raises(ImproperlyConfigured):
+        check_shared_cache()
+    # кэш в файлах общий для процессов (как redis, но без сервера в тестах)
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                   'LOCATION': str(tmp_path)}}
+    check_shared_cache()
+
+    settings.CATALOG_CACHE = False
+    check_shared_cache()
+    response = client.get('/api/v1/categories')
+    assert 'ETag' not in response
+    with CaptureQueriesContext(connection) as queries:
+        client.get('/api/v1/categories')
+    assert db_queries(queries)
+
+
+# Выбор полей ответа: fields - только перечисленные поля, expand - вложенные объекты,
+# из БД загружаются только нужные столбцы одним запросом
+@pytest.mark.django_db
+def test_products_sparse_fields(client, catalog):
+    full = client.get('/api/v1/products?ordering=price&page_size=5').json()['results']
+    with CaptureQueriesContext(connection) as queries:
+        lean = client.get('/api/v1/products?ordering=price&page_size=5&fields=id,price').json()
+    assert lean['results'] == [{'id': item['id'], 'price': item['price']} for item in full]
+    sql = db_queries(queries)
+    assert len(sql) == 1 and '"parameters"' not in sql[0] and '"search_text"' not in sql[0]
+    assert get_all_pages(client, '/api/v1/products?ordering=price&page_size=7&fields=id') == \
+           get_all_pages(client, '/api/v1/products?ordering=price&page_size=7')
+
+    expanded = client.get('/api/v1/products?ordering=price&page_size=5&expand=product_parameters').json()['results']
+    assert expanded == [{key: value for key, value in item.items() if key != 'product'} for item in full]
+    assert client.get('/api/v1/products?ordering=price&page_size=5&fields=id&expand=product').json()['results'] == \
+           [{'id': item['id'], 'product': item['product']} for item in full]
+
+    # Неизвестные поля - 400 со списком этих полей
+    for params, unknown in (('fields=foo', 'foo'), ('fields=id,foo,bar', 'bar, foo'), ('expand=price', 'price')):
+        response = client.get(f'/api/v1/products?{params}')
+        assert response.status_code == 400 and response.json()['Errors'] == f'Неизвестные поля: {unknown}'
+
+
+# Выгрузка каталога в NDJSON: потоком по пакетам, те же товары, что и в /products, по запросу - в gzip
+@pytest.mark.django_db
+def test_products_export(client, catalog, settings):
+    settings.CATALOG_EXPORT_CHUNK_SIZE = 7
+    response = client.get('/api/v1/products/export')
+    assert response.streaming and response['Content-Type'].startswith('application/x-ndjson')
+    chunks = list(response.streaming_content)
+    assert len(chunks) == 8  # 50 товаров по 7
+    items = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    expected = client.get('/api/v1/products?page_size=100').json()['results']
+    assert items == sorted(expected, key=lambda item: item['id'])
+
+    response = client.get('/api/v1/products/export', HTTP_ACCEPT_ENCODING='gzip, deflate')
+    assert response['Content-Encoding'] == 'gzip'
+    content = gzip.decompress(b''.join(response.streaming_content)).decode()
+    assert [json.loads(line) for line in content.splitlines()] == items
+
+    shop_id = expected[0]['shop']
+    content = b''.join(client.get(f'/api/v1/products/export?shop_id={shop_id}').streaming_content).decode()
+    assert len(content.splitlines()) == len([item for item in expected if item['shop'] == shop_id])
@@ -0,0 +1,468 @@
+import io
+import json
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from kombu.exceptions import OperationalError
+from rest_framework.authtoken.models import Token
+from yaml import load as load_yaml, Loader, safe_dump as dump_yaml
+
+from backend.benchmark import generate_price_list, run_case, compare_results
+from backend.basket import refresh_totals
+from backend.importer import PriceListImporter, CatalogCache
+from backend.price_list import read_price_list, validate_price_list
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, ImportJob, \
+    UploadFiles, Order, OrderItem
+
+
+def load_price_list(name):
+    with open(f'media/files/{name}', encoding='utf-8') as file:
+        return load_yaml(file, Loader=Loader)
+
+
+# Загрузка прайса пакетами: все товары и параметры из yaml-файла записаны в БД
+@pytest.mark.django_db
+def test_importer_run(user_factory):
+    user = user_factory(type='shop')
+    data = load_price_list('ozon.yaml')
+    stats = PriceListImporter(user.id, batch_size=2).run(data)
+    shop = Shop.objects.get(user_id=user.id)
+    assert shop.name == 'Ozon'
+    assert stats['rows'] == len(data['goods']) == ProductInfo.objects.filter(shop=shop).count()
+    assert stats['parameters'] == ProductParameter.objects.count()
+    assert stats['queries'] > 0
+    assert set(Category.objects.filter(shops=shop).values_list('id', flat=True)) == \
+           {category['id'] for category in data['categories']}
+    product_info = ProductInfo.objects.get(shop=shop, external_id=data['goods'][0]['id'])
+    assert product_info.model == data['goods'][0]['model']
+    assert product_info.product.name == data['goods'][0]['name']
+    assert {(parameter.parameter.name, parameter.value) for parameter in product_info.product_parameters.all()} == \
+           {(name, str(value)) for name, value in data['goods'][0]['parameters'].items()}
+
+
+# Повторная загрузка: старые товары магазина заменяются, Продукты и Параметры не дублируются
+@pytest.mark.django_db
+def test_importer_reload(user_factory):
+    user = user_factory(type='shop')
+    data = load_price_list('ozon.yaml')
+    PriceListImporter(user.id).run(data)
+    products, parameters = Product.objects.count(), Parameter.objects.count()
+    PriceListImporter(user.id).run(data)
+    assert ProductInfo.objects.count() == len(data['goods'])
+    assert Product.objects.count() == products
+    assert Parameter.objects.count() == parameters
+
+
+# Второй магазин переиспользует Категории, Продукты и Параметры первого
+@pytest.mark.django_db
+def test_importer_two_shops(user_factory):
+    ozon, tele2 = load_price_list('ozon.yaml'), load_price_list('tele2.yaml')
+    PriceListImporter(user_factory(type='shop').id).run(ozon)
+    PriceListImporter(user_factory(type='shop').id).run(tele2)
+    assert ProductInfo.objects.count() == len(ozon['goods']) + len(tele2['goods'])
+    assert Category.objects.count() == 3
+    assert Category.objects.get(id=224).shops.count() == 2
+
+
+# Режим sync: записываются только изменения, id неизменённых товаров сохраняются
+@pytest.mark.django_db
+def test_importer_sync(user_factory):
+    user = user_factory(type='shop')
+    data = load_price_list('ozon.yaml')
+    PriceListImporter(user.id).run(data)
+    ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+
+    changed, removed = data['goods'][0], data['goods'].pop(1)
+    changed['price'] += 100
+    changed['parameters']['Цвет'] = 'белый'
+    added = dict(data['goods'][1], id=999000111)
+    data['goods'].append(added)
+
+    stats = PriceListImporter(user.id, mode='sync').run(data)
+    assert (stats['created'], stats['updated'], stats['deleted']) == (1, 1, 1)
+    assert stats['unchanged'] == len(data['goods']) - 2
+    assert stats['parameters'] == len(changed['parameters']) + len(added['parameters'])
+    product_info = ProductInfo.objects.get(external_id=changed['id'])
+    assert product_info.id == ids[changed['id']]
+    assert product_info.price == changed['price']
+    assert product_info.product_parameters.get(parameter__name='Цвет').value == 'белый'
+    assert not ProductInfo.objects.filter(external_id=removed['id']).exists()
+    assert ProductInfo.objects.count() == len(data['goods'])
+    for item in data['goods'][1:-1]:
+        assert ProductInfo.objects.get(external_id=item['id']).id == ids[item['id']]
+
+
+# Режим sync без изменений в прайсе - в БД ничего не пишется
+@pytest.mark.django_db
+def test_importer_sync_unchanged(user_factory):
+    user = user_factory(type='shop')
+    data = load_price_list('tele2.yaml')
+    PriceListImporter(user.id).run(data)
+    stats = PriceListImporter(user.id, mode='sync').run(data)
+    assert stats['unchanged'] == len(data['goods'])
+    assert (stats['created'], stats['updated'], stats['deleted'], stats['parameters']) == (0, 0, 0, 0)
+
+
+def make_order(user, state, items):
+    order = Order.objects.create(user=user, state=state)
+    OrderItem.objects.bulk_create([OrderItem(order=order, product_info=product_info, quantity=quantity)
+                                   for product_info, quantity in items])
+    refresh_totals([order.id])
+    return Order.objects.get(id=order.id)
+
+
+# Загрузка прайса пересчитывает суммы корзин с изменёнными и удалёнными товарами, оформленные заказы не меняются
+@pytest.mark.django_db
+def test_importer_sync_refreshes_baskets(user_factory):
+    user, buyer = user_factory(type='shop'), user_factory()
+    data = load_price_list('ozon.yaml')
+    PriceListImporter(user.id).run(data)
+    changed, removed, kept = (ProductInfo.objects.get(external_id=item['id']) for item in data['goods'][:3])
+    basket = make_order(buyer, 'basket', [(changed, 2), (removed, 1), (kept, 1)])
+    order = make_order(user_factory(), 'new', [(changed, 2), (removed, 1)])
+
+    data['goods'][0]['price'] += 100
+    data['goods'].pop(1)
+    PriceListImporter(user.id, mode='sync').run(data)
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (2 * (changed.price + 100) + kept.price, 2)
+    assert Order.objects.get(id=order.id).total_sum == order.total_sum
+
+
+@pytest.mark.django_db
+def test_importer_replace_refreshes_baskets(user_factory):
+    user, buyer = user_factory(type='shop'), user_factory()
+    data = load_price_list('ozon.yaml')
+    PriceListImporter(user.id).run(data)
+    basket = make_order(buyer, 'basket', [(product_info, 1) for product_info in ProductInfo.objects.all()[:2]])
+    assert basket.items_count == 2
+
+    PriceListImporter(user.id).run(data)
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (0, 0)
+
+
+# Режим replace: новые товары не видны покупателям, пока загрузка не завершится.
+# Сбой посреди загрузки оставляет опубликованным старый каталог, недописанные товары удаляются следующей загрузкой
+@pytest.mark.django_db
+def test_importer_staged_swap(user_factory):
+    user = user_factory(type='shop')
+    data = load_price_list('ozon.yaml')
+    PriceListImporter(user.id).run(data)
+    published = set(ProductInfo.objects.published().values_list('id', flat=True))
+
+    def broken_goods():
+        yield from data['goods'][:2]
+        assert set(ProductInfo.objects.published().values_list('id', flat=True)) == published
+        raise ValueError('обрыв загрузки')
+
+    with pytest.raises(ValueError):
+        PriceListImporter(user.id, batch_size=1).run(dict(data, goods=broken_goods()))
+    assert set(ProductInfo.objects.published().values_list('id', flat=True)) == published
+    assert ProductInfo.objects.count() == len(published) + 2
+
+    PriceListImporter(user.id).run(data)
+    shop = Shop.objects.get(user_id=user.id)
+    assert shop.catalog_version == 2
+    assert ProductInfo.objects.published().count() == ProductInfo.objects.count() == len(data['goods'])
+    assert not published & set(ProductInfo.objects.values_list('id', flat=True))
+
+
+# Потоковое чтение прайса (yaml и json) даёт тот же результат, что и загрузка документа целиком
+@pytest.mark.parametrize('dump', [lambda data: json.dumps(data, ensure_ascii=False),
+                                  lambda data: dump_yaml(data, allow_unicode=True, sort_keys=False)])
+def test_read_price_list(dump):
+    data = load_price_list('tele2.yaml')
+    price_list = read_price_list(io.BytesIO(dump(data).encode()))
+    assert price_list['shop'] == data['shop']
+    assert price_list['categories'] == data['categories']
+    assert not isinstance(price_list['goods'], list)  # товары читаются по мере обхода
+    assert list(price_list['goods']) == data['goods']
+
+
+# Раздел goods перед shop и categories - прайс всё равно читается
+def test_read_price_list_goods_first():
+    data = load_price_list('ozon.yaml')
+    stream = io.StringIO(json.dumps({'goods': data['goods'], 'shop': data['shop'],
+                                     'categories': data['categories']}))
+    assert read_price_list(stream) == data
+
+
+# Загрузка в БД прайса, прочитанного потоком
+@pytest.mark.django_db
+def test_importer_stream(user_factory):
+    user = user_factory(type='shop')
+    with open('media/files/tele2.yaml', 'rb') as file:
+        stats = PriceListImporter(user.id, batch_size=3).run(read_price_list(file))
+    assert stats['rows'] == ProductInfo.objects.count() == len(load_price_list('tele2.yaml')['goods'])
+
+
+# Вместо скачивания по ссылке прайс читается из папки media/files (имя файла - последняя часть url).
+# ETag файла - его имя, на условный запрос с этим ETag "сервер" отвечает 304
+@contextmanager
+def open_local_url(url, timeout=60, etag='', last_modified=''):
+    name = url.rsplit('/', 1)[-1]
+    if etag == name:
+        yield SimpleNamespace(raw=None, status_code=304, headers={})
+        return
+    with open(f'media/files/{name}', 'rb') as file:
+        yield SimpleNamespace(raw=file, status_code=200, headers={'ETag': name})
+
+
+@pytest.fixture
+def shop_client(client, user_factory):
+    user = user_factory(type='shop', is_active=True)
+    Token.objects.create(user=user)
+    client.force_authenticate(user=user, token=user.auth_token)
+    client.user = user
+    return client
+
+
+# Загрузка прайса ставится в очередь celery, ход загрузки смотрится по id загрузки
+@pytest.mark.django_db
+def test_partner_update_job(shop_client, celery_eager, monkeypatch):
+    monkeypatch.setattr('backend.tasks.open_url', open_local_url)
+    response = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/ozon.yaml'})
+    data = response.json()
+    assert data['Status']
+    response = shop_client.get(data['status_url'])
+    assert response.status_code == 200
+    job = response.json()
+    assert job['id'] == data['job_id']
+    assert job['state'] == 'done'
+    assert job['rows'] == job['stats']['created'] == ProductInfo.objects.filter(shop__user=shop_client.user).count()
+    assert job['errors'] == []
+
+
+# Пока загрузка магазина не завершена, вторая загрузка в очередь не ставится
+@pytest.mark.django_db
+def test_partner_update_job_dedup(shop_client):
+    job = ImportJob.objects.create(user=shop_client.user, url='http://example.com/files/ozon.yaml')
+    response = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/tele2.yaml'})
+    data = response.json()
+    assert not data['Status']
+    assert data['job_id'] == job.id
+    assert ImportJob.objects.count() == 1
+
+
+# Ошибка загрузки сохраняется в ImportJob
+@pytest.mark.django_db
+def test_partner_update_job_failed(shop_client, celery_eager, monkeypatch):
+    monkeypatch.setattr('backend.tasks.open_url', open_local_url)
+    response = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/missing.yaml'})
+    job = ImportJob.objects.get(id=response.json()['job_id'])
+    assert job.state == 'failed'
+    assert 'FileNotFoundError' in job.errors[0]
+    # после ошибки можно снова загружать прайс
+    response = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/ozon.yaml'})
+    assert response.json()['Status']
+
+
+# Брокер celery недоступен: загрузка помечается ошибкой и не блокирует следующие загрузки магазина
+@pytest.mark.django_db
+def test_partner_update_queue_failed(shop_client, monkeypatch, settings):
+    def delay(job_id):
+        raise OperationalError('Error 111 connecting to redis')
+
+    monkeypatch.setattr('backend.views.import_price_list_task.delay', delay)
+    response = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/ozon.yaml'})
+    assert response.status_code == 503
+    assert not response.json()['Status']
+    job = ImportJob.objects.get(id=response.json()['job_id'])
+    assert job.state == 'failed'
+    assert job.errors == ['OperationalError: Error 111 connecting to redis']
+
+    # следующая загрузка ставится в очередь (здесь - для команды import_price_lists, без брокера)
+    settings.PRICE_LIST_IMPORT_CELERY = False
+    response = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/ozon.yaml'})
+    assert response.json()['Status']
+    assert ImportJob.objects.get(id=response.json()['job_id']).state == 'queued'
+
+
+# Загрузка из файла, загруженного менеджером: файл читается из хранилища, без запроса по http
+@pytest.mark.django_db
+def test_partner_update_upload(shop_client, celery_eager, monkeypatch):
+    monkeypatch.setattr('backend.tasks.open_url', None)
+    upload = UploadFiles.objects.create(user=shop_client.user, email=shop_client.user.email, name='Прайс Tele2',
+                                        file='files/tele2.yaml')
+    response = shop_client.get('/api/v1/partner/update')
+    assert 'Прайс Tele2' in response.content.decode()
+    response = shop_client.post('/api/v1/partner/update', {'file_id': upload.id, 'mode': 'sync'})
+    job = ImportJob.objects.get(id=response.json()['job_id'])
+    assert (job.state, job.upload, job.url) == ('done', upload, '')
+    assert job.stats['created'] == ProductInfo.objects.filter(shop__name='Tele2').count() > 0
+
+
+# Чужой файл загрузить нельзя
+@pytest.mark.django_db
+def test_partner_update_foreign_upload(shop_client, user_factory):
+    other = user_factory(type='shop')
+    upload = UploadFiles.objects.create(user=other, email=other.email, name='Чужой прайс', file='files/ozon.yaml')
+    response = shop_client.post('/api/v1/partner/update', {'file_id': upload.id})
+    assert not response.json()['Status']
+    assert not ImportJob.objects.exists()
+
+
+# Повторная загрузка того же файла пропускается по хэшу, с force - загружается
+@pytest.mark.django_db
+def test_partner_update_unchanged_upload(shop_client, celery_eager):
+    upload = UploadFiles.objects.create(user=shop_client.user, email=shop_client.user.email, name='Прайс Ozon',
+                                        file='files/ozon.yaml')
+    copy = UploadFiles.objects.create(user=shop_client.user, email=shop_client.user.email, name='Копия',
+                                      file='files/ozon.yaml')
+    jobs = [shop_client.post('/api/v1/partner/update', data).json()['job_id']
+            for data in ({'file_id': upload.id}, {'file_id': copy.id}, {'file_id': copy.id, 'force': 'on'})]
+    stats = [ImportJob.objects.get(id=job_id).stats for job_id in jobs]
+    assert stats[0]['created'] > 0
+    assert stats[1]['skipped']
+    assert not stats[2].get('skipped') and stats[2]['created'] == stats[0]['created']
+
+
+# Повторная загрузка по той же ссылке - условный запрос, неизменённый файл не скачивается
+@pytest.mark.django_db
+def test_partner_update_not_modified(shop_client, celery_eager, monkeypatch):
+    monkeypatch.setattr('backend.tasks.open_url', open_local_url)
+    url = 'http://example.com/files/tele2.yaml'
+    first = shop_client.post('/api/v1/partner/update', {'url': url}).json()['job_id']
+    assert Shop.objects.get(user=shop_client.user).import_etag == 'tele2.yaml'
+    second = shop_client.post('/api/v1/partner/update', {'url': url}).json()['job_id']
+    assert ImportJob.objects.get(id=first).stats['created'] > 0
+    job = ImportJob.objects.get(id=second)
+    assert job.state == 'done'
+    assert job.stats['skipped']
+    assert 'ETag' in job.stats['message']
+
+
+# Очередь загрузок разбирает команда import_price_lists (без celery), справочники берутся из общего кэша
+@pytest.mark.django_db
+def test_import_price_lists_command(shop_client, user_factory, settings):
+    settings.PRICE_LIST_IMPORT_CELERY = False
+    job_id = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/ozon.yaml'}).json()['job_id']
+    assert ImportJob.objects.get(id=job_id).state == 'queued'
+    ImportJob.objects.filter(id=job_id).delete()
+    users = [shop_client.user, user_factory(type='shop')]
+    jobs = [ImportJob.objects.create(user=user, upload=UploadFiles.objects.create(
+        user=user, email=user.email, name=name, file=f'files/{name}'))
+        for user, name in zip(users, ('ozon.yaml', 'tele2.yaml'))]
+
+    out = io.StringIO()
+    call_command('import_price_lists', '--workers', '1', stdout=out)
+    assert {job.state for job in ImportJob.objects.all()} == {'done'}
+    assert f'Загрузка {jobs[1].id}: done' in out.getvalue()
+    assert set(Shop.objects.values_list('name', flat=True)) == {'Ozon', 'Tele2'}
+    assert ProductInfo.objects.published().count() == \
+           len(load_price_list('ozon.yaml')['goods']) + len(load_price_list('tele2.yaml')['goods'])
+    assert Parameter.objects.count() == len(set(Parameter.objects.values_list('name', flat=True)))
+
+
+# С общим кэшем справочники не перечитываются из БД для каждого прайса
+@pytest.mark.django_db
+def test_importer_catalog_cache(user_factory):
+    cache = CatalogCache.load()
+    first = PriceListImporter(user_factory(type='shop').id, cache=cache).run(load_price_list('ozon.yaml'))
+    assert cache.categories == set(Category.objects.values_list('id', flat=True))
+    assert cache.parameters == dict(Parameter.objects.values_list('name', 'id'))
+    data = load_price_list('ozon.yaml')
+    second = PriceListImporter(user_factory(type='shop').id, cache=cache).run(data)
+    uncached = PriceListImporter(user_factory(type='shop').id).run(data)
+    assert second['queries'] < uncached['queries'] < first['queries']
+
+
+# Сгенерированный прайс читается и загружается, как прайс магазина
+@pytest.mark.django_db
+def test_benchmark_run_case(tmp_path):
+    path = tmp_path / 'price_list.yaml'
+    with open(path, 'w', encoding='utf-8') as stream:
+        generate_price_list(stream, goods=50, categories=3, parameters=5, values=2, item_parameters=3)
+    with open(path, 'rb') as file:
+        data = read_price_list(file)
+        goods = list(data['goods'])
+    assert len(data['categories']) == 3
+    assert len(goods) == 50
+    assert {len(item['parameters']) for item in goods} == {3}
+    assert {value for item in goods for value in item['parameters'].values()} == {'значение 0', 'значение 1'}
+
+    result = run_case(path, batch_size=20)
+    assert result['replace']['created'] == result['sync']['unchanged'] == 50
+    assert result['replace']['queries'] > result['sync']['queries']
+    assert result['peak_rss_mb'] > 0
+
+    old = {'cases': [dict(result, goods=50)]}
+    slow = json.loads(json.dumps(old))
+    slow['cases'][0]['replace']['rows_per_sec'] = result['replace']['rows_per_sec'] / 2
+    report = compare_results(old, slow)
+    assert 'РЕГРЕССИЯ' in report[0]
+    assert 'РЕГРЕССИЯ' not in report[1]
+
+
+# Проверка прайса находит все ошибки структуры, прайс без ошибок проходит проверку
+def test_validate_price_list():
+    with open('media/files/ozon.yaml', 'rb') as file:
+        assert validate_price_list(file) == (3, [])
+    data = load_price_list('ozon.yaml')
+    del data['goods'][0]['price']
+    data['goods'][1]['category'] = 999
+    data['goods'][1]['quantity'] = -1
+    data['goods'][2]['id'] = data['goods'][0]['id']
+    rows, errors = validate_price_list(io.StringIO(json.dumps(data)))
+    assert rows == 3
+    assert errors == [f'goods[0] (id {data["goods"][0]["id"]}): нет поля price',
+                      f'goods[1] (id {data["goods"][1]["id"]}).quantity: отрицательное значение -1',
+                      f'goods[1] (id {data["goods"][1]["id"]}).category: категории 999 нет в разделе categories',
+                      f'goods[2] (id {data["goods"][0]["id"]}): внешний ИД повторяется']
+    rows, errors = validate_price_list(io.StringIO('shop: Ozon\ngoods: [1, 2, 3]'), max_errors=2)
+    assert errors == ['categories: ожидается список категорий', 'goods[0]: ожидается словарь с полями товара',
+                      '... и ещё 2 ошибок']
+    assert 'Ошибка разбора файла' in validate_price_list(io.StringIO('shop: [Ozon'))[1][0]
+
+
+# Значения, которые не поместятся в поля БД (длина строк, диапазон чисел, параметры - не строки и не числа),
+# находятся проверкой до записи в БД
+def test_validate_price_list_limits():
+    data = load_price_list('ozon.yaml')
+    data['shop'] = 'М' * 51
+    data['categories'][0]['name'] = 'К' * 41
+    first, second, third = data['goods']
+    first['name'], first['model'] = 'Т' * 81, 'М' * 81
+    first['price'], first['quantity'] = 2 ** 31, -1
+    second['id'] = -5
+    second['parameters'] = {'П' * 41: 'x', 'Цвет': 'ч' * 101, 'Размеры': [1, 2], 'Вес': None, 5: 'x'}
+    third['price_rrc'] = 10 ** 12
+    # yaml: в json название параметра 5 стало бы строкой
+    rows, errors = validate_price_list(io.StringIO(dump_yaml(data, allow_unicode=True)))
+    assert rows == 3
+    goods = [f'goods[{index}] (id {item["id"]})' for index, item in enumerate(data['goods'])]
+    assert errors == ['shop: длина 51 больше 50',
+                      'categories[0].name: длина 41 больше 40',
+                      f'{goods[0]}.model: длина 81 больше 80',
+                      f'{goods[0]}.name: длина 81 больше 80',
+                      f'{goods[0]}.price: значение 2147483648 вне диапазона -2147483648..2147483647',
+                      f'{goods[0]}.quantity: отрицательное значение -1',
+                      f'{goods[1]}.id: отрицательное значение -5',
+                      f"{goods[1]}.parameters['{'П' * 41}']: название - длина 41 больше 40",
+                      f"{goods[1]}.parameters['Цвет']: значение - длина 101 больше 100",
+                      f"{goods[1]}.parameters['Размеры']: ожидается строка или число, получено [1, 2]",
+                      f"{goods[1]}.parameters['Вес']: ожидается строка или число, получено None",
+                      f'{goods[1]}.parameters: название параметра 5 - не строка',
+                      f'{goods[2]}.price_rrc: значение 1000000000000 вне диапазона -2147483648..2147483647']
+
+
+# Файл с ошибками не сохраняется при загрузке через форму, dry_run проверяет прайс без записи в БД
+@pytest.mark.django_db
+def test_upload_file_validation(shop_client, monkeypatch):
+    monkeypatch.setattr('backend.views.open_url', open_local_url)
+    broken = SimpleUploadedFile('broken.yaml', b'shop: Ozon\ncategories: []\ngoods:\n  - id: 1\n')
+    response = shop_client.post('/api/v1/partner/upload_file/', {'user': shop_client.user.id, 'name': 'Прайс',
+                                                                 'email': shop_client.user.email, 'file': broken},
+                                format='multipart')
+    assert response.status_code == 400
+    assert 'нет поля category' in response.content.decode()
+    assert not UploadFiles.objects.exists()
+
+    response = shop_client.post('/api/v1/partner/update', {'url': 'http://example.com/files/ozon.yaml',
+                                                           'dry_run': 'on'})
+    assert response.json() == {'Status': True, 'rows': 3, 'Errors': []}
+    assert not ImportJob.objects.exists() and not ProductInfo.objects.exists()
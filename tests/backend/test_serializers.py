@@ -0,0 +1,74 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_bakery import baker
+from rest_framework.renderers import JSONRenderer
+
+from backend.basket import refresh_totals
+from backend.benchmark import serialization_case
+from backend.fast_serializers import catalog_entry_columns, catalog_entries_data, product_infos_data, orders_data
+from backend.models import CatalogEntry, ProductInfo, Order, OrderItem
+from backend.serializers import CatalogEntrySerializer, ProductInfoSerializer, OrderSerializer
+from tests.conftest import db_queries
+
+
+def render(data):
+    return JSONRenderer().render(data)
+
+
+# Каталог из двух магазинов по сгенерированным прайсам
+@pytest.fixture
+def catalog(shop_factory):
+    for seed, shop in enumerate(('Магазин 1', 'Магазин 2')):
+        shop_factory(goods=20, shop=shop, seed=seed)
+
+
+# Быстрая сериализация каталога даёт тот же json (байт в байт), что и сериалайзеры DRF
+@pytest.mark.django_db
+def test_fast_catalog_entries(catalog):
+    entries = CatalogEntry.objects.order_by('shop_id', 'pk')
+    product_infos = ProductInfo.objects.published().order_by('shop_id', 'id').select_related(
+        'product').prefetch_related('product_parameters__parameter')
+    fast = render(catalog_entries_data(entries.values(*catalog_entry_columns())))
+    assert fast == render(CatalogEntrySerializer(entries, many=True).data)
+    assert fast == render(ProductInfoSerializer(product_infos, many=True).data)
+    assert render(list(product_infos_data([item.id for item in product_infos]).values())) == \
+           render(ProductInfoSerializer(product_infos, many=True).data)
+
+    fields = ['id', 'price', 'product_parameters']
+    assert render(catalog_entries_data(entries.values(*catalog_entry_columns(fields)), fields)) == \
+           render([{name: item[name] for name in fields} for item in CatalogEntrySerializer(entries, many=True).data])
+
+
+# Быстрая сериализация заказов: тот же json, что у OrderSerializer, и постоянное кол-во запросов
+@pytest.mark.django_db
+def test_fast_orders(catalog, user_factory):
+    user = user_factory()
+    contact = baker.make('backend.Contact', user=user)
+    product_infos = list(ProductInfo.objects.order_by('id'))
+    for state, items, order_contact in (('basket', product_infos[:7], None), ('new', product_infos[10:13], contact),
+                                        ('basket', [], None)):
+        order = Order.objects.create(user=user, state=state, contact=order_contact)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_info=item, quantity=number + 1)
+                                       for number, item in enumerate(items)])
+    orders = Order.objects.filter(user=user)
+    refresh_totals(orders.values_list('id', flat=True))
+    assert sorted(orders.values_list('total_sum', 'items_count')) == sorted([
+        (0, 0), (sum((number + 1) * item.price for number, item in enumerate(product_infos[:7])), 7),
+        (sum((number + 1) * item.price for number, item in enumerate(product_infos[10:13])), 3)])
+    expected = render(OrderSerializer(orders.prefetch_related(
+        'ordered_items__product_info__product__category',
+        'ordered_items__product_info__product_parameters__parameter').select_related('contact'), many=True).data)
+    with CaptureQueriesContext(connection) as queries:
+        fast = render(orders_data(orders))
+    assert fast == expected
+    # без запросов silk (EXPLAIN и сохранение профиля в БД)
+    assert len(db_queries(queries)) == 5
+
+
+# Микробенчмарк сериализации: замеры обоих вариантов для каталога, товаров и заказов
+@pytest.mark.django_db
+def test_serialization_benchmark():
+    result = serialization_case(goods=30, basket_items=5, repeat=1)
+    assert set(result) == {'products', 'product_infos', 'orders'}
+    assert all(case['serializer'] > 0 and case['fast'] > 0 for case in result.values())
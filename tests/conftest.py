@@ -1,7 +1,14 @@
+import io
+
 import pytest
 from rest_framework.test import APIClient
+from rest_framework.throttling import SimpleRateThrottle
 from model_bakery import baker
+from backend.benchmark import generate_price_list
+from backend.importer import PriceListImporter
 from backend.models import User
+from backend.price_list import read_price_list
+from django_diplom.celery import app as celery_app
 
 
 @pytest.fixture
@@ -23,4 +30,42 @@ def contact_factory(user_factory):
     return factory
 
 
+# Задачи celery выполняются сразу (без брокера redis)
+@pytest.fixture
+def celery_eager():
+    broker_url, result_backend = celery_app.conf.broker_url, celery_app.conf.result_backend
+    # Настройки celery берутся из settings.py с префиксом CELERY_
+    celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True, CELERY_BROKER_URL='memory://',
+                           CELERY_RESULT_BACKEND='cache+memory://')
+    yield
+    celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=False, CELERY_BROKER_URL=broker_url,
+                           CELERY_RESULT_BACKEND=result_backend)
+
+
+# Лимиты запросов (throttling) не проверяются (кроме тестов самих лимитов в test_backend_api.py)
+@pytest.fixture
+def no_throttling(monkeypatch):
+    monkeypatch.setattr(SimpleRateThrottle, 'allow_request', lambda self, request, view: True)
+
+
+# Магазин с товарами из сгенерированного прайса (backend/benchmark.py), возвращает менеджера магазина
+@pytest.fixture
+def shop_factory(user_factory):
+    def factory(goods, shop='Магазин', seed=0, user=None):
+        stream = io.StringIO()
+        generate_price_list(stream, goods=goods, categories=3, parameters=5, values=3, shop=shop, seed=seed)
+        stream.seek(0)
+        # user - повторная загрузка прайса магазина этого менеджера (с заменой товаров)
+        user = user or user_factory(type='shop')
+        PriceListImporter(user.id).run(read_price_list(stream))
+        return user
+    return factory
+
 
+def db_queries(context):
+    """
+    Запросы к БД из CaptureQueriesContext без запросов silk (EXPLAIN и сохранение профиля в БД)
+    и точек сохранения транзакций
+    """
+    return [query['sql'] for query in context.captured_queries
+            if 'silk_' not in query['sql'] and not query['sql'].startswith(('EXPLAIN', 'SAVEPOINT', 'RELEASE'))]